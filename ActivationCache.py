@@ -0,0 +1,114 @@
+__author__ = 'Thushan Ganegedara'
+
+import hashlib
+import os
+import numpy as np
+
+# Content addressed on-disk cache for greedy layer-wise pretraining.
+# Encoded features of a layer are stored as .npy files (sample-major, read back memory mapped) under a key made
+# from the dataset identity and the weights of every layer below (see key), so they are reused as long as
+# nothing upstream changed. Trained weights can be stored as well (.npz) under a key made from the input and
+# the layer's hyperparameters, which lets a sweep over one layer skip training the layers below it.
+# Files are evicted least recently used first once the cache grows over max_bytes.
+class ActivationCache(object):
+
+    def __init__(self, cache_dir, max_bytes=4*1024**3):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        if not os.path.exists(cache_dir):
+            os.makedirs(cache_dir)
+
+    # identity of a dataset. A memmap is identified by its file (name, size and modification time),
+    # anything else by hashing its content
+    def dataset_key(self, X):
+        h = hashlib.sha1()
+        h.update(repr((X.shape, str(X.dtype))).encode('utf-8'))
+
+        filename = getattr(X, 'filename', None)
+        if isinstance(X, np.memmap) and filename is not None:
+            filename = os.path.abspath(filename)
+            h.update(repr((filename, os.path.getsize(filename), os.path.getmtime(filename))).encode('utf-8'))
+        else:
+            for sIdx in range(0, X.shape[0], 1000):
+                h.update(np.ascontiguousarray(X[sIdx:sIdx+1000]).tobytes())
+
+        return h.hexdigest()
+
+    # key from any mix of strings, numbers and arrays (e.g. key(input_key, W1, b1) or key(input_key, n_hidden, lam))
+    def key(self, *parts):
+        h = hashlib.sha1()
+        for part in parts:
+            if isinstance(part, np.ndarray):
+                h.update(repr((part.shape, str(part.dtype))).encode('utf-8'))
+                h.update(np.ascontiguousarray(part).tobytes())
+            else:
+                h.update(repr(part).encode('utf-8'))
+        return h.hexdigest()
+
+    def path(self, key, ext):
+        return os.path.join(self.cache_dir, key + ext)
+
+    # memory mapped array stored under key, or None
+    def get(self, key):
+        path = self.path(key, '.npy')
+        if not os.path.exists(path):
+            return None
+        os.utime(path, None)
+        return np.load(path, mmap_mode='r')
+
+    def put(self, key, arr):
+        self.write(self.path(key, '.npy'), lambda f: np.save(f, arr))
+        return self.get(key)
+
+    # features stored under key, computed (by fn) and stored if they are not in the cache
+    def get_or_compute(self, key, fn):
+        arr = self.get(key)
+        if arr is None:
+            print ("Activation cache miss %s" % key)
+            arr = self.put(key, fn())
+        else:
+            print ("Activation cache hit %s" % key)
+        return arr
+
+    # list of parameter arrays stored under key, or None
+    def get_params(self, key):
+        path = self.path(key, '.npz')
+        if not os.path.exists(path):
+            return None
+        os.utime(path, None)
+        with np.load(path) as f:
+            return [f['arr_%d' % i] for i in range(len(f.files))]
+
+    def put_params(self, key, params):
+        self.write(self.path(key, '.npz'), lambda f: np.savez(f, *params))
+
+    # writes to a temporary file and renames it, so an interrupted run never leaves a half written entry
+    def write(self, path, save_fn):
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'wb') as f:
+            save_fn(f)
+        if os.path.exists(path):
+            os.remove(path)
+        os.rename(tmp_path, path)
+        self.evict(keep=path)
+
+    # removes the least recently used entries until the cache is below max_bytes
+    def evict(self, keep=None):
+        entries = []
+        for name in os.listdir(self.cache_dir):
+            path = os.path.join(self.cache_dir, name)
+            if name.endswith('.npy') or name.endswith('.npz'):
+                entries.append((os.path.getmtime(path), os.path.getsize(path), path))
+
+        total = sum(size for _, size, _ in entries)
+        for mtime, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            if path == keep:
+                continue
+            try:
+                os.remove(path)
+                total -= size
+            except OSError:
+                #still memory mapped somewhere (e.g. on Windows), leave it for the next eviction
+                pass
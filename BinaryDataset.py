@@ -0,0 +1,174 @@
+__author__ = 'Thushan Ganegedara'
+
+import numpy as np
+import gzip,cPickle
+import os
+import struct
+import sys,getopt
+
+# Uncompressed binary dataset format, which is memory mapped instead of unpickled.
+# A dataset is stored as three files <prefix>_train.bin, <prefix>_valid.bin and <prefix>_test.bin, each holding
+#   a 64 byte header: magic, version, dtype code, n_samples, n_features, offset of X, offset of y, scale
+#   X: (n_samples, n_features) float32 or uint8, sample-major and C contiguous, starting at a 64 byte boundary
+#   y: (n_samples,) int32 labels, starting at a 64 byte boundary
+# The values of the samples are X*scale (e.g. uint8 pixels are stored with scale 1/255.)
+#
+# Converting (see usage) e.g. MNIST: python BinaryDataset.py --mnist=Data/mnist.pkl.gz -o Data/mnist
+
+MAGIC = b'SAEDATA\0'
+VERSION = 1
+HEADER_FORMAT = '<8sIIQQQQf'
+HEADER_SIZE = 64
+ALIGN = 64
+SPLITS = ['train', 'valid', 'test']
+
+dtype_codes = {np.dtype(np.float32): 0, np.dtype(np.uint8): 1}
+code_dtypes = dict((code, dtype) for dtype, code in dtype_codes.items())
+
+def aligned(offset):
+    return (offset + ALIGN - 1) // ALIGN * ALIGN
+
+def split_path(prefix, split):
+    return prefix + '_' + split + '.bin'
+
+# True if prefix points to a converted dataset
+def has_binary_dataset(prefix):
+    return all(os.path.exists(split_path(prefix, split)) for split in SPLITS)
+
+# writes one split. data_x can be an array or a list of rows and is written in chunks of chunk_size rows
+def write_split(file_path, data_x, data_y, dtype=np.float32, scale=1.0, chunk_size=10000):
+    chunks = ((data_x[sIdx:sIdx+chunk_size], data_y[sIdx:sIdx+chunk_size]) for sIdx in range(0, len(data_x), chunk_size))
+    write_split_batches(file_path, chunks, len(data_x[0]), dtype, scale)
+
+# writes one split from (X, y) batches (any iterable, e.g. a generator converting one file at a time), so the
+# split is never in memory at once. The header is written last, when the number of samples is known
+def write_split_batches(file_path, batches, n_features, dtype=np.float32, scale=1.0):
+    dtype = np.dtype(dtype)
+    x_offset = aligned(HEADER_SIZE)
+
+    dir_name = os.path.dirname(file_path)
+    if dir_name and not os.path.exists(dir_name):
+        os.makedirs(dir_name)
+
+    tmp_path = file_path + '.tmp'
+    n_samples = 0
+    labels = []
+    with open(tmp_path, 'wb') as f:
+        f.write(b'\0' * x_offset)
+        for batch_x, batch_y in batches:
+            batch_x = np.ascontiguousarray(np.asarray(batch_x, dtype=dtype))
+            assert batch_x.shape[1] == n_features
+            f.write(batch_x.tobytes())
+            labels.append(np.asarray(batch_y, dtype=np.int32))
+            n_samples += batch_x.shape[0]
+
+        y_offset = aligned(x_offset + n_samples * n_features * dtype.itemsize)
+        f.write(b'\0' * (y_offset - f.tell()))
+        f.write(np.concatenate(labels).tobytes() if labels else b'')
+
+        f.seek(0)
+        f.write(struct.pack(HEADER_FORMAT, MAGIC, VERSION, dtype_codes[dtype], n_samples, n_features,
+                            x_offset, y_offset, scale))
+
+    if os.path.exists(file_path):
+        os.remove(file_path)
+    os.rename(tmp_path, file_path)
+
+def read_header(file_path):
+    with open(file_path, 'rb') as f:
+        magic, version, code, n_samples, n_features, x_offset, y_offset, scale = \
+            struct.unpack(HEADER_FORMAT, f.read(struct.calcsize(HEADER_FORMAT)))
+
+    if magic != MAGIC or version != VERSION:
+        raise ValueError("%s is not a binary dataset (version %i)" % (file_path, VERSION))
+    return code_dtypes[code], int(n_samples), int(n_features), int(x_offset), int(y_offset), scale
+
+# memory maps one split (nothing is read in to memory), returns X, y and scale
+def load_split(file_path):
+    dtype, n_samples, n_features, x_offset, y_offset, scale = read_header(file_path)
+    data_x = np.memmap(file_path, dtype=dtype, mode='r', offset=x_offset, shape=(n_samples, n_features))
+    data_y = np.memmap(file_path, dtype=np.int32, mode='r', offset=y_offset, shape=(n_samples,))
+    return data_x, data_y, scale
+
+# X*scale in the given dtype. If X is already stored like that the memmap itself is returned (no copy),
+# otherwise it is converted chunk by chunk in to one preallocated array
+def as_float(data_x, scale, dtype=np.float32, chunk_size=10000):
+    if data_x.dtype == dtype and scale == 1.0:
+        return data_x
+
+    out = np.empty(data_x.shape, dtype=dtype)
+    for sIdx in range(0, data_x.shape[0], chunk_size):
+        np.multiply(data_x[sIdx:sIdx+chunk_size], scale, out=out[sIdx:sIdx+chunk_size], casting='unsafe')
+    return out
+
+# [(X, y)] of the given splits (train, valid and test by default) with X*scale in the given dtype (see as_float)
+def load_binary_dataset(prefix, dtype=np.float32, splits=SPLITS):
+    all_data = []
+    for split in splits:
+        data_x, data_y, scale = load_split(split_path(prefix, split))
+        all_data.append((as_float(data_x, scale, dtype), data_y))
+    return all_data
+
+# (X, y) from a pickle holding either a dict with 'data' and 'labels' (CIFAR batches) or a pair [X, y]
+def load_pickled_xy(file_path):
+    with open(file_path, 'rb') as f:
+        obj = cPickle.load(f)
+    if isinstance(obj, dict):
+        return obj.get('data'), obj.get('labels')
+    return obj[0], obj[1]
+
+def convert_mnist(file_path, prefix):
+    f = gzip.open(file_path, 'rb')
+    sets = cPickle.load(f)
+    f.close()
+
+    for split, (data_x, data_y) in zip(SPLITS, sets):
+        write_split(split_path(prefix, split), data_x, data_y)
+        print ("Wrote %s (%i samples)" % (split_path(prefix, split), len(data_x)))
+
+# split_files - list of pickle file lists for train, valid and test (the train list is concatenated)
+def convert_pickled(split_files, prefix, dtype=np.float32, scale=1.0):
+    for split, file_paths in zip(SPLITS, split_files):
+        parts = [load_pickled_xy(file_path) for file_path in file_paths]
+        data_x = np.concatenate([np.asarray(x) for x, y in parts])
+        data_y = np.concatenate([np.asarray(y) for x, y in parts])
+        write_split(split_path(prefix, split), data_x, data_y, dtype, scale)
+        print ("Wrote %s (%i samples)" % (split_path(prefix, split), len(data_x)))
+
+def usage():
+    print ('BinaryDataset.py -o <output_prefix> --mnist=<mnist.pkl.gz>')
+    print ('BinaryDataset.py -o <output_prefix> --train=<f1,f2,..> --valid=<file> --test=<file> [--uint8] [--scale=<s>]')
+    print ('  --uint8 stores 0-255 pixel values as uint8 with scale 1/255. (e.g. the CIFAR-10 batches)')
+    print ('  --scale sets the scale of float32 data (e.g. 0.00392156862745 for the grayscale CIFAR-10 pickles)')
+
+if __name__ == '__main__':
+    try:
+        opts,args = getopt.getopt(sys.argv[1:],"o:",["mnist=","train=","valid=","test=","uint8","scale="])
+    except getopt.GetoptError:
+        usage()
+        sys.exit(2)
+
+    prefix = None
+    mnist = None
+    split_files = {}
+    dtype, scale = np.float32, 1.0
+    for opt,arg in opts:
+        if opt == '-o':
+            prefix = arg
+        elif opt == '--mnist':
+            mnist = arg
+        elif opt in ('--train', '--valid', '--test'):
+            split_files[opt[2:]] = [s.strip() for s in arg.split(',')]
+        elif opt == '--uint8':
+            dtype, scale = np.uint8, 1/255.
+        elif opt == '--scale':
+            scale = float(arg)
+
+    if prefix is None or (mnist is None and len(split_files) != len(SPLITS)):
+        usage()
+        sys.exit(2)
+
+    if mnist is not None:
+        convert_mnist(mnist, prefix)
+    else:
+        convert_pickled([split_files[split] for split in SPLITS], prefix, dtype, scale)
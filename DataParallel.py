@@ -0,0 +1,91 @@
+__author__ = 'Thushan Ganegedara'
+
+import ctypes
+import multiprocessing as mp
+from multiprocessing.sharedctypes import RawArray
+import numpy as np
+
+# Data parallel evaluation of cost/gradient functions with a pool of worker processes.
+# The data (and labels) are copied once in to shared memory and split in to contiguous column shards.
+# For every evaluation the parent writes theta in to shared memory, each worker runs a shard function
+# on its columns and writes its partial sums in to its own row of the shared 'parts' matrix,
+# and the parent reduces the rows. Nothing big is pickled per evaluation and the
+# worker processes are created once and reused for every evaluation until close() is called.
+#
+# A shard function must be a module level function (so it can be pickled by name) with the signature
+#   fn(shared, sIdx, eIdx, row, extra)
+# shared - dict of the shared arrays ('theta', 'parts' and whatever was given in arrays)
+# sIdx, eIdx - column range of the shard, row - row of 'parts' to write the result to
+# extra - any (small) extra argument given to map
+#
+# Note: set OMP_NUM_THREADS / MKL_NUM_THREADS to 1 before starting python when using many workers,
+# otherwise every worker's BLAS starts its own threads as well
+
+def shared_array(shape, dtype):
+    dtype = np.dtype(dtype)
+    raw = RawArray(ctypes.c_char, max(1, int(np.prod(shape))*dtype.itemsize))
+    return raw, tuple(shape), dtype.str
+
+def as_array(raw, shape, dtype):
+    return np.frombuffer(raw, dtype=np.dtype(dtype), count=int(np.prod(shape))).reshape(shape)
+
+#shared arrays of the worker process, set by init_worker
+worker_arrays = {}
+
+def init_worker(specs):
+    for name, (raw, shape, dtype) in specs.items():
+        worker_arrays[name] = as_array(raw, shape, dtype)
+
+def run_shard(args):
+    fn, sIdx, eIdx, row, extra = args
+    fn(worker_arrays, sIdx, eIdx, row, extra)
+    return row
+
+class DataParallelPool(object):
+
+    # arrays - dict of arrays with one example per column (e.g. {'data': X}) or one example per element
+    #          (e.g. {'labels': Y}), all with the same number of examples
+    # theta_size, theta_dtype - size and dtype of the parameter vector
+    # part_size - length of each worker's result row
+    def __init__(self, arrays, theta_size, theta_dtype, part_size, n_procs=None):
+
+        if n_procs is None:
+            n_procs = mp.cpu_count()
+
+        self.n_examples = None
+        specs = {}
+        self.arrays = {}
+        for name, arr in arrays.items():
+            arr = np.asarray(arr)
+            n = arr.shape[-1]
+            assert self.n_examples is None or self.n_examples == n
+            self.n_examples = n
+            specs[name] = shared_array(arr.shape, arr.dtype)
+            self.arrays[name] = as_array(*specs[name])
+            self.arrays[name][...] = arr
+
+        self.n_shards = max(1, min(n_procs, self.n_examples))
+        bounds = np.linspace(0, self.n_examples, self.n_shards+1).astype(np.int64)
+        self.shards = [(int(bounds[i]), int(bounds[i+1])) for i in range(self.n_shards)]
+
+        specs['theta'] = shared_array((theta_size,), theta_dtype)
+        specs['parts'] = shared_array((self.n_shards, part_size), np.float64)
+        self.theta = as_array(*specs['theta'])
+        self.parts = as_array(*specs['parts'])
+
+        self.pool = mp.Pool(processes=n_procs, initializer=init_worker, initargs=(specs,))
+
+    # copies theta in to shared memory (converting it to the shared dtype) and returns the shared copy
+    def set_theta(self, theta):
+        self.theta[...] = theta
+        return self.theta
+
+    # runs fn on every shard and returns the parts matrix (one row per shard)
+    def map(self, fn, extra=None):
+        tasks = [(fn, sIdx, eIdx, row, extra) for row, (sIdx, eIdx) in enumerate(self.shards)]
+        self.pool.map(run_shard, tasks)
+        return self.parts
+
+    def close(self):
+        self.pool.close()
+        self.pool.join()
@@ -8,6 +8,8 @@ import theano.tensor as T
 
 import numpy as np
 
+from TheanoOptimizers import get_optimizer
+
 def identity(x):
     return x
 
@@ -38,7 +40,7 @@ def iterations_shim(func, iterations):
 class Transformer(object):
 
     #__slots__ save memory by allocating memory only to the varibles defined in the list
-    __slots__ = ['layers','_x','_y','_logger']
+    __slots__ = ['layers','_x','_y','_logger','_optimizer','_optimizers']
 
     def __init__(self,layers):
         self.layers = layers
@@ -63,6 +65,51 @@ class Transformer(object):
 
         return theano.function(inputs=[idx],outputs=output, updates=update, givens=given, on_unused_input='warn')
 
+    def set_optimizer(self, name, **params):
+        '''
+        Use the given update rule in the train functions (plain SGD if this is not called)
+        :param name: name of the optimizer (see TheanoOptimizers)
+        :param params: options of the optimizer except the learning rate (e.g. momentum=0.9)
+        :return:
+        '''
+        self._optimizer = (name, params)
+        self._optimizers = {}
+
+    def get_optimizer(self, theta, learning_rate):
+        '''
+        The optimizer of theta, created on the first call and returned again after that, so every train function
+        of theta (e.g. for the batch and the pools) updates the same accumulators
+        :param theta: parameters (shared variables)
+        :param learning_rate: How fast it learns. A number is the initial value of the optimizer's l_rate (a shared
+        variable, which can be changed later with l_rate.set_value for every function of theta), asking for a
+        different number afterwards is a ValueError. A symbolic variable is used as it is
+        :return: the optimizer (see TheanoOptimizers)
+        '''
+        if getattr(self, '_optimizers', None) is None:
+            self._optimizers = {}
+        key = tuple(theta)
+        symbolic = isinstance(learning_rate, theano.Variable)
+        if symbolic:
+            key += (learning_rate,)
+        if key not in self._optimizers:
+            name, params = getattr(self, '_optimizer', ('sgd', {}))
+            self._optimizers[key] = get_optimizer(name, theta, l_rate=learning_rate, **params)
+        elif not symbolic and not np.allclose(self._optimizers[key].l_rate.get_value(), learning_rate):
+            #the l_rate is shared by the functions compiled before, so it is not changed behind their back
+            raise ValueError('The optimizer of these parameters has learning rate %f, not %f (use its l_rate.set_value to change it)'
+                             % (self._optimizers[key].l_rate.get_value(), learning_rate))
+        return self._optimizers[key]
+
+    def get_updates(self, theta, cost, learning_rate):
+        '''
+        Updates of theta for the cost, with the optimizer given to set_optimizer
+        :param theta: parameters (shared variables)
+        :param cost: the cost to minimize (symbolic)
+        :param learning_rate: How fast it learns (see get_optimizer)
+        :return: list of updates for theano.function
+        '''
+        return self.get_optimizer(theta, learning_rate).get_updates(T.grad(cost, wrt=theta))
+
     def process(self, x, y):
         '''
         Visit function with visitor pattern
@@ -150,7 +197,7 @@ class DeepAutoencoder(Transformer):
         return None
 
     def train_func(self, _, learning_rate, x, y, batch_size, transformed_x=identity):
-        updates = [(param, param - learning_rate*grad) for param, grad in zip(self.theta, T.grad(self.cost,wrt=self.theta))]
+        updates = self.get_updates(self.theta, self.cost, learning_rate)
         return self.make_func(x=x,y=y,batch_size=batch_size,output=None, updates=updates, transformed_x=transformed_x)
 
     def indexed_train_func(self, arc, learning_rate, x, batch_size, transformed_x):
@@ -159,6 +206,7 @@ class DeepAutoencoder(Transformer):
         # clone is used to substitute a computational subgraph
         transformed_cost = theano.clone(self.cost, replace={self._x : transformed_x(self._x)})
 
+        # plain SGD on purpose (not get_optimizer), only the columns in nnlayer.idx are stepped and the optimizers keep whole-matrix accumulators
         # find out what happens in this updates list
         updates = [
             (nnlayer.W, T.inc_subtensor(nnlayer.W[:,nnlayer.idx], - learning_rate * T.grad(transformed_cost, nnlayer.W)[:,nnlayer.idx].T)),
@@ -236,7 +284,7 @@ class Softmax(Transformer):
         if iterations is None:
             iterations = self.iterations
 
-        updates = [(param, param - learning_rate*grad) for param, grad in zip(self.theta, T.grad(self.cost,wrt=self.theta))]
+        updates = self.get_updates(self.theta, self.cost, learning_rate)
 
         train = self.make_func(x,y,batch_size,None,updates,transformed_x)
         return iterations_shim(train, iterations)
@@ -340,6 +388,7 @@ class MergeIncrementingAutoencoder(Transformer):
         combined_objective_tune = self._combined_objective.train_func(0, learning_rate, x, y, batch_size)
 
         # set up cost function
+        # stepped with plain SGD like indexed_train_func, the first layer only updates the columns in nnlayer.idx
         mi_cost = self._softmax.cost + self.lam * self._autoencoder.cost
         mi_updates = []
 
@@ -515,7 +564,7 @@ class CombinedObjective(Transformer):
             theta += [layer.W, layer.b, layer.b_prime]
         theta += [self.layers[-1].W, self.layers[-1].b] #softmax layer
 
-        update = [(param, param - learning_rate * grad) for param, grad in zip(theta, T.grad(combined_cost,wrt=theta))]
+        update = self.get_updates(theta, combined_cost, learning_rate)
         func = self.make_func(x, y, batch_size, None, update, transformed_x)
         return iterations_shim(func, iterations)
 
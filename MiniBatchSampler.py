@@ -0,0 +1,93 @@
+__author__ = 'Thushan Ganegedara'
+
+import numpy as np
+
+# Draws mini-batches (columns of X) without replacement.
+# A permutation of the column indices is generated once per epoch and batches are consecutive slices of it,
+# so getting k indices is O(k). Each batch is gathered with one np.take in to a buffer that is allocated once
+# and reused, therefore a returned batch is only valid until the next call to sample/epoch.
+# Sample-major data (one example per row, e.g. a np.memmap) is supported with axis=0, the batch is still
+# returned as a (n_inputs, k) matrix (a transposed view of the row buffer)
+class MiniBatchSampler(object):
+
+    def __init__(self, batch_size, seed=None, dtype=None):
+        self.batch_size = batch_size
+        self.dtype = dtype
+        self.rng = np.random.RandomState(seed)
+
+        self.perm = None
+        self.pos = 0
+        self.buffer = None
+        self.row_buffer = None
+        self.chunk_buffer = None
+
+    def get_dtype(self, X):
+        return X.dtype if self.dtype is None else np.dtype(self.dtype)
+
+    def get_buffer(self, X, batch_size):
+        dtype = self.get_dtype(X)
+        if self.buffer is None or self.buffer.shape[0] != X.shape[0] or self.buffer.shape[1] < batch_size \
+                or self.buffer.dtype != dtype:
+            self.buffer = np.zeros((X.shape[0], batch_size), dtype=dtype)
+        return self.buffer
+
+    def get_row_buffer(self, X, batch_size):
+        dtype = self.get_dtype(X)
+        if self.row_buffer is None or self.row_buffer.shape[1] != X.shape[1] or self.row_buffer.shape[0] < batch_size \
+                or self.row_buffer.dtype != dtype:
+            self.row_buffer = np.zeros((batch_size, X.shape[1]), dtype=dtype)
+        return self.row_buffer
+
+    # axis=1 gathers columns of X, axis=0 rows (sample-major X)
+    def gather(self, X, idx, axis=1):
+        if axis == 1:
+            out = self.get_buffer(X, idx.size)[:, :idx.size]
+            np.take(X, idx, axis=1, out=out)
+            return out
+
+        #sorted row indices make the reads from a memmap go forward through the file
+        out = self.get_row_buffer(X, idx.size)[:idx.size]
+        np.take(X, np.sort(idx), axis=0, out=out)
+        return out.T
+
+    # a random batch of batch_size distinct examples of X
+    # consecutive calls walk through the same permutation, so no example repeats until the epoch is over
+    def sample(self, X, axis=1):
+        n = X.shape[axis]
+        assert self.batch_size <= n
+
+        if self.perm is None or self.perm.size != n or self.pos + self.batch_size > n:
+            self.perm = self.rng.permutation(n)
+            self.pos = 0
+
+        idx = self.perm[self.pos:self.pos+self.batch_size]
+        self.pos += self.batch_size
+        return self.gather(X, idx, axis)
+
+    # generator over one freshly shuffled epoch of X, the last batch may be smaller than batch_size
+    def epoch(self, X, batch_size=None):
+        if batch_size is None:
+            batch_size = self.batch_size
+
+        perm = self.rng.permutation(X.shape[1])
+        for sIdx in range(0, perm.size, batch_size):
+            yield self.gather(X, perm[sIdx:sIdx+batch_size])
+
+    # epoch over sample-major X (e.g. a np.memmap) which only reads contiguous chunks of chunk_size rows
+    # the order of the chunks and the order of the rows inside every chunk are shuffled
+    def chunked_epoch(self, X, chunk_size, batch_size=None):
+        if batch_size is None:
+            batch_size = self.batch_size
+
+        dtype = self.get_dtype(X)
+        if self.chunk_buffer is None or self.chunk_buffer.shape != (chunk_size, X.shape[1]) or self.chunk_buffer.dtype != dtype:
+            self.chunk_buffer = np.zeros((chunk_size, X.shape[1]), dtype=dtype)
+
+        for cIdx in self.rng.permutation(np.arange(0, X.shape[0], chunk_size)):
+            rows = min(chunk_size, X.shape[0] - cIdx)
+            chunk = self.chunk_buffer[:rows]
+            chunk[...] = X[cIdx:cIdx+rows]
+
+            perm = self.rng.permutation(rows)
+            for sIdx in range(0, rows, batch_size):
+                yield self.gather(chunk, perm[sIdx:sIdx+batch_size], axis=0)
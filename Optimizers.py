@@ -0,0 +1,80 @@
+__author__ = 'Thushan Ganegedara'
+
+import numpy as np
+
+# Mini-batch update rules for the NumPy models.
+# All of them work on the flat theta vector (see packTheta) and update it in place,
+# so the same optimizer can be used with any model that can pack its weights in to a vector
+
+class SGD(object):
+
+    def __init__(self, l_rate=0.1):
+        self.l_rate = l_rate
+
+    def update(self, theta, grad):
+        theta -= self.l_rate * grad
+        return theta
+
+class Momentum(object):
+
+    def __init__(self, l_rate=0.1, momentum=0.9):
+        self.l_rate = l_rate
+        self.momentum = momentum
+        self.velocity = None
+
+    def update(self, theta, grad):
+        if self.velocity is None:
+            self.velocity = np.zeros_like(theta)
+
+        self.velocity *= self.momentum
+        self.velocity -= self.l_rate * grad
+        theta += self.velocity
+        return theta
+
+class Nesterov(Momentum):
+
+    # this is the reformulation of Nesterov momentum (Sutskever et al. 2013) which only needs
+    # the gradient at the current theta, theta += -mu*v_prev + (1+mu)*v
+    def update(self, theta, grad):
+        if self.velocity is None:
+            self.velocity = np.zeros_like(theta)
+
+        v_prev = np.copy(self.velocity)
+        self.velocity *= self.momentum
+        self.velocity -= self.l_rate * grad
+        theta += (1 + self.momentum) * self.velocity - self.momentum * v_prev
+        return theta
+
+class Adam(object):
+
+    def __init__(self, l_rate=0.001, beta1=0.9, beta2=0.999, eps=1e-8):
+        self.l_rate = l_rate
+        self.beta1 = beta1
+        self.beta2 = beta2
+        self.eps = eps
+        self.m = None
+        self.v = None
+        self.t = 0
+
+    def update(self, theta, grad):
+        if self.m is None:
+            self.m = np.zeros_like(theta)
+            self.v = np.zeros_like(theta)
+
+        self.t += 1
+        self.m *= self.beta1
+        self.m += (1 - self.beta1) * grad
+        self.v *= self.beta2
+        self.v += (1 - self.beta2) * grad**2
+
+        #bias corrected step size
+        step = self.l_rate * np.sqrt(1 - self.beta2**self.t) / (1 - self.beta1**self.t)
+        theta -= step * self.m / (np.sqrt(self.v) + self.eps)
+        return theta
+
+optimizers = {'sgd': SGD, 'momentum': Momentum, 'nesterov': Nesterov, 'adam': Adam}
+
+def get_optimizer(name, **kwargs):
+    if name not in optimizers:
+        raise ValueError("Unknown optimizer '%s', use one of %s" % (name, sorted(optimizers.keys())))
+    return optimizers[name](**kwargs)
@@ -0,0 +1,64 @@
+__author__ = 'Thushan Ganegedara'
+
+import numpy as np
+
+# reshaped views of a flat vector holding arrays of the given shapes one after the other
+# (this is also used by worker processes, which only get the shapes and not the ParamStore)
+def split_views(vec, shapes):
+    views = []
+    sIdx = 0
+    for shape in shapes:
+        size = int(np.prod(shape))
+        views.append(vec[sIdx:sIdx+size].reshape(shape))
+        sIdx += size
+    return views
+
+# Keeps all the parameters of a model in one contiguous vector (theta) and the gradients in a second one (grad)
+# The weight matrices and bias vectors are reshaped views of these vectors, so changing theta changes
+# the weights (and vice versa) without packing/unpacking, and gradients can be written in place
+class ParamStore(object):
+
+    # shapes - list of parameter shapes in the order they appear in theta, e.g. [(n_hidden,n_inputs),(n_hidden,)]
+    def __init__(self, shapes, dtype=np.float64):
+        self.shapes = [tuple(shape) for shape in shapes]
+        self.sizes = [int(np.prod(shape)) for shape in self.shapes]
+        self.offsets = np.concatenate(([0], np.cumsum(self.sizes))).astype(np.int64)
+        self.size = int(self.offsets[-1])
+        self.dtype = np.dtype(dtype)
+
+        self.theta = np.zeros((self.size,), dtype=self.dtype)
+        self.grad = np.zeros((self.size,), dtype=self.dtype)
+
+        #vectors of another dtype (scipy always passes float64) are converted in to this buffer
+        self.cast_buffer = np.zeros((self.size,), dtype=self.dtype)
+
+    # reshaped views of vec, which can be theta, grad or any vector with the same layout (e.g. the one scipy passes)
+    def views(self, vec):
+        assert vec.size == self.size
+        return split_views(vec, self.shapes)
+
+    # vec in the dtype of the store. Returns vec itself if it already has the right dtype,
+    # otherwise a copy in cast_buffer (valid until the next call)
+    def cast(self, vec):
+        if vec.dtype == self.dtype:
+            return vec
+        self.cast_buffer[...] = vec
+        return self.cast_buffer
+
+    def params(self):
+        return self.views(self.theta)
+
+    def grads(self):
+        return self.views(self.grad)
+
+    # copy the given arrays in to theta
+    def set_params(self, values):
+        for view, value in zip(self.params(), values):
+            view[...] = value
+
+    # copy the given arrays in to a new vector with the same layout as theta
+    def pack(self, values):
+        vec = np.empty((self.size,), dtype=self.dtype)
+        for view, value in zip(self.views(vec), values):
+            view[...] = value
+        return vec
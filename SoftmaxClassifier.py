@@ -1,10 +1,39 @@
 __author__ = 'Thushan Ganegedara'
 
 from math import sqrt
-from math import isnan,isinf
 import numpy as np
 from scipy import optimize
 import numpy.linalg as LA
+from ParamStore import ParamStore, split_views
+from DataParallel import DataParallelPool
+
+# log of the softmax of every column of z (z is modified in place)
+# the max of every column is subtracted before exponentiating (log-sum-exp), so large logits
+# cannot overflow to inf/nan
+def log_softmax(z):
+    z -= np.max(z, axis=0)
+    z -= np.log(np.sum(np.exp(z), axis=0))
+    return z
+
+# Shard function run by the DataParallelPool workers (see parallel_cost_and_grad)
+# writes the summed gradient of the shard (without weight decay) followed by the summed negative log likelihood
+def shard_cost_and_grad(shared, sIdx, eIdx, row, shapes):
+    W1, b1 = split_views(shared['theta'], shapes)
+    x = shared['data'][:, sIdx:eIdx]
+    labels = shared['labels'][sIdx:eIdx]
+    cols = np.arange(eIdx - sIdx)
+
+    log_p = log_softmax(np.dot(W1, x) + b1[:, None])
+
+    delta = np.exp(log_p)
+    delta[labels, cols] -= 1.0
+
+    part = shared['parts'][row]
+    d_W1, d_b1 = split_views(part[:-1], shapes)
+    d_W1[...] = np.dot(delta, x.T)
+    d_b1[...] = np.sum(delta, axis=1)
+    part[-1] = -np.sum(log_p[labels, cols])
+
 class SoftmaxClassifier(object):
 
     def sigmoid(self, x):
@@ -25,36 +54,45 @@ class SoftmaxClassifier(object):
         if W1 == None:
             val_range1 = [0, 2*sqrt(6.0/(n_inputs+n_outputs+1))]
             W1 = np.random.random_sample((n_outputs, n_inputs))*0.2
-            self.W1 = W1
 
 
         #by introducing *0.05 to b1 initialization got an error dropoff from 360 -> 280
         if b1 == None:
             b1 = np.random.random_sample((n_outputs,)) * 0.2
-            self.b1 = b1
+
+        #W1 and b1 are views of the flat vector self.params.theta, gradients are written in to self.params.grad
+        self.params = ParamStore([(n_outputs, n_inputs), (n_outputs,)])
+        self.params.set_params([W1, b1])
+        self.W1, self.b1 = self.params.params()
+
+        #worker pool for parallel_cost_and_grad (created by start_pool)
+        self.pool = None
 
 
     def forward_pass(self, x, W1, b1):
+        return self.forward_pass_for_batch(x[:, None], W1, b1)[:, 0]
 
-        x_bias = np.concatenate((x,np.array([1])),axis=0)
-        theta_mat = self.getThetaMatrix(W1,b1)
+    # log of the softmax output for a whole batch (one example per column of X)
+    def log_softmax_for_batch(self, X, W1, b1):
+        return log_softmax(np.dot(W1, X) + b1[:, None])
 
-        top = np.exp(np.dot(theta_mat,x_bias))
-        bottom = np.sum(top)
+    def forward_pass_for_batch(self, X, W1, b1):
+        return np.exp(self.log_softmax_for_batch(X, W1, b1))
 
-        return top/bottom
+    # class probabilities (n_outputs x number of examples) for X using the current weights
+    def predict_proba(self, X):
+        return self.forward_pass_for_batch(X, self.W1, self.b1)
+
+    # predicted labels (5,4,9.. form) for every column of X
+    def predict(self, X):
+        return np.argmax(self.log_softmax_for_batch(X, self.W1, self.b1), axis=0)
 
     def packTheta(self, W1, b1):
-        theta = np.concatenate((np.reshape(W1, (self.n_outputs*self.n_inputs,)), b1))
-        return theta
+        return self.params.pack([W1, b1])
 
+    #W1, b1 returned are views of theta (no copying)
     def unpackTheta(self, theta):
-        sIdx = 0
-        W1 = np.reshape(theta[sIdx:self.n_inputs*self.n_outputs], (self.n_outputs, self.n_inputs))
-        sIdx = self.n_outputs*self.n_inputs
-        b1 = np.reshape(theta[sIdx:sIdx+self.n_outputs],(self.n_outputs,))
-
-        return W1, b1
+        return self.params.views(theta)
 
     def getThetaMatrix(self, W1, b1):
         theta_mat =  np.append(W1,b1[:,None],axis=1)
@@ -73,32 +111,14 @@ class SoftmaxClassifier(object):
     def cost(self, theta,data,labels, lam=0.5):
 
         W1, b1 = self.unpackTheta(theta)
-        tot_err = 0.0
+        labels = np.asarray(labels, dtype=np.int64)
         size_data = data.shape[1]
 
-        test = np.sum(data,axis=1)
-        for idx in range(size_data):
-            x = data[:, idx]
-            x_bias = np.concatenate((x,np.array([1])),axis=0)
-
-            y = labels[idx]
+        log_p = self.log_softmax_for_batch(data, W1, b1)
+        tot_err = -np.sum(log_p[labels, np.arange(size_data)])/size_data
 
-            theta_mat = self.getThetaMatrix(W1,b1)
-            theta_k = theta_mat[y,:]
-            tmp = np.dot(theta_k,x_bias)
-            log_top = np.exp(tmp)
-            tmp3 = np.exp(np.dot(theta_mat,x_bias))
-            log_bottom = np.sum(tmp3)
-
-            if log_bottom == 0. or isnan(log_bottom) or isinf(log_bottom):
-                print "test"
-
-            tmp2 = np.log(log_top/log_bottom)
-            err = -np.sum(tmp2)
-
-            tot_err += err
-
-        tot_err = tot_err/size_data + (lam/2)*np.sum(np.sum(theta_mat**2))
+        #bias is included in the weight decay (same as using the theta matrix [W1 | b1])
+        tot_err += (lam/2)*(np.sum(W1**2) + np.sum(b1**2))
 
         return tot_err
 
@@ -106,82 +126,108 @@ class SoftmaxClassifier(object):
     # In other words this is dC/dW in the delta rule (i.e. W = W - alpha*dC/dW)
     # make sure to send 5,4,9.. type of values for the 'labels', not the vectorized form
     def cost_prime(self, theta, data, labels, lam=0.5):
+        return self.cost_and_grad(theta, data, labels, lam)[1]
 
-        W1, b1 = self.unpackTheta(theta)
+    # fused objective for optimize.minimize(..., jac=True)
+    # the batch is fed forward once for both the cost and the gradient
+    # the gradient is written in to self.params.grad (same layout as theta), so the returned
+    # vector is overwritten by the next call
+    def cost_and_grad(self, theta, data, labels, lam=0.5):
+        return self.cost_grad_and_delta(theta, data, labels, lam)[:2]
 
-        d_theta = np.zeros((self.n_outputs, self.n_inputs+1), dtype=np.float32)
+    # cost_and_grad, and the output error delta = p - y (one column per example) of the same forward pass
+    def cost_grad_and_delta(self, theta, data, labels, lam=0.5):
 
+        W1, b1 = self.unpackTheta(theta)
+        labels = np.asarray(labels, dtype=np.int64)
         size_data = data.shape[1]
-        for idx in range(size_data):
-            x = data[:,idx]
-            x_bias = np.concatenate((x,np.array([1])),axis=0)
-
-            y = labels[idx]
-            y_vec = [0.0] * self.n_outputs
-            y_vec[y] = 1.0
-
-            theta_mat = self.getThetaMatrix(W1, b1)
-
-            W1,b1 = self.getWeightsAndBias(theta_mat)
-
-            topDevBottom = self.forward_pass(x,W1,b1)[y]
+        cols = np.arange(size_data)
 
-            delta = np.asarray(y_vec,dtype=np.float32)
-            delta[y,None] = delta[y,None]-topDevBottom
+        log_p = self.log_softmax_for_batch(data, W1, b1)
+        tot_err = -np.sum(log_p[labels, cols])/size_data + (lam/2)*(np.sum(W1**2) + np.sum(b1**2))
 
-            tmp_arr = np.dot(delta[:, None], np.transpose(x_bias[:, None]))
-            d_theta = d_theta + tmp_arr
+        #delta = p - y, where y is the one hot label. Subtracting 1 at the label index avoids building y
+        delta = np.exp(log_p)
+        delta[labels, cols] -= 1.0
 
-        d_theta = -((1.0/size_data) * d_theta) + lam*theta_mat
+        d_W1, d_b1 = self.params.grads()
+        np.dot(delta, data.T, out=d_W1)
+        d_W1 *= 1.0/size_data
+        d_W1 += lam*W1
+        np.sum(delta, axis=1, out=d_b1)
+        d_b1 *= 1.0/size_data
+        d_b1 += lam*b1
 
-        return np.reshape(d_theta,(self.n_outputs*(self.n_inputs+1),))
+        return tot_err, self.params.grad, delta
 
-    def back_prop(self, iter=1000):
-        init_val = self.packTheta(self.W1, self.b1)
+    # n_procs - if given, cost and gradient are calculated by n_procs worker processes (see parallel_cost_and_grad)
+    def back_prop(self, iter=1000, n_procs=None):
+        init_val = self.params.theta
         #err = optimize.check_grad(self.cost, self.cost_prime, init_val, self.X,self.Y)
-        res = optimize.minimize(fun=self.cost, x0=init_val, args=(self.X,self.Y,0.0001), jac=self.cost_prime, method='L-BFGS-B', options={'maxiter':iter,'disp':True})
-        self.W1, self.b1 = self.unpackTheta(res.x)
+        if n_procs is None:
+            res = optimize.minimize(fun=self.cost_and_grad, x0=init_val, args=(self.X,self.Y,0.0001), jac=True, method='L-BFGS-B', options={'maxiter':iter,'disp':True})
+        else:
+            self.start_pool(n_procs)
+            try:
+                res = optimize.minimize(fun=self.parallel_cost_and_grad, x0=init_val, args=(0.0001,), jac=True, method='L-BFGS-B', options={'maxiter':iter,'disp':True})
+            finally:
+                self.close_pool()
+        self.params.theta[...] = res.x
 
         #print ("Error (check_grad): %f" %err)
 
-    def back_prop_man(self, iter=1000, alpha=0.5, lam =0.0001):
+    # plain (full batch) gradient descent
+    # start_iter - iteration to continue from (when resuming from a checkpoint)
+    # callback - called with the iteration number after every update
+    def back_prop_man(self, iter=1000, alpha=0.5, lam =0.0001, start_iter=0, callback=None):
 
-        theta_mat = self.getThetaMatrix(self.W1, self.b1)
+        labels = np.asarray(self.Y, dtype=np.int64)
 
-        for i in range(iter):
+        for i in range(start_iter, iter):
 
-            d_theta = np.zeros((self.n_outputs, self.n_inputs+1), dtype=np.float32)
-            size_data = self.X.shape[1]
-            tot_err = 0.0
+            #the printed error and the gradient come from the same forward pass
+            err, grad, delta = self.cost_grad_and_delta(self.params.theta, self.X, labels, lam)
 
-            for idx in range(size_data):
-                x = self.X[:,idx]
-                x_bias = np.concatenate((x,np.array([1])),axis=0)
+            #error is the average norm of (y - p), y being the one hot label
+            tot_err = np.mean(np.sqrt(np.sum(delta**2, axis=0)))
+            print ("Iteration: %i, Error: %f"%(i,tot_err))
 
-                y = self.Y[idx]
-                y_vec = [0.0] * self.n_outputs
-                y_vec[y] = 1.0
+            #W1 and b1 are views of params.theta, so this updates them in place
+            self.params.theta -= alpha*grad
 
-                W1,b1 = self.getWeightsAndBias(theta_mat)
-                topDevBottom = self.forward_pass(x,W1,b1)
+            if callback is not None:
+                callback(i)
 
-                delta = np.asarray(y_vec,dtype=np.float32)
-                delta = delta-topDevBottom
-                err = LA.norm(delta)
-                tot_err = tot_err + err
+    # copies self.X and self.Y in to shared memory and starts n_procs workers, which are reused by every
+    # parallel_cost_and_grad call until close_pool
+    def start_pool(self, n_procs=None):
+        self.close_pool()
+        arrays = {'data': self.X, 'labels': np.asarray(self.Y, dtype=np.int64)}
+        self.pool = DataParallelPool(arrays, self.params.size, self.params.dtype, self.params.size+1, n_procs)
 
-                tmp_arr = np.dot(delta[:, None], np.transpose(x_bias[:, None]))
-                d_theta = d_theta + tmp_arr
+    def close_pool(self):
+        if self.pool is not None:
+            self.pool.close()
+            self.pool = None
 
-            d_theta = -((1.0/size_data) * d_theta) + (lam*theta_mat)
-            tot_err = (1.0/size_data)*tot_err
-            print ("Iteration: %i, Error: %f"%(i,tot_err))
-            theta_mat = theta_mat - (alpha*d_theta)
+    # same as cost_and_grad(theta, self.X, self.Y, lam), but the columns of X are split across the worker pool
+    def parallel_cost_and_grad(self, theta, lam=0.5):
+
+        theta = self.pool.set_theta(theta)
+        W1, b1 = self.unpackTheta(theta)
+        size_data = self.pool.n_examples
+
+        parts = self.pool.map(shard_cost_and_grad, self.params.shapes)
 
+        tot_err = np.sum(parts[:, -1])/size_data + (lam/2)*(np.sum(W1**2) + np.sum(b1**2))
 
-        self.W1 = theta_mat[:,0:theta_mat.shape[1]-1]
-        self.b1 = theta_mat[:,theta_mat.shape[1]-1]
+        np.sum(parts[:, :-1], axis=0, out=self.params.grad)
+        self.params.grad *= 1.0/size_data
+        d_W1, d_b1 = self.params.grads()
+        d_W1 += lam*W1
+        d_b1 += lam*b1
 
+        return tot_err, self.params.grad
 
     def get_params(self):
         return self.W1,self.b1
\ No newline at end of file
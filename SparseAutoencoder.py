@@ -8,6 +8,45 @@ from scipy import optimize
 from scipy import misc
 from numpy import linalg as LA
 from PIL import Image
+from Optimizers import get_optimizer
+from MiniBatchSampler import MiniBatchSampler
+from ParamStore import ParamStore, split_views
+from DataParallel import DataParallelPool
+
+# Partial sums over a block of columns x. These are used by the DataParallelPool workers
+# (see parallel_cost_and_grad) and by the chunked objective for sample-major data (see chunked_cost_and_grad).
+# The caller does the averaging and adds the weight decay
+
+# sum of the hidden activations over the columns of x
+def hidden_sum(W1, b1, x):
+    a2 = 1.0 / (1.0 + np.exp(-(np.dot(W1, x) + b1[:, None])))
+    return np.sum(a2, axis=1)
+
+# summed gradients over the columns of x (without weight decay) followed by the summed squared error,
+# written in to out (a vector with one element more than theta)
+# d_kl is beta * derivative of the KL divergence, calculated from the rho_nh of all the data
+def grad_sums(W1, b1, W2, b2, x, d_kl, out):
+    a2 = 1.0 / (1.0 + np.exp(-(np.dot(W1, x) + b1[:, None])))
+    a3 = 1.0 / (1.0 + np.exp(-(np.dot(W2, a2) + b2[:, None])))
+
+    delta3 = -(x - a3) * a3 * (1.0 - a3)
+    delta2 = (np.dot(W2.T, delta3) + d_kl[:, None]) * a2 * (1.0 - a2)
+
+    d_W1, d_b1, d_W2, d_b2 = split_views(out[:-1], [W1.shape, b1.shape, W2.shape, b2.shape])
+    d_W1[...] = np.dot(delta2, x.T)
+    d_b1[...] = np.sum(delta2, axis=1)
+    d_W2[...] = np.dot(delta3, a2.T)
+    d_b2[...] = np.sum(delta3, axis=1)
+    out[-1] = np.sum((a3-x)**2, dtype=np.float64)
+
+def shard_hidden_sum(shared, sIdx, eIdx, row, shapes):
+    W1, b1, W2, b2 = split_views(shared['theta'], shapes)
+    shared['parts'][row, :b1.size] = hidden_sum(W1, b1, shared['data'][:, sIdx:eIdx])
+
+def shard_grad(shared, sIdx, eIdx, row, extra):
+    shapes, d_kl = extra
+    W1, b1, W2, b2 = split_views(shared['theta'], shapes)
+    grad_sums(W1, b1, W2, b2, shared['data'][:, sIdx:eIdx], d_kl, shared['parts'][row])
 
 class SparseAutoencoder(object):
 
@@ -34,8 +73,23 @@ class SparseAutoencoder(object):
     #__init__ is called when the constructor of an object is called (i.e. created an object)
 
     #by reducing number of hidden from 400 -> 75 and hidden2 200 -> 25 got an error reduction of 540+ -> 387 (for numbers dataset)
-    def __init__(self, n_inputs, n_hidden, X, W1=None, W2=None, b1=None, b2=None, m_batch_size=30):
-        self.X = X
+    #dtype is the compute dtype. weights, gradients, data and mini-batches are all kept in this dtype
+    #so nothing gets upcast to float64 in the matrix products
+    #X is either an in-memory (n_inputs, n_examples) matrix, or sample-major (n_examples, n_inputs) data
+    #(a np.memmap, a .npy file name which is opened with mmap_mode='r', or any array with sample_major=True)
+    #sample-major data is never loaded as a whole, it is read in chunks of chunk_size rows
+    def __init__(self, n_inputs, n_hidden, X, W1=None, W2=None, b1=None, b2=None, m_batch_size=30, seed=None, dtype=np.float32,
+                 sample_major=False, chunk_size=1000):
+        self.dtype = np.dtype(dtype)
+
+        if isinstance(X, str):
+            X = np.load(X, mmap_mode='r')
+        self.sample_major = sample_major or isinstance(X, np.memmap)
+        self.chunk_size = chunk_size
+        if self.sample_major:
+            self.X = X
+        else:
+            self.X = np.asarray(X, dtype=self.dtype)
 
         #define global variables for n_inputs and n_hidden
         self.n_hidden = n_hidden
@@ -43,33 +97,44 @@ class SparseAutoencoder(object):
         self.n_outputs = n_inputs
 
         self.m_batch_size = m_batch_size
-        self.min_batch_X = np.zeros((n_inputs, m_batch_size), dtype=np.float32)
+        self.min_batch_X = np.zeros((n_inputs, m_batch_size), dtype=self.dtype)
+        self.sampler = MiniBatchSampler(m_batch_size, seed=seed, dtype=self.dtype)
 
         self.lam = 0.0001
         self.beta = 0.1
         self.rho = 0.3
 
-        self.rho_nh = np.zeros((self.n_hidden,),dtype=np.float32)
+        self.rho_nh = np.zeros((self.n_hidden,),dtype=self.dtype)
+
+        #activations of the last (theta, data) pair, so cost and cost_prime share one forward pass
+        self.cache_theta = None
+        self.cache_data = None
+        self.cache_act = None
+
+        #worker pool for parallel_cost_and_grad (created by start_pool)
+        self.pool = None
 
         #generate random weights for W
         if W1 == None:
             val_range1 = [-math.sqrt(6.0/(n_inputs+n_hidden+1)), math.sqrt(6.0/(n_inputs+n_hidden+1))]
             W1 = val_range1[0] + np.random.random_sample((n_hidden, n_inputs))*2.0*val_range1[1]
-            self.W1 = W1
 
         if W2 == None:
             val_range2 = [-math.sqrt(24.0/(self.n_outputs+n_hidden+1)), math.sqrt(24.0/(self.n_outputs+n_hidden+1))]
             W2 = val_range2[0] + np.random.random_sample((self.n_outputs, n_hidden))*2.0*val_range2[1]
-            self.W2 = W2
 
         #by introducing *0.05 to b1 initialization got an error dropoff from 360 -> 280
         if b1 == None:
             b1 = -0.01 + np.random.random_sample((n_hidden,)) * 0.02
-            self.b1 = b1
 
         if b2 == None:
             b2 = -0.02 + np.random.random_sample((self.n_outputs,)) * 0.04
-            self.b2 = b2
+
+        #all the weights live in one flat vector (self.params.theta) and W1, b1, W2, b2 are views of it
+        #gradients are written in to self.params.grad
+        self.params = ParamStore([(n_hidden, n_inputs), (n_hidden,), (self.n_outputs, n_hidden), (self.n_outputs,)], dtype=self.dtype)
+        self.params.set_params([W1, b1, W2, b2])
+        self.W1, self.b1, self.W2, self.b2 = self.params.params()
 
 
     def load_data(self):
@@ -81,22 +146,17 @@ class SparseAutoencoder(object):
             imgVec = np.reshape(img, (810, 1))
             self.X[:, i-1] = imgVec[:, 0]
 
-        self.X = self.X/255.0
+        self.X = np.asarray(self.X/255.0, dtype=self.dtype)
         #mean_X = np.mean(self.X, axis=0)
         #for i in range(self.X.shape[1]):
         #    self.X[:,i] = self.X[:,i]-mean_X[i,]
 
     def renew_dataset(self):
-        sel_idx = []
-        tmp_data = np.zeros((self.X.shape[0],self.m_batch_size),dtype=np.float32)
-        for dIdx in range(self.m_batch_size):
-            while True:
-                tmp_idx = np.random.randint(self.X.shape[1])
-                if tmp_idx not in sel_idx:
-                    sel_idx.append(tmp_idx)
-                    tmp_data[:, dIdx] = self.X[:, tmp_idx]
-                    break
-        return tmp_data
+        #the sampler reuses its buffer, so activations cached for the previous batch are not valid anymore
+        self.cache_data = None
+        if self.sample_major:
+            return self.sampler.sample(self.X, axis=0)
+        return self.sampler.sample(self.X)
 
     def forward_pass_for_one_case(self, x, W1, b1, W2, b2):
 
@@ -108,23 +168,42 @@ class SparseAutoencoder(object):
 
         return a2, a3
 
+    #same as forward_pass_for_one_case but X holds one example per column,
+    #so the whole batch goes through the network as two matrix products
+    def forward_pass_for_batch(self, X, W1, b1, W2, b2):
+
+        z2 = np.dot(W1, X) + b1[:, None]
+        a2 = self.sigmoid(z2)
+
+        z3 = np.dot(W2, a2) + b2[:, None]
+        a3 = self.sigmoid(z3)
+
+        return a2, a3
+
+    #returns the batch activations for theta, reusing the cached ones if theta and data are unchanged
+    def forward_pass_cached(self, theta, data):
+        if self.cache_data is not data or not np.array_equal(self.cache_theta, theta):
+            W1, b1, W2, b2 = self.unpackTheta(theta)
+            self.cache_act = self.forward_pass_for_batch(data, W1, b1, W2, b2)
+            if self.cache_theta is None:
+                self.cache_theta = np.empty_like(theta)
+            self.cache_theta[...] = theta
+            self.cache_data = data
+
+        return self.cache_act
+
+    #average activation of each hidden unit
+    #the first 0.001 keeps the average activation away from zero (same as the per example version)
+    def avg_activation(self, a2):
+        return (0.001 + np.sum(a2, axis=1))/a2.shape[1]
+
     def packTheta(self, W1, b1, W2, b2):
-        theta_p1 = np.concatenate((np.reshape(W1, (self.n_hidden*self.n_inputs,)), b1))
-        theta_p2 = np.concatenate((np.reshape(W2, (self.n_outputs*self.n_hidden,)), b2))
-        theta = np.concatenate((theta_p1,theta_p2))
-        return theta
+        return self.params.pack([W1, b1, W2, b2])
 
+    #W1, b1, W2, b2 returned are views of theta (no copying), unless theta is not in the compute dtype
+    #(scipy passes float64), in which case it is converted once in to the ParamStore's cast buffer
     def unpackTheta(self, theta):
-        sIdx = 0
-        W1 = np.reshape(theta[sIdx:self.n_inputs*self.n_hidden], (self.n_hidden, self.n_inputs))
-        sIdx = self.n_hidden*self.n_inputs
-        b1 = np.reshape(theta[sIdx:sIdx+self.n_hidden],(self.n_hidden,))
-        sIdx = sIdx + self.n_hidden
-        W2 = np.reshape(theta[sIdx:sIdx + self.n_outputs*self.n_hidden],(self.n_outputs,self.n_hidden))
-        sIdx = sIdx + self.n_outputs*self.n_hidden
-        b2 = np.reshape(theta[sIdx:],(self.n_outputs,))
-
-        return W1, b1, W2, b2
+        return self.params.views(self.params.cast(theta))
 
     # cost calculate the cost you get given all the inputs feed forward through the network
     # at the moment I am using the squared error between the reconstructed and the input
@@ -133,58 +212,65 @@ class SparseAutoencoder(object):
     def cost(self, theta,data):
 
         W1, b1, W2, b2 = self.unpackTheta(theta)
-        tot_sqr_err = 0.0
+        data = np.asarray(data, dtype=self.dtype)
         size_data = data.shape[1]
 
-        self.rho_nh = np.ones((self.n_hidden,),dtype=np.float32)*0.001
+        a2, a3 = self.forward_pass_cached(theta, data)
 
-        for idx in range(size_data):
-            x = data[:, idx]
-            a2, a3 = self.forward_pass_for_one_case(x, W1, b1, W2, b2)
-            self.rho_nh = self.rho_nh + a2
-            sqr_err = 0.5 * np.sum((a3-x)**2) + (self.lam/2)*np.sum(np.sum(W1**2,axis=1),axis=0) + (self.lam/2)*np.sum(np.sum(W2**2,axis=1), axis=0)
-            tot_sqr_err += sqr_err
+        self.rho_nh = self.avg_activation(a2)
 
-        self.rho_nh = self.rho_nh/size_data
-        tot_err = tot_sqr_err/size_data + self.beta*np.sum(self.kl_diverg(self.rho,self.rho_nh))
+        #the sums are accumulated in float64 so L-BFGS gets a precise enough cost with float32 activations
+        sqr_err = 0.5 * np.sum((a3-data)**2, dtype=np.float64)/size_data
+        w_decay = (self.lam/2)*(np.sum(W1**2, dtype=np.float64) + np.sum(W2**2, dtype=np.float64))
+        tot_err = sqr_err + w_decay + self.beta*np.sum(self.kl_diverg(self.rho,self.rho_nh), dtype=np.float64)
 
-        return tot_err
+        return float(tot_err)
 
     # Cost prime is the gradient of the cost function.
     # In other words this is dC/dW in the delta rule (i.e. W = W - alpha*dC/dW)
+    # rho_nh is calculated from the activations of theta, so this does not depend on cost being called first
     def cost_prime(self,theta,data):
 
-        #if all the elements of rho_nh are zero, initialize the array with the given value
-        if all(rho_j==0. for rho_j in self.rho_nh):
-            self.rho_nh = np.ones((self.n_hidden,), dtype=np.float32)*0.001
-
         W1, b1, W2, b2 = self.unpackTheta(theta)
+        data = np.asarray(data, dtype=self.dtype)
+
+        a2, a3 = self.forward_pass_cached(theta, data)
+        self.rho_nh = self.avg_activation(a2)
+
+        return self.grad_from_activations(W1, W2, data, a2, a3, self.rho_nh)
 
-        d_W1 = np.zeros((self.n_hidden, self.n_inputs), dtype=np.float32)
-        d_b1 = np.zeros((self.n_hidden,), dtype=np.float32)
-        d_W2 = np.zeros((self.n_outputs, self.n_hidden), dtype=np.float32)
-        d_b2 = np.zeros((self.n_outputs, ), dtype=np.float32)
+    # gradient for a batch whose activations (a2, a3) are already calculated
+    # rho_nh is passed in so mini-batch training can use a running estimate instead of the batch average
+    def grad_from_activations(self, W1, W2, data, a2, a3, rho_nh):
 
         size_data = data.shape[1]
-        for idx in range(size_data):
-            x = data[:,idx]
-            a2, a3 = self.forward_pass_for_one_case(x, W1, b1, W2, b2)
 
-            delta3 = -(x - a3) * self.dsigmoid(a3)
-            delta2 = (np.dot(np.transpose(W2), delta3)+self.beta*self.d_kl_diverg(self.rho,self.rho_nh)) * self.dsigmoid(a2)
+        #delta3 and delta2 hold one column per example
+        delta3 = -(data - a3) * self.dsigmoid(a3)
+        delta2 = (np.dot(W2.T, delta3) + self.beta*self.d_kl_diverg(self.rho,rho_nh)[:, None]) * self.dsigmoid(a2)
 
-            d_W2 = d_W2 + np.dot(delta3[:, None], np.transpose(a2[:, None]))
-            d_b2 = d_b2 + delta3
+        #gradients are written in place in to self.params.grad, which is what gets returned
+        #so the returned vector is overwritten by the next call
+        d_W1, d_b1, d_W2, d_b2 = self.params.grads()
 
-            d_W1 = d_W1 + np.dot(delta2[:, None], np.transpose(x[:, None]))
-            d_b1 = d_b1 + delta2
+        np.dot(delta3, a2.T, out=d_W2)
+        d_W2 *= 1.0/size_data
+        d_W2 += self.lam * W2
+        np.sum(delta3, axis=1, out=d_b2)
+        d_b2 *= 1.0/size_data
 
-        d_W2 = ((1.0/size_data) * d_W2) + (self.lam * W2)
-        d_b2 = (1.0/size_data) * d_b2
-        d_W1 = ((1.0/size_data) * d_W1) + (self.lam * W1)
-        d_b1 = (1.0/size_data) * d_b1
+        np.dot(delta2, data.T, out=d_W1)
+        d_W1 *= 1.0/size_data
+        d_W1 += self.lam * W1
+        np.sum(delta2, axis=1, out=d_b1)
+        d_b1 *= 1.0/size_data
 
-        return self.packTheta(d_W1, d_b1, d_W2, d_b2)
+        return self.params.grad
+
+    # fused objective for optimize.minimize(..., jac=True)
+    # cost and gradient come from the same forward pass
+    def cost_and_grad(self, theta, data):
+        return self.cost(theta, data), self.cost_prime(theta, data)
 
     # back_propagation method uses Scipy optimize.minimize method to optimize Theta
     # fun - Cost function, x0 - initial Theta value, jac - gradient of cost function, method - optimization technique
@@ -196,18 +282,199 @@ class SparseAutoencoder(object):
     # Nact  = number of active bounds at final generalized Cauchy point
     # Projg = norm of the final projected gradient
     # F     = final function value '''
-    def back_prop_with_SGD(self, iter=1500):
-        #m_b_data = self.renew_dataset()
-        init_val = self.packTheta(self.W1,self.b1,self.W2,self.b2)
-        res = optimize.minimize(fun=self.cost, x0=init_val, args=(self.renew_dataset(),), jac=self.cost_prime, method='L-BFGS-B', options={'maxiter':iter,'disp':True})
-        #err = optimize.check_grad(func=self.cost, x0=args, grad=self.cost_prime)
-        #print err
-        self.W1, self.b1, self.W2, self.b2 = self.unpackTheta(res.x)
-
-    def back_prop(self, iter=1000):
-        init_val = self.packTheta(self.W1, self.b1, self.W2, self.b2)
-        res = optimize.minimize(fun=self.cost, x0=init_val, args=(self.X,), jac=self.cost_prime, method='L-BFGS-B', options={'maxiter':iter,'disp':True})
-        self.W1, self.b1, self.W2, self.b2 = self.unpackTheta(res.x)
+    # n_procs - if given, cost and gradient are calculated by n_procs worker processes (see parallel_cost_and_grad)
+    # sample-major data is always read in chunks by this process (see chunked_cost_and_grad), so n_procs can't be given for it
+    def back_prop(self, iter=1000, n_procs=None):
+        if self.sample_major and n_procs is not None:
+            raise ValueError('n_procs can not be used with sample-major data, the worker pool copies the whole data in to shared memory')
+        if self.sample_major:
+            self.minimize_lbfgs(self.chunked_cost_and_grad, iter)
+        elif n_procs is None:
+            self.minimize_lbfgs(self.cost_and_grad, iter, (self.X,))
+        else:
+            self.start_pool(n_procs)
+            try:
+                self.minimize_lbfgs(self.parallel_cost_and_grad, iter)
+            finally:
+                self.close_pool()
+
+    # runs L-BFGS-B on fun (cost_and_grad or one of its chunked/parallel versions) and stores the result in theta
+    # scipy's L-BFGS-B only takes a float64 gradient, so the gradient (self.params.grad, in the compute dtype)
+    # is handed over as a float64 copy. The cost and gradient are still calculated in self.dtype
+    def minimize_lbfgs(self, fun, iter, args=()):
+        def fun64(theta, *args):
+            err, grad = fun(theta, *args)
+            return err, grad.astype(np.float64)
+
+        res = optimize.minimize(fun=fun64, x0=self.params.theta.astype(np.float64), args=args, jac=True, method='L-BFGS-B', options={'maxiter':iter,'disp':True})
+        self.params.theta[...] = res.x
+
+    # copies self.X in to shared memory and starts n_procs workers, which are reused by every
+    # parallel_cost_and_grad call until close_pool
+    def start_pool(self, n_procs=None):
+        if self.sample_major:
+            raise ValueError('The worker pool copies the data in to shared memory, use chunked_cost_and_grad for sample-major data')
+        self.close_pool()
+        self.pool = DataParallelPool({'data': self.X}, self.params.size, self.dtype, self.params.size+1, n_procs)
+
+    def close_pool(self):
+        if self.pool is not None:
+            self.pool.close()
+            self.pool = None
+
+    # same as cost_and_grad(theta, self.X), but the columns of X are split across the worker pool
+    # the hidden activation sums are reduced first (for rho_nh), then the gradients and squared errors
+    def parallel_cost_and_grad(self, theta):
+
+        theta = self.pool.set_theta(theta)
+        W1, b1, W2, b2 = self.unpackTheta(theta)
+        size_data = self.pool.n_examples
+
+        parts = self.pool.map(shard_hidden_sum, self.params.shapes)
+        self.rho_nh = ((0.001 + np.sum(parts[:, :self.n_hidden], axis=0))/size_data).astype(self.dtype)
+
+        d_kl = (self.beta*self.d_kl_diverg(self.rho,self.rho_nh)).astype(self.dtype)
+        parts = self.pool.map(shard_grad, (self.params.shapes, d_kl))
+
+        return self.cost_and_grad_from_sums(W1, W2, np.sum(parts, axis=0), size_data)
+
+    # same as cost_and_grad(theta, self.X) for sample-major (memmap) data. The data is read in
+    # chunks of chunk_size rows (twice, the first pass is for rho_nh), so only one chunk is in memory at a time
+    def chunked_cost_and_grad(self, theta):
+
+        W1, b1, W2, b2 = self.unpackTheta(theta)
+        size_data = self.X.shape[0]
+
+        h_sum = np.zeros((self.n_hidden,), dtype=np.float64)
+        for x in self.iterate_chunks():
+            h_sum += hidden_sum(W1, b1, x)
+        self.rho_nh = ((0.001 + h_sum)/size_data).astype(self.dtype)
+
+        d_kl = (self.beta*self.d_kl_diverg(self.rho,self.rho_nh)).astype(self.dtype)
+        sums = np.zeros((self.params.size+1,), dtype=np.float64)
+        part = np.empty_like(sums)
+        for x in self.iterate_chunks():
+            grad_sums(W1, b1, W2, b2, x, d_kl, part)
+            sums += part
+
+        return self.cost_and_grad_from_sums(W1, W2, sums, size_data)
+
+    # cost and gradient from the gradient sums and summed squared error of all the data (see grad_sums)
+    # self.rho_nh has to be already calculated from all the data
+    def cost_and_grad_from_sums(self, W1, W2, sums, size_data):
+
+        sqr_err = 0.5 * sums[-1]/size_data
+        w_decay = (self.lam/2)*(np.sum(W1**2, dtype=np.float64) + np.sum(W2**2, dtype=np.float64))
+        tot_err = sqr_err + w_decay + self.beta*np.sum(self.kl_diverg(self.rho,self.rho_nh), dtype=np.float64)
+
+        self.params.grad[...] = sums[:-1]
+        self.params.grad *= 1.0/size_data
+        d_W1, d_b1, d_W2, d_b2 = self.params.grads()
+        d_W1 += self.lam * W1
+        d_W2 += self.lam * W2
+
+        return float(tot_err), self.params.grad
+
+    # generator over X (self.X if None) in chunks of chunk_size examples
+    # sample-major X is read in chunk_size consecutive rows (contiguous reads for a memmap)
+    # every chunk is given as a (n_inputs, examples) matrix in the compute dtype, like the in-memory data
+    def iterate_chunks(self, X=None, sample_major=None):
+        if X is None:
+            X = self.X
+            sample_major = self.sample_major
+        elif sample_major is None:
+            sample_major = isinstance(X, np.memmap)
+
+        if sample_major:
+            for sIdx in range(0, X.shape[0], self.chunk_size):
+                yield np.asarray(X[sIdx:sIdx+self.chunk_size], dtype=self.dtype).T
+        else:
+            for sIdx in range(0, X.shape[1], self.chunk_size):
+                yield np.asarray(X[:, sIdx:sIdx+self.chunk_size], dtype=self.dtype)
+
+    # activations of every example of X (self.X if None) with the current weights, one column per example
+    # upto_layer=1 gives the hidden layer (the features for the next autoencoder), upto_layer=2 the reconstruction
+    # the examples go through the network chunk_size at a time, so the temporaries stay chunk sized
+    def encode(self, X=None, upto_layer=1, sample_major=None):
+        assert upto_layer in (1, 2)
+
+        if X is None:
+            n_examples = self.X.shape[0] if self.sample_major else self.X.shape[1]
+        elif sample_major or (sample_major is None and isinstance(X, np.memmap)):
+            n_examples = X.shape[0]
+        else:
+            n_examples = X.shape[1]
+
+        n_out = self.n_hidden if upto_layer == 1 else self.n_outputs
+        out = np.empty((n_out, n_examples), dtype=self.dtype)
+
+        sIdx = 0
+        for x in self.iterate_chunks(X, sample_major):
+            if upto_layer == 1:
+                out[:, sIdx:sIdx+x.shape[1]] = self.sigmoid(np.dot(self.W1, x) + self.b1[:, None])
+            else:
+                out[:, sIdx:sIdx+x.shape[1]] = self.forward_pass_for_batch(x, self.W1, self.b1, self.W2, self.b2)[1]
+            sIdx += x.shape[1]
+
+        return out
+
+    # hidden layer features of X (self.X if None), same as encode(X, upto_layer=1)
+    def transform(self, X=None, sample_major=None):
+        return self.encode(X, 1, sample_major)
+
+    #generator giving one epoch of mini-batches, reshuffled every time it is called
+    #for sample-major data the order of the chunks and the rows inside each chunk are shuffled instead,
+    #so the data is still read in contiguous chunks
+    def iterate_minibatches(self, batch_size):
+        if self.sample_major:
+            return self.sampler.chunked_epoch(self.X, self.chunk_size, batch_size)
+        return self.sampler.epoch(self.X, batch_size)
+
+    # mini-batch training with one of the update rules in Optimizers (sgd, momentum, nesterov, adam)
+    # batches - None to reshuffle self.X every epoch, a function returning a new iterable of batches for each epoch,
+    #           or an iterable/generator of batches which is streamed through once (epochs is ignored)
+    # every batch is a (n_inputs, k) matrix. rho_nh is a running average of the hidden activations
+    # across batches (rho_decay), so the sparsity penalty does not depend on a single small batch
+    def back_prop_with_SGD(self, epochs=10, batch_size=None, optimizer='sgd', l_rate=0.1, batches=None, rho_decay=0.9, **opt_args):
+
+        if batch_size is None:
+            batch_size = self.m_batch_size
+
+        if batches is None:
+            get_batches = lambda: self.iterate_minibatches(batch_size)
+        elif callable(batches):
+            get_batches = batches
+        else:
+            get_batches = lambda: batches
+            epochs = 1
+
+        opt = get_optimizer(optimizer, l_rate=l_rate, **opt_args)
+        theta = self.params.theta
+        W1, b1, W2, b2 = self.W1, self.b1, self.W2, self.b2
+
+        rho_nh = None
+        for epoch in range(epochs):
+            c = []
+            for data in get_batches():
+                data = np.asarray(data, dtype=self.dtype)
+                a2, a3 = self.forward_pass_for_batch(data, W1, b1, W2, b2)
+
+                if rho_nh is None:
+                    rho_nh = self.avg_activation(a2)
+                else:
+                    rho_nh = rho_decay*rho_nh + (1-rho_decay)*self.avg_activation(a2)
+
+                sqr_err = 0.5 * np.sum((a3-data)**2)/data.shape[1]
+                w_decay = (self.lam/2)*(np.sum(W1**2) + np.sum(W2**2))
+                c.append(sqr_err + w_decay + self.beta*np.sum(self.kl_diverg(self.rho,rho_nh)))
+
+                grad = self.grad_from_activations(W1, W2, data, a2, a3, rho_nh)
+                # W1, b1, W2, b2 are views of theta, so they see the update
+                opt.update(theta, grad)
+
+            print ("Training epoch %d, cost %f" % (epoch, np.mean(c)))
+
+        self.rho_nh = rho_nh
 
 
     def mkdir_if_not_exist(self, name):
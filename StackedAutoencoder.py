@@ -3,6 +3,9 @@ __author__ = 'Thushan Ganegedara'
 import numpy as np
 from SparseAutoencoder import SparseAutoencoder
 from SoftmaxClassifier import SoftmaxClassifier
+from ActivationCache import ActivationCache
+from Checkpointer import Checkpointer
+from BinaryDataset import has_binary_dataset, load_binary_dataset
 from scipy import misc
 import os
 from PIL import Image
@@ -12,7 +15,10 @@ import gzip,cPickle
 
 class StackedAutoencoder(object):
 
-    def __init__(self):
+    # cache_dir - if given, trained layers and their encoded features are cached there (see ActivationCache)
+    # so layers whose inputs and hyperparameters did not change are not trained or propagated again
+    # optimizer, l_rate, batch_size - mini-batch training of the autoencoders (see SparseAutoencoder.back_prop_with_SGD)
+    def __init__(self, cache_dir=None, cache_max_bytes=4*1024**3, optimizer='momentum', l_rate=0.1, batch_size=100):
         self.img_w = 28
         self.img_h = 28
         self.d_size = 5000
@@ -24,108 +30,167 @@ class StackedAutoencoder(object):
         self.W2_1 = None
         self.W3_1 = None
 
+        #True if self.X is sample-major (n_examples, 784), e.g. a np.memmap from load_data_mmap
+        self.sample_major = False
 
-    def load_data(self):
+        self.cache = None if cache_dir is None else ActivationCache(cache_dir, cache_max_bytes)
 
-        dir_name = "Data"
-        f = gzip.open(dir_name+'\\mnist.pkl.gz', 'rb')
-        train_set, valid_set, test_set = cPickle.load(f)
-        f.close()
+        self.sgd_args = {'optimizer': optimizer, 'l_rate': l_rate, 'batch_size': batch_size}
 
-        self.X = np.transpose(train_set[0][1:self.d_size,:])
-        self.Y_VEC = train_set[1][1:self.d_size]
+    # file_path can be the prefix of a dataset converted with BinaryDataset.py. Its training samples are then
+    # memory mapped (sample-major) instead of unpickled, like with load_data_mmap
+    def load_data(self, file_path=None):
 
-        idx = 0
-        for y in train_set[1][1:self.d_size]:
-            tmp_arr = [0.0] * self.o_size
-            tmp_arr[y] = 1.0
-            self.Y[:,idx] = tmp_arr
-            idx += 1
+        if file_path is not None and has_binary_dataset(file_path):
+            train_set = load_binary_dataset(file_path)[0]
+            self.X = train_set[0][1:self.d_size]
+            self.sample_major = True
+        else:
+            dir_name = "Data"
+            f = gzip.open(dir_name+'\\mnist.pkl.gz', 'rb')
+            train_set, valid_set, test_set = cPickle.load(f)
+            f.close()
+
+            self.X = np.transpose(train_set[0][1:self.d_size,:])
+
+        self.Y_VEC = np.asarray(train_set[1][1:self.d_size])
+        self.Y[self.Y_VEC, np.arange(self.Y_VEC.size)] = 1.0
 
         print ("Last")
 
+    # loads sample-major (n_examples, 784) training data saved with np.save without reading it in to memory
+    # (it is memory mapped and the first autoencoder reads it in chunks). The labels are loaded normally
+    def load_data_mmap(self, x_file, y_file):
+        self.X = np.load(x_file, mmap_mode='r')
+        self.Y_VEC = np.load(y_file)
+        self.d_size = self.X.shape[0]
+        self.sample_major = True
 
 
-    def train_model(self):
+
+    # checkpoint_file - if given, the weights of every pretrained layer, the softmax weights and iteration and
+    # the RNG state are written there (in the background) after each layer and every checkpoint_freq softmax
+    # iterations. With resume=True training continues from that checkpoint if it exists
+    # pre_epochs - training epochs of each autoencoder
+    def train_model(self, checkpoint_file=None, checkpoint_freq=100, resume=True, pre_epochs=(10, 20, 20)):
 
         in_dim = self.img_w*self.img_h
         h1_dim = 20**2
         h2_dim = 15**2
         h3_dim = 10**2
 
-        data_size = self.X.shape[1]
+        data_size = self.X.shape[0] if self.sample_major else self.X.shape[1]
+
+        checkpointer = None if checkpoint_file is None else Checkpointer(checkpoint_file, checkpoint_freq)
+        state = checkpointer.load() if checkpointer is not None and resume else None
+        if state is not None:
+            print ("Resuming from checkpoint: %i layers pretrained, softmax iteration %i" %(len(state['layers']), state['softmax_iter']))
+            np.random.set_state(state['rng'])
+        else:
+            state = {'layers': [], 'softmax': None, 'softmax_iter': 0, 'rng': None}
+
+        def checkpoint():
+            if checkpointer is not None:
+                state['rng'] = np.random.get_state()
+                checkpointer.save(state)
+
+        # weights of layer i from the checkpoint (None if it has not been trained yet)
+        def layer_params(i):
+            return state['layers'][i] if i < len(state['layers']) else None
+
+        def layer_done(i, sa):
+            if i == len(state['layers']):
+                state['layers'].append(sa.get_params())
+                checkpoint()
 
-        sa1 = SparseAutoencoder(n_inputs=in_dim,n_hidden=h1_dim,X=self.X)
-        sa1.back_prop(iter=50)
-        W1_1,b1_1,W1_2,b1_2 = sa1.get_params()
-        self.W1_1 = W1_1
+        data_key = None if self.cache is None else self.cache.dataset_key(self.X)
+        #cached features are sample-major memmaps
+        cached = self.cache is not None
+
+        sa1, X2, X2_key = self.train_layer(self.X, data_key, in_dim, h1_dim, pre_epochs[0], self.sample_major, layer_params(0))
+        layer_done(0, sa1)
+        self.W1_1 = sa1.get_params()[0]
 
         print ("Trained 1st AE...")
-        X2 = np.zeros([h1_dim,data_size],dtype=np.float32)
-        idx = 0
-        for x in self.X.T:
-            a2,a3 = sa1.forward_pass_for_one_case(x,W1_1,b1_1,W1_2,b1_2)
-            X2[:,idx] = a2
-            idx += 1
-
-        print ("Inputs for 2nd AE created. Size (%i, %i)" %(X2.shape[0],X2.shape[1]))
-        sa2 = SparseAutoencoder(n_inputs=h1_dim,n_hidden=h2_dim,X=X2)
-        sa2.back_prop(iter=150)
-        W2_1,b2_1,W2_2,b2_2 = sa2.get_params()
-        self.W2_1 = W2_1
+        print ("Inputs for 2nd AE created. Size (%i, %i)" %(h1_dim,data_size))
 
-        print ("Trained 2nd AE...")
+        sa2, X3, X3_key = self.train_layer(X2, X2_key, h1_dim, h2_dim, pre_epochs[1], cached, layer_params(1))
+        layer_done(1, sa2)
+        self.W2_1 = sa2.get_params()[0]
 
-        X3 = np.zeros([h2_dim,data_size],dtype=np.float32)
-        idx = 0
-        for x in X2.T:
-            a2,a3 = sa2.forward_pass_for_one_case(x,W2_1,b2_1,W2_2,b2_2)
-            X3[:,idx] = a2
-            idx += 1
+        print ("Trained 2nd AE...")
+        print ("Inputs for 3rd AE created. Size (%i, %i)" %(h2_dim,data_size))
 
-        print ("Inputs for 2nd AE created. Size (%i, %i)" %(X3.shape[0],X3.shape[1]))
-        sa3 = SparseAutoencoder(n_inputs=h2_dim, n_hidden=h3_dim, X=X3)
-        sa3.back_prop(iter=150)
-        W3_1,b3_1,W3_2,b3_2 = sa3.get_params()
-        self.W3_1 = W3_1
+        sa3, X4, X4_key = self.train_layer(X3, X3_key, h2_dim, h3_dim, pre_epochs[2], cached, layer_params(2))
+        layer_done(2, sa3)
+        self.W3_1 = sa3.get_params()[0]
 
         print ("Trained 3rd AE...")
+        print ("Inputs for softmax created. Size (%i, %i)" %(h3_dim,data_size))
 
-        X4 = np.zeros([h3_dim,data_size],dtype=np.float32)
-        idx = 0
-        for x in X3.T:
-            a2,a3 = sa3.forward_pass_for_one_case(x,W3_1,b3_1,W3_2,b3_2)
-            X4[:,idx] = a2
-            idx += 1
-
-        print ("Inputs for 3rd AE created. Size (%i, %i)" %(X4.shape[0],X4.shape[1]))
+        #the softmax classifier needs its inputs in memory as columns
+        if cached:
+            X4 = np.asarray(X4).T
 
         softmax = SoftmaxClassifier(n_inputs=h3_dim, n_outputs=self.o_size, X=X4, Y=self.Y_VEC)
-        softmax.back_prop_man(iter=500)
+        if state['softmax'] is not None:
+            softmax.params.set_params(state['softmax'])
+
+        def softmax_step(i):
+            state['softmax'] = softmax.get_params()
+            state['softmax_iter'] = i + 1
+            if checkpointer is not None and checkpointer.due(i):
+                checkpoint()
+
+        softmax.back_prop_man(iter=500, start_iter=state['softmax_iter'], callback=softmax_step)
         W4_1,b4_1 = softmax.get_params()
 
-        output = np.zeros([self.o_size,data_size],dtype=np.float32)
-        idx = 0
-        for x in X4.T:
-            a2 = softmax.forward_pass(x,W4_1,b4_1)
-            output[:,idx] = a2
-            idx += 1
+        if checkpointer is not None:
+            checkpoint()
+            checkpointer.wait()
+
+        output = softmax.predict_proba(X4)
 
         print ("Finished Training")
 
-        outDigits = np.empty((1,self.d_size),dtype=np.int8)
-        totCorrect = 0
-        for i in range(self.d_size-1):
-            maxCol = np.max(output[:,i])
-            if maxCol>0.4:
-                maxIdx = np.argmax(output[:,i])
-                #outDigits[1,i]=maxIdx
-                if self.Y_VEC[i]==maxIdx:
-                    totCorrect = totCorrect+1
-            #else:
-                #outDigits[1,i]=-1
-
-        print ("Accuracy: %f" %(1.0*totCorrect/self.d_size))
+        #a prediction only counts if the winning class has a probability above 0.4
+        maxCol = np.max(output, axis=0)
+        maxIdx = np.argmax(output, axis=0)
+        totCorrect = np.sum((maxCol > 0.4) & (maxIdx == self.Y_VEC[:data_size]))
+
+        print ("Accuracy: %f" %(1.0*totCorrect/data_size))
+
+    # trains an autoencoder with n_hidden units on X (mini-batch, for epochs) and returns it with the encoded features of X
+    # With a cache, the trained weights are looked up under (input key, hyperparameters) and the features under
+    # (input key, weights). The features are then a sample-major memmap (n_examples, n_hidden), which the next
+    # autoencoder reads in chunks, and their key is returned as the input key of the next layer.
+    # Without a cache, features are the usual (n_hidden, n_examples) matrix.
+    # If params (e.g. from a checkpoint) are given, the layer is not trained again
+    def train_layer(self, X, in_key, n_inputs, n_hidden, epochs, sample_major=False, params=None):
+        sa = SparseAutoencoder(n_inputs=n_inputs,n_hidden=n_hidden,X=X,sample_major=sample_major)
+        if params is not None:
+            sa.params.set_params(params)
+
+        if self.cache is None:
+            if params is None:
+                sa.back_prop_with_SGD(epochs=epochs, **self.sgd_args)
+            return sa, sa.transform(), None
+
+        params_key = self.cache.key(in_key, n_inputs, n_hidden, epochs, sorted(self.sgd_args.items()), sa.lam, sa.beta, sa.rho, str(sa.dtype))
+        if params is None:
+            params = self.cache.get_params(params_key)
+            if params is not None:
+                print ("Loaded trained layer (%i -> %i) from cache" %(n_inputs, n_hidden))
+                sa.params.set_params(params)
+
+        if params is None:
+            sa.back_prop_with_SGD(epochs=epochs, **self.sgd_args)
+            self.cache.put_params(params_key, sa.get_params())
+
+        W1, b1, W2, b2 = sa.get_params()
+        features_key = self.cache.key(in_key, W1, b1)
+        features = self.cache.get_or_compute(features_key, lambda: np.ascontiguousarray(sa.transform().T))
+        return sa, features, features_key
 
     def mkdir_if_not_exist(self, name):
         if not os.path.exists(name):
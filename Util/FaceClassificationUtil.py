@@ -7,6 +7,59 @@ from PIL import Image
 import numpy as np
 import pickle
 import scipy
+import multiprocessing
+
+i_side = 48
+
+# grayscale thumbnail (at most size x size) of an image as a flat uint8 array of size*size pixels
+# (zero padded at the end like before), None if the image can not be read.
+# A module function so it can be run by a process pool
+def decode_face(file_path, size=i_side):
+    try:
+        im = Image.open(file_path)
+        im.thumbnail((size, size), Image.ANTIALIAS)
+        img = im.convert('L')
+    except IOError:
+        print "cannot create thumbnail for '%s'" % file_path
+        return None
+
+    pixels = np.zeros((size*size,), dtype=np.uint8)
+    arr = np.asarray(img, dtype=np.uint8).ravel()
+    pixels[:arr.size] = arr
+    return pixels
+
+# thumbnails of earlier runs, file path -> (modification time, pixels), stored in a pickle file
+class ThumbnailCache(object):
+
+    def __init__(self, file_path=None):
+        self.file_path = file_path
+        self.entries = {}
+        self.changed = False
+        if file_path is not None and os.path.exists(file_path):
+            with open(file_path, 'rb') as f:
+                self.entries = pickle.load(f)
+
+    def get(self, img_path):
+        entry = self.entries.get(img_path)
+        if entry is not None and entry[0] == os.path.getmtime(img_path):
+            return entry[1]
+        return None
+
+    def put(self, img_path, pixels):
+        self.entries[img_path] = (os.path.getmtime(img_path), pixels)
+        self.changed = True
+
+    def save(self):
+        if self.file_path is None or not self.changed:
+            return
+        tmp_path = self.file_path + '.tmp'
+        with open(tmp_path, 'wb') as f:
+            pickle.dump(self.entries, f, protocol=pickle.HIGHEST_PROTOCOL)
+        if os.path.exists(self.file_path):
+            os.remove(self.file_path)
+        os.rename(tmp_path, self.file_path)
+        self.changed = False
+
 class FaceClassifUtil(object):
 
     def load_data_to_one_folder(self,data_dir):
@@ -22,18 +75,10 @@ class FaceClassifUtil(object):
                 if '.jpg' in f_name:
                     sh.copyfile(src, dst)
 
-    def load_data(self,img_dir,lbl_dir,file_name):
-
-        def get_thumbnail(filename,size):
-            try:
-                im = Image.open(filename)
-                im.thumbnail(size, Image.ANTIALIAS)
-                img = im.convert('L')
-                return img
-            except IOError:
-                print "cannot create thumbnail for '%s'" % filename
-
-            return None
+    # the images are decoded by a pool of n_workers processes (all cores by default) and written in to one
+    # preallocated (n_images, 48*48) float32 array. With cache_file, thumbnails are kept between runs
+    # (see ThumbnailCache) and only new or modified images are decoded
+    def load_data(self,img_dir,lbl_dir,file_name,n_workers=None,cache_file=None):
 
         def get_label(age,gender):
             age_val = 0
@@ -62,15 +107,11 @@ class FaceClassifUtil(object):
 
             return gender_val*8 + age_val
 
-        with open(lbl_dir+'\\'+file_name) as inputfile:
+        with open(lbl_dir+os.sep+file_name) as inputfile:
             results = list(csv.reader(inputfile))
 
-        i_side = 48
-        f_names = []
-        f_ids = []
-        labels = []
-        imgs = []
-        i = 0
+        img_paths = []
+        img_labels = []
         for s in results[1:]:
 
             if len(s)==2:
@@ -84,29 +125,38 @@ class FaceClassifUtil(object):
 
             f_name = s_tokens[1]
             f_id = s_tokens[2]
-            img1 = get_thumbnail(img_dir+"\\"+'coarse_tilt_aligned_face.'+f_id+'.'+f_name,[i_side,i_side])
-            if img1 is not None:
-                arr = np.asarray(list(img1.getdata()))
-                arr = arr/255.
-                if arr.size<i_side**2:
-                    gap = i_side**2 - arr.size
-                    gap_arr = np.zeros((gap),dtype=np.float32)
-                    arr = np.concatenate((arr,gap_arr))
-
-                imgs.append(arr)
-                f_names.append(s_tokens[1])
-                f_ids.append(s_tokens[2])
-                label = get_label(s_tokens[3],s_tokens[4])
-                labels.append(label)
-
-
-                #if i == 30:
-                #    im = Image.fromarray(np.reshape(arr*255.,(64,64)))
-                #    im = im.convert('RGB')
-                #    im.save('test.jpg')
-
+            img_paths.append(img_dir+os.sep+'coarse_tilt_aligned_face.'+f_id+'.'+f_name)
+            img_labels.append(get_label(s_tokens[3],s_tokens[4]))
+
+        cache = ThumbnailCache(cache_file)
+        pixels = [cache.get(img_path) if os.path.exists(img_path) else None for img_path in img_paths]
+        todo = [idx for idx in xrange(len(img_paths)) if pixels[idx] is None]
+        print '%i images, %i cached, %i to decode' %(len(img_paths), len(img_paths)-len(todo), len(todo))
+
+        if len(todo) > 0:
+            todo_paths = [img_paths[idx] for idx in todo]
+            if n_workers == 1:
+                decoded = map(decode_face, todo_paths)
             else:
-                continue
+                pool = multiprocessing.Pool(n_workers)
+                try:
+                    decoded = pool.map(decode_face, todo_paths, chunksize=32)
+                finally:
+                    pool.close()
+                    pool.join()
+
+            for idx, img_pixels in zip(todo, decoded):
+                pixels[idx] = img_pixels
+                if img_pixels is not None:
+                    cache.put(img_paths[idx], img_pixels)
+            cache.save()
+
+        #images that could not be read are left out
+        valid = [idx for idx in xrange(len(img_paths)) if pixels[idx] is not None]
+        imgs = np.empty((len(valid), i_side**2), dtype=np.float32)
+        for row, idx in enumerate(valid):
+            np.multiply(pixels[idx], 1/255., out=imgs[row], casting='unsafe')
+        labels = [img_labels[idx] for idx in valid]
 
         return [imgs,labels]
 
@@ -117,6 +167,6 @@ if __name__ == '__main__':
     f_names = ['fold_0_data','fold_1_data','fold_2_data','fold_3_data','fold_4_data']
     for f in f_names:
         print 'started ' + f
-        [imgs,labels] = util.load_data("all_images","labels",f+'.txt')
+        [imgs,labels] = util.load_data("all_images","labels",f+'.txt',cache_file='thumbnail_cache.pkl')
         pickle.dump([imgs,labels], open(f+".pkl", "wb"))
         print 'done ' + f
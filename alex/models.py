@@ -4,6 +4,7 @@ import itertools
 import random
 
 import policies
+from TheanoOptimizers import get_optimizer
 
 import theano
 import theano.tensor as T
@@ -27,7 +28,7 @@ def iterations_shim(train, iterations):
 
 class Transformer(object):
     ''' A compositional approach to building neural networks '''
-    __slots__ = [ 'layers', 'arcs', '_x', '_y', '_logger', 'use_error', 'context' ]
+    __slots__ = [ 'layers', 'arcs', '_x', '_y', '_logger', 'use_error', 'context', '_optimizer', '_optimizers' ]
 
     def __init__(self, layers, arcs, use_error):
         self.layers = layers
@@ -45,6 +46,32 @@ class Transformer(object):
                 }
         return theano.function([idx], output, updates=update, givens=given, on_unused_input='warn')
 
+    def set_optimizer(self, name, **params):
+        ''' Use the given update rule (see TheanoOptimizers) in the train functions, plain SGD by default '''
+        self._optimizer = (name, params)
+        self._optimizers = {}
+
+    def get_optimizer(self, theta, learning_rate):
+        ''' The optimizer of theta, created once so every train function of theta shares its accumulators and l_rate (a different numeric learning_rate later is a ValueError) '''
+        if getattr(self, '_optimizers', None) is None:
+            self._optimizers = {}
+        key = tuple(theta)
+        symbolic = isinstance(learning_rate, theano.Variable)
+        if symbolic:
+            key += (learning_rate,)
+        if key not in self._optimizers:
+            name, params = getattr(self, '_optimizer', ('sgd', {}))
+            self._optimizers[key] = get_optimizer(name, theta, l_rate=learning_rate, **params)
+        elif not symbolic and not np.allclose(self._optimizers[key].l_rate.get_value(), learning_rate):
+            #the l_rate is shared by the functions compiled before, so it is not changed behind their back
+            raise ValueError('The optimizer of these parameters has learning rate %f, not %f (use its l_rate.set_value to change it)'
+                             % (self._optimizers[key].l_rate.get_value(), learning_rate))
+        return self._optimizers[key]
+
+    def get_updates(self, theta, cost, learning_rate):
+        ''' Updates of theta for the cost with the configured optimizer '''
+        return self.get_optimizer(theta, learning_rate).get_updates(T.grad(cost, theta))
+
     def begin(self, context):
         ''' Pass contextual from the trainer to the model '''
         self.context = context
@@ -120,7 +147,7 @@ class DeepAutoencoder(Transformer):
         return None
 
     def train_func(self, _, learning_rate, prealloc_x, prealloc_y, batch_size, apply_x=identity):
-        updates = [ (param, param - learning_rate * grad) for param, grad in zip(self.theta, T.grad(self.cost, self.theta)) ]
+        updates = self.get_updates(self.theta, self.cost, learning_rate)
         return self.make_func(prealloc_x, prealloc_y, batch_size, None, updates, apply_x)
 
     def indexed_train_func(self, arc, learning_rate, prealloc_x, batch_size, apply_x=identity):
@@ -128,6 +155,7 @@ class DeepAutoencoder(Transformer):
         nnlayer = self.layers[arc]
         applied_cost = theano.clone(self.cost, replace={ self._x: apply_x(self._x) })
 
+        # plain SGD on purpose (not get_optimizer), only the columns in nnlayer.idx are stepped and the optimizers keep whole-matrix accumulators
         updates = [ (nnlayer.W, T.inc_subtensor(nnlayer.W[:,nnlayer.idx], - learning_rate * T.grad(applied_cost, nnlayer.W)[:,nnlayer.idx].T))
                   , (nnlayer.b, T.inc_subtensor(nnlayer.b[nnlayer.idx],   - learning_rate * T.grad(applied_cost, nnlayer.b)[nnlayer.idx]))
                   , (nnlayer.b_prime, - learning_rate * T.grad(applied_cost, nnlayer.b_prime))
@@ -197,7 +225,7 @@ class Softmax(Transformer):
         if iterations is None:
             iterations = self.iterations
 
-        updates = [ (param, param - learning_rate * grad) for param, grad in zip(self.theta, T.grad(self.cost, self.theta)) ]
+        updates = self.get_updates(self.theta, self.cost, learning_rate)
 
         train = self.make_func(prealloc_x, prealloc_y, batch_size, None, updates, apply_x)
         return iterations_shim(train, iterations)
@@ -311,6 +339,7 @@ class MergeIncrementingAutoencoder(Transformer):
         combined_objective_tune = self._combined_objective.train_func(0, learning_rate, prealloc_x, prealloc_y, batch_size)
 
         # set up layered merge-increment - build a cost function
+        # stepped with plain SGD like indexed_train_func, the first layer only updates the columns in nnlayer.idx
         mi_cost = self._softmax.cost + self.lam * self._autoencoder.cost
         mi_updates = []
 
@@ -475,7 +504,7 @@ class CombinedObjective(Transformer):
         theta += [ self.layers[-1].W, self.layers[-1].b ]
 
         # gradient descent
-        updates = [ (param, param - learning_rate * grad) for param, grad in zip(theta, T.grad(combined_cost, theta)) ]
+        updates = self.get_updates(theta, combined_cost, learning_rate)
         func = self.make_func(prealloc_x, prealloc_y, batch_size, None, updates, apply_x)
         return iterations_shim(func, iterations)
 
@@ -7,6 +7,7 @@ from scipy import optimize
 from scipy import misc
 from numpy import linalg as LA
 from PIL import Image
+from MiniBatchSampler import MiniBatchSampler
 
 class SimpleAutoEncoder(object):
 
@@ -23,11 +24,14 @@ class SimpleAutoEncoder(object):
     #__init__ is called when the constructor of an object is called (i.e. created an object)
 
     #by reducing number of hidden from 400 -> 75 and hidden2 200 -> 25 got an error reduction of 540+ -> 387 (for numbers dataset)
-    def __init__(self, n_inputs=810, n_hidden=90, W1=None, W2=None, b1=None, b2=None, m_batch_size=30):
-        self.X = np.zeros((810, 40), dtype=np.float32)
+    #dtype is the compute dtype used for the weights, data and mini-batches
+    def __init__(self, n_inputs=810, n_hidden=90, W1=None, W2=None, b1=None, b2=None, m_batch_size=30, seed=None, dtype=np.float32):
+        self.dtype = np.dtype(dtype)
+        self.X = np.zeros((810, 40), dtype=self.dtype)
 
         self.m_batch_size = m_batch_size
-        self.min_batch_X = np.zeros((n_inputs, m_batch_size), dtype=np.float32)
+        self.min_batch_X = np.zeros((n_inputs, m_batch_size), dtype=self.dtype)
+        self.sampler = MiniBatchSampler(m_batch_size, seed=seed, dtype=self.dtype)
 
         #define global variables for n_inputs and n_hidden
         self.n_hidden = n_hidden
@@ -38,21 +42,21 @@ class SimpleAutoEncoder(object):
         if W1 == None:
             val_range1 = [-math.sqrt(6.0/(n_inputs+n_hidden+1)), math.sqrt(6.0/(n_inputs+n_hidden+1))]
             W1 = val_range1[0] + np.random.random_sample((n_hidden, n_inputs))*2.0*val_range1[1]
-            self.W1 = W1
+            self.W1 = np.asarray(W1, dtype=self.dtype)
 
         if W2 == None:
             val_range2 = [-math.sqrt(24.0/(self.n_outputs+n_hidden+1)), math.sqrt(24.0/(self.n_outputs+n_hidden+1))]
             W2 = val_range2[0] + np.random.random_sample((self.n_outputs, n_hidden))*2.0*val_range2[1]
-            self.W2 = W2
+            self.W2 = np.asarray(W2, dtype=self.dtype)
 
         #by introducing *0.05 to b1 initialization got an error dropoff from 360 -> 280
         if b1 == None:
             b1 = -0.01 + np.random.random_sample((n_hidden,)) * 0.02
-            self.b1 = b1
+            self.b1 = np.asarray(b1, dtype=self.dtype)
 
         if b2 == None:
             b2 = -0.02 + np.random.random_sample((self.n_outputs,)) * 0.04
-            self.b2 = b2
+            self.b2 = np.asarray(b2, dtype=self.dtype)
 
 
 
@@ -65,22 +69,13 @@ class SimpleAutoEncoder(object):
             imgVec = np.reshape(img, (810, 1))
             self.X[:, i-1] = imgVec[:, 0]
 
-        self.X = self.X/255.0
+        self.X = np.asarray(self.X/255.0, dtype=self.dtype)
         #mean_X = np.mean(self.X, axis=0)
         #for i in range(self.X.shape[1]):
         #    self.X[:,i] = self.X[:,i]-mean_X[i,]
 
     def renew_dataset(self):
-        sel_idx = []
-        tmp_data = np.zeros((self.X.shape[0],self.m_batch_size),dtype=np.float32)
-        for dIdx in range(self.m_batch_size):
-            while True:
-                tmp_idx = np.random.randint(self.X.shape[1])
-                if tmp_idx not in sel_idx:
-                    sel_idx.append(tmp_idx)
-                    tmp_data[:, dIdx] = self.X[:, tmp_idx]
-                    break
-        return tmp_data
+        return self.sampler.sample(self.X)
 
     def forward_pass_for_one_case(self, x, W1, b1, W2, b2):
 
@@ -92,6 +87,17 @@ class SimpleAutoEncoder(object):
 
         return a2, a3
 
+    #same as forward_pass_for_one_case but X holds one example per column
+    def forward_pass_for_batch(self, X, W1, b1, W2, b2):
+
+        z2 = np.dot(W1, X) + b1[:, None]
+        a2 = self.sigmoid(z2)
+
+        z3 = np.dot(W2, a2) + b2[:, None]
+        a3 = self.sigmoid(z3)
+
+        return a2, a3
+
     def packTheta(self, W1, b1, W2, b2):
         theta_p1 = np.concatenate((np.reshape(W1, (self.n_hidden*self.n_inputs,)), b1))
         theta_p2 = np.concatenate((np.reshape(W2, (self.n_outputs*self.n_hidden,)), b2))
@@ -161,6 +167,30 @@ class SimpleAutoEncoder(object):
 
         return self.packTheta(d_W1, d_b1, d_W2, d_b2)
 
+    # fused objective for optimize.minimize(..., jac=True)
+    # cost and gradient come from the same (batched) forward pass
+    def cost_and_grad(self, theta, data):
+
+        #scipy passes a float64 theta, convert it once so the matrix products run in the compute dtype
+        theta = np.asarray(theta, dtype=self.dtype)
+        W1, b1, W2, b2 = self.unpackTheta(theta)
+        size_data = data.shape[1]
+
+        a2, a3 = self.forward_pass_for_batch(data, W1, b1, W2, b2)
+
+        tot_sqr_err = 0.5 * np.sum((a3-data)**2, dtype=np.float64)/size_data
+
+        delta3 = -(data - a3) * self.dsigmoid(a3)
+        delta2 = np.dot(W2.T, delta3) * self.dsigmoid(a2)
+
+        d_W2 = np.dot(delta3, a2.T)/size_data
+        d_b2 = np.sum(delta3, axis=1)/size_data
+        d_W1 = np.dot(delta2, data.T)/size_data
+        d_b1 = np.sum(delta2, axis=1)/size_data
+
+        #L-BFGS-B only takes a float64 gradient
+        return tot_sqr_err, self.packTheta(d_W1, d_b1, d_W2, d_b2).astype(np.float64)
+
     # back_propagation method uses Scipy optimize.minimize method to optimize Theta
     # fun - Cost function, x0 - initial Theta value, jac - gradient of cost function, method - optimization technique
     ''' Values shown by optimize.minimize when 'disp' = true
@@ -174,17 +204,17 @@ class SimpleAutoEncoder(object):
     def back_prop_with_SGD(self, iter=1500):
         #m_b_data = self.renew_dataset()
         init_val = self.packTheta(self.W1,self.b1,self.W2,self.b2)
-        res = optimize.minimize(fun=self.cost, x0=init_val, args=(self.renew_dataset(),), jac=self.cost_prime, method='L-BFGS-B', options={'maxiter':iter,'disp':True})
+        res = optimize.minimize(fun=self.cost_and_grad, x0=init_val, args=(self.renew_dataset(),), jac=True, method='L-BFGS-B', options={'maxiter':iter,'disp':True})
         #err = optimize.check_grad(func=self.cost, x0=args, grad=self.cost_prime)
         #print err
-        self.W1, self.b1, self.W2, self.b2 = self.unpackTheta(res.x)
+        self.W1, self.b1, self.W2, self.b2 = self.unpackTheta(np.asarray(res.x, dtype=self.dtype))
 
     def back_prop(self, iter=1100):
         init_val = self.packTheta(self.W1, self.b1, self.W2, self.b2)
-        res = optimize.minimize(fun=self.cost, x0=init_val, args=(self.X,), jac=self.cost_prime, method='L-BFGS-B', options={'maxiter':iter,'disp':True})
+        res = optimize.minimize(fun=self.cost_and_grad, x0=init_val, args=(self.X,), jac=True, method='L-BFGS-B', options={'maxiter':iter,'disp':True})
         #err = optimize.check_grad(func=self.cost, x0=args, grad=self.cost_prime)
         #print err
-        self.W1, self.b1, self.W2, self.b2 = self.unpackTheta(res.x)
+        self.W1, self.b1, self.W2, self.b2 = self.unpackTheta(np.asarray(res.x, dtype=self.dtype))
 
     def check_grad_manual(self,epsilon=0.000001):
         theta = self.packTheta(self.W1, self.b1, self.W2, self.b2)
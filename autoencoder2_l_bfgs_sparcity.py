@@ -7,6 +7,7 @@ from scipy import optimize
 from scipy import misc
 from numpy import linalg as LA
 from PIL import Image
+from MiniBatchSampler import MiniBatchSampler
 
 class SimpleAutoEncoder(object):
 
@@ -33,8 +34,10 @@ class SimpleAutoEncoder(object):
     #__init__ is called when the constructor of an object is called (i.e. created an object)
 
     #by reducing number of hidden from 400 -> 75 and hidden2 200 -> 25 got an error reduction of 540+ -> 387 (for numbers dataset)
-    def __init__(self, n_inputs=810, n_hidden=90, W1=None, W2=None, b1=None, b2=None, m_batch_size=30):
-        self.X = np.zeros((810, 40), dtype=np.float32)
+    #dtype is the compute dtype used for the weights, data and mini-batches
+    def __init__(self, n_inputs=810, n_hidden=90, W1=None, W2=None, b1=None, b2=None, m_batch_size=30, seed=None, dtype=np.float32):
+        self.dtype = np.dtype(dtype)
+        self.X = np.zeros((810, 40), dtype=self.dtype)
 
         #define global variables for n_inputs and n_hidden
         self.n_hidden = n_hidden
@@ -42,33 +45,34 @@ class SimpleAutoEncoder(object):
         self.n_outputs = n_inputs
 
         self.m_batch_size = m_batch_size
-        self.min_batch_X = np.zeros((n_inputs, m_batch_size), dtype=np.float32)
+        self.min_batch_X = np.zeros((n_inputs, m_batch_size), dtype=self.dtype)
+        self.sampler = MiniBatchSampler(m_batch_size, seed=seed, dtype=self.dtype)
 
         self.lam = 0.0001
         self.beta = 0.5
         self.rho = 0.25
 
-        self.rho_nh = np.zeros((self.n_hidden,),dtype=np.float32)
+        self.rho_nh = np.zeros((self.n_hidden,),dtype=self.dtype)
 
         #generate random weights for W
         if W1 == None:
             val_range1 = [-math.sqrt(6.0/(n_inputs+n_hidden+1)), math.sqrt(6.0/(n_inputs+n_hidden+1))]
             W1 = val_range1[0] + np.random.random_sample((n_hidden, n_inputs))*2.0*val_range1[1]
-            self.W1 = W1
+            self.W1 = np.asarray(W1, dtype=self.dtype)
 
         if W2 == None:
             val_range2 = [-math.sqrt(24.0/(self.n_outputs+n_hidden+1)), math.sqrt(24.0/(self.n_outputs+n_hidden+1))]
             W2 = val_range2[0] + np.random.random_sample((self.n_outputs, n_hidden))*2.0*val_range2[1]
-            self.W2 = W2
+            self.W2 = np.asarray(W2, dtype=self.dtype)
 
         #by introducing *0.05 to b1 initialization got an error dropoff from 360 -> 280
         if b1 == None:
             b1 = -0.01 + np.random.random_sample((n_hidden,)) * 0.02
-            self.b1 = b1
+            self.b1 = np.asarray(b1, dtype=self.dtype)
 
         if b2 == None:
             b2 = -0.02 + np.random.random_sample((self.n_outputs,)) * 0.04
-            self.b2 = b2
+            self.b2 = np.asarray(b2, dtype=self.dtype)
 
 
 
@@ -81,22 +85,13 @@ class SimpleAutoEncoder(object):
             imgVec = np.reshape(img, (810, 1))
             self.X[:, i-1] = imgVec[:, 0]
 
-        self.X = self.X/255.0
+        self.X = np.asarray(self.X/255.0, dtype=self.dtype)
         #mean_X = np.mean(self.X, axis=0)
         #for i in range(self.X.shape[1]):
         #    self.X[:,i] = self.X[:,i]-mean_X[i,]
 
     def renew_dataset(self):
-        sel_idx = []
-        tmp_data = np.zeros((self.X.shape[0],self.m_batch_size),dtype=np.float32)
-        for dIdx in range(self.m_batch_size):
-            while True:
-                tmp_idx = np.random.randint(self.X.shape[1])
-                if tmp_idx not in sel_idx:
-                    sel_idx.append(tmp_idx)
-                    tmp_data[:, dIdx] = self.X[:, tmp_idx]
-                    break
-        return tmp_data
+        return self.sampler.sample(self.X)
 
     def forward_pass_for_one_case(self, x, W1, b1, W2, b2):
 
@@ -108,6 +103,17 @@ class SimpleAutoEncoder(object):
 
         return a2, a3
 
+    #same as forward_pass_for_one_case but X holds one example per column
+    def forward_pass_for_batch(self, X, W1, b1, W2, b2):
+
+        z2 = np.dot(W1, X) + b1[:, None]
+        a2 = self.sigmoid(z2)
+
+        z3 = np.dot(W2, a2) + b2[:, None]
+        a3 = self.sigmoid(z3)
+
+        return a2, a3
+
     def packTheta(self, W1, b1, W2, b2):
         theta_p1 = np.concatenate((np.reshape(W1, (self.n_hidden*self.n_inputs,)), b1))
         theta_p2 = np.concatenate((np.reshape(W2, (self.n_outputs*self.n_hidden,)), b2))
@@ -186,6 +192,35 @@ class SimpleAutoEncoder(object):
 
         return self.packTheta(d_W1, d_b1, d_W2, d_b2)
 
+    # fused objective for optimize.minimize(..., jac=True)
+    # cost and gradient come from the same (batched) forward pass, and rho_nh is
+    # calculated here instead of being left behind by cost
+    def cost_and_grad(self, theta, data):
+
+        #scipy passes a float64 theta, convert it once so the matrix products run in the compute dtype
+        theta = np.asarray(theta, dtype=self.dtype)
+        W1, b1, W2, b2 = self.unpackTheta(theta)
+        size_data = data.shape[1]
+
+        a2, a3 = self.forward_pass_for_batch(data, W1, b1, W2, b2)
+
+        self.rho_nh = (0.001 + np.sum(a2, axis=1))/size_data
+
+        sqr_err = 0.5 * np.sum((a3-data)**2, dtype=np.float64)/size_data
+        w_decay = (self.lam/2)*(np.sum(W1**2, dtype=np.float64) + np.sum(W2**2, dtype=np.float64))
+        tot_err = sqr_err + w_decay + self.beta*np.sum(self.kl_diverg(self.rho,self.rho_nh), dtype=np.float64)
+
+        delta3 = -(data - a3) * self.dsigmoid(a3)
+        delta2 = (np.dot(W2.T, delta3) + self.beta*self.d_kl_diverg(self.rho,self.rho_nh)[:, None]) * self.dsigmoid(a2)
+
+        d_W2 = (np.dot(delta3, a2.T)/size_data) + (self.lam * W2)
+        d_b2 = np.sum(delta3, axis=1)/size_data
+        d_W1 = (np.dot(delta2, data.T)/size_data) + (self.lam * W1)
+        d_b1 = np.sum(delta2, axis=1)/size_data
+
+        #L-BFGS-B only takes a float64 gradient
+        return tot_err, self.packTheta(d_W1, d_b1, d_W2, d_b2).astype(np.float64)
+
     # back_propagation method uses Scipy optimize.minimize method to optimize Theta
     # fun - Cost function, x0 - initial Theta value, jac - gradient of cost function, method - optimization technique
     ''' Values shown by optimize.minimize when 'disp' = true
@@ -199,15 +234,15 @@ class SimpleAutoEncoder(object):
     def back_prop_with_SGD(self, iter=1500):
         #m_b_data = self.renew_dataset()
         init_val = self.packTheta(self.W1,self.b1,self.W2,self.b2)
-        res = optimize.minimize(fun=self.cost, x0=init_val, args=(self.renew_dataset(),), jac=self.cost_prime, method='L-BFGS-B', options={'maxiter':iter,'disp':True})
+        res = optimize.minimize(fun=self.cost_and_grad, x0=init_val, args=(self.renew_dataset(),), jac=True, method='L-BFGS-B', options={'maxiter':iter,'disp':True})
         #err = optimize.check_grad(func=self.cost, x0=args, grad=self.cost_prime)
         #print err
-        self.W1, self.b1, self.W2, self.b2 = self.unpackTheta(res.x)
+        self.W1, self.b1, self.W2, self.b2 = self.unpackTheta(np.asarray(res.x, dtype=self.dtype))
 
     def back_prop(self, iter=1000):
         init_val = self.packTheta(self.W1, self.b1, self.W2, self.b2)
-        res = optimize.minimize(fun=self.cost, x0=init_val, args=(self.X,), jac=self.cost_prime, method='L-BFGS-B', options={'maxiter':iter,'disp':True})
-        self.W1, self.b1, self.W2, self.b2 = self.unpackTheta(res.x)
+        res = optimize.minimize(fun=self.cost_and_grad, x0=init_val, args=(self.X,), jac=True, method='L-BFGS-B', options={'maxiter':iter,'disp':True})
+        self.W1, self.b1, self.W2, self.b2 = self.unpackTheta(np.asarray(res.x, dtype=self.dtype))
 
     def test_back_prop_with_diff_grad_checks(self, iter=200):
         eps = math.sqrt(np.finfo(float).eps)
@@ -216,25 +251,25 @@ class SimpleAutoEncoder(object):
         err = optimize.check_grad(self.cost, self.cost_prime, init_val, self.X)
         print ("Error after 0 iterations: %f, Error per Param: %f" % (err, err/init_val.size))
         res = optimize.minimize(fun=self.cost, x0=init_val, args=(self.X,), jac=self.cost_prime, method='L-BFGS-B', options={'maxiter':iter})
-        self.W1, self.b1, self.W2, self.b2 = self.unpackTheta(res.x)
+        self.W1, self.b1, self.W2, self.b2 = self.unpackTheta(np.asarray(res.x, dtype=self.dtype))
 
         err = optimize.check_grad(self.cost, self.cost_prime, init_val, self.X)
         print ("Error after 200 iterations: %f, Error per Param: %f" % (err, err/init_val.size))
         init_val = res.x
         res = optimize.minimize(fun=self.cost, x0=init_val, args=(self.X,), jac=self.cost_prime, method='L-BFGS-B', options={'maxiter':iter})
-        self.W1, self.b1, self.W2, self.b2 = self.unpackTheta(res.x)
+        self.W1, self.b1, self.W2, self.b2 = self.unpackTheta(np.asarray(res.x, dtype=self.dtype))
 
         err = optimize.check_grad(self.cost, self.cost_prime, init_val, self.X)
         print ("Error after 400 iterations: %f, Error per Param: %f" % (err, err/init_val.size))
         init_val = res.x
         res = optimize.minimize(fun=self.cost, x0=init_val, args=(self.X,), jac=self.cost_prime, method='L-BFGS-B', options={'maxiter':iter})
-        self.W1, self.b1, self.W2, self.b2 = self.unpackTheta(res.x)
+        self.W1, self.b1, self.W2, self.b2 = self.unpackTheta(np.asarray(res.x, dtype=self.dtype))
 
         err = optimize.check_grad(self.cost, self.cost_prime, init_val, self.X)
         print ("Error after 600 iterations: %f, Error per Param: %f" % (err, err/init_val.size))
         init_val = res.x
         res = optimize.minimize(fun=self.cost, x0=init_val, args=(self.X,), jac=self.cost_prime, method='L-BFGS-B', options={'maxiter':iter})
-        self.W1, self.b1, self.W2, self.b2 = self.unpackTheta(res.x)
+        self.W1, self.b1, self.W2, self.b2 = self.unpackTheta(np.asarray(res.x, dtype=self.dtype))
 
         err = optimize.check_grad(self.cost, self.cost_prime, init_val, self.X)
         print ("Error after 800 iterations: %f, Error per Param: %f" % (err, err/init_val.size))
@@ -21,6 +21,9 @@ import time
 import sys,getopt
 
 from utils import tile_raster_images
+from MaxActivation import maximize_activations
+from BinaryDataset import has_binary_dataset, load_binary_dataset, load_split, split_path, SPLITS
+from StreamingData import StreamingDataset, n_examples, window_index
 
 try:
     import PIL.Image as Image
@@ -121,31 +124,40 @@ class StackedAutoencoder(object):
         self.error = self.softmax.get_error(self.y)
 
 
-    def load_data(self,dir_name='DataCifar',):
-
-        train_names = ['data_batch_1','data_batch_2','data_batch_3','data_batch_4']
-        valid_name = 'data_batch_5'
-        test_name = 'test_batch'
-
-        train_data = []
-        train_labels = []
-        for file_path in train_names:
-            f = open(dir_name + os.sep +file_path, 'rb')
+    #dir_name can also be the prefix of a dataset converted with BinaryDataset.py, which is memory mapped
+    #window_size - if given, the training set is streamed through a shared window of that many examples
+    def load_data(self,dir_name='DataCifar',window_size=None):
+
+        if window_size is not None and has_binary_dataset(dir_name):
+            #the training set stays memory mapped and is streamed window by window (see StreamingDataset)
+            train_set = load_split(split_path(dir_name, 'train'))
+            valid_set, test_set = load_binary_dataset(dir_name, config.floatX, SPLITS[1:])
+        elif has_binary_dataset(dir_name):
+            train_set, valid_set, test_set = load_binary_dataset(dir_name, config.floatX)
+        else:
+            train_names = ['data_batch_1','data_batch_2','data_batch_3','data_batch_4']
+            valid_name = 'data_batch_5'
+            test_name = 'test_batch'
+
+            train_data = []
+            train_labels = []
+            for file_path in train_names:
+                f = open(dir_name + os.sep +file_path, 'rb')
+                dict = cPickle.load(f)
+                train_data.extend(dict.get('data')/255.)
+                train_labels.extend(dict.get('labels'))
+
+            train_set = [train_data,train_labels]
+
+            f = open(dir_name + os.sep +valid_name, 'rb')
             dict = cPickle.load(f)
-            train_data.extend(dict.get('data')/255.)
-            train_labels.extend(dict.get('labels'))
-
-        train_set = [train_data,train_labels]
+            valid_set = [dict.get('data')/255.,dict.get('labels')]
 
-        f = open(dir_name + os.sep +valid_name, 'rb')
-        dict = cPickle.load(f)
-        valid_set = [dict.get('data')/255.,dict.get('labels')]
-
-        f = open(dir_name + os.sep +test_name, 'rb')
-        dict = cPickle.load(f)
-        test_set = [dict.get('data')/255.,dict.get('labels')]
+            f = open(dir_name + os.sep +test_name, 'rb')
+            dict = cPickle.load(f)
+            test_set = [dict.get('data')/255.,dict.get('labels')]
 
-        f.close()
+            f.close()
 
 
         def get_shared_data(data_xy):
@@ -156,7 +168,11 @@ class StackedAutoencoder(object):
             return shared_x,T.cast(shared_y,'int32')
 
 
-        train_x,train_y = get_shared_data(train_set)
+        #with window_size only a window of the training set is kept in a shared variable
+        if window_size is None:
+            train_x,train_y = get_shared_data(train_set)
+        else:
+            train_x,train_y = StreamingDataset(train_set[0], train_set[1], window_size, self.batch_size, *train_set[2:]).get_shared_data()
         valid_x,valid_y = get_shared_data(valid_set)
         test_x,test_y = get_shared_data(test_set)
 
@@ -165,27 +181,40 @@ class StackedAutoencoder(object):
 
         return all_data
 
-    def load_data_bw(self,dir_name='DataCifar',):
+    #dir_name can also be the prefix of a dataset converted with BinaryDataset.py, which is memory mapped
+    #window_size - if given, the training set is streamed through a shared window of that many examples
+    def load_data_bw(self,dir_name='DataCifar',window_size=None):
 
-        train_names = 'train_set_bw'
-        valid_name = 'valid_set_bw'
-        test_name = 'test_set_bw'
+        #grayscale dataset written by makegrayscale.py in to the data folder
+        if not has_binary_dataset(dir_name) and has_binary_dataset(dir_name + os.sep + 'cifar_bw'):
+            dir_name = dir_name + os.sep + 'cifar_bw'
 
+        if window_size is not None and has_binary_dataset(dir_name):
+            #the training set stays memory mapped and is streamed window by window (see StreamingDataset)
+            train_set = load_split(split_path(dir_name, 'train'))
+            valid_set, test_set = load_binary_dataset(dir_name, config.floatX, SPLITS[1:])
+        elif has_binary_dataset(dir_name):
+            train_set, valid_set, test_set = load_binary_dataset(dir_name, config.floatX)
+        else:
+            train_names = 'train_set_bw'
+            valid_name = 'valid_set_bw'
+            test_name = 'test_set_bw'
 
-        f = open(dir_name + os.sep +train_names, 'rb')
-        train_data_ls,train_labels = cPickle.load(f)
-        train_data = np.asarray(train_data_ls)/255.
-        train_set = [train_data,train_labels]
 
-        f = open(dir_name + os.sep +valid_name, 'rb')
-        valid_data,valid_labels = cPickle.load(f)
-        valid_set = [valid_data/255.,valid_labels]
+            f = open(dir_name + os.sep +train_names, 'rb')
+            train_data_ls,train_labels = cPickle.load(f)
+            train_data = np.asarray(train_data_ls)/255.
+            train_set = [train_data,train_labels]
 
-        f = open(dir_name + os.sep +test_name, 'rb')
-        test_data,test_labels = cPickle.load(f)
-        test_set = [test_data/255.,test_labels]
+            f = open(dir_name + os.sep +valid_name, 'rb')
+            valid_data,valid_labels = cPickle.load(f)
+            valid_set = [valid_data/255.,valid_labels]
 
-        f.close()
+            f = open(dir_name + os.sep +test_name, 'rb')
+            test_data,test_labels = cPickle.load(f)
+            test_set = [test_data/255.,test_labels]
+
+            f.close()
 
 
         def get_shared_data(data_xy):
@@ -196,7 +225,11 @@ class StackedAutoencoder(object):
             return shared_x,T.cast(shared_y,'int32')
 
 
-        train_x,train_y = get_shared_data(train_set)
+        #with window_size only a window of the training set is kept in a shared variable
+        if window_size is None:
+            train_x,train_y = get_shared_data(train_set)
+        else:
+            train_x,train_y = StreamingDataset(train_set[0], train_set[1], window_size, self.batch_size, *train_set[2:]).get_shared_data()
         valid_x,valid_y = get_shared_data(valid_set)
         test_x,test_y = get_shared_data(test_set)
 
@@ -289,7 +322,7 @@ class StackedAutoencoder(object):
         (valid_set_x, valid_set_y) = datasets[1]
         (test_set_x, test_set_y) = datasets[2]
 
-        n_train_batches = train_set_x.get_value(borrow=True).shape[0] / batch_size
+        n_train_batches = n_examples(train_set_x) / batch_size
 
         pre_train_fns = self.greedy_pre_training(train_set_x, batch_size=self.batch_size,pre_lr=pre_lr,denoising=denoising)
 
@@ -300,7 +333,7 @@ class StackedAutoencoder(object):
             for epoch in xrange(pre_epochs):
                 c=[]
                 for batch_index in xrange(n_train_batches):
-                    c.append(pre_train_fns[i](index=batch_index, lam=lam, beta=beta, rho=rho))
+                    c.append(pre_train_fns[i](index=window_index(train_set_x, batch_index), lam=lam, beta=beta, rho=rho))
 
                 print 'Training epoch %d, cost ' % epoch,
                 print np.mean(c)
@@ -337,7 +370,7 @@ class StackedAutoencoder(object):
             epoch = epoch + 1
             fine_tune_cost = []
             for mini_index in xrange(n_train_batches):
-                cost = fine_tune_fn(index=mini_index,lam=lam)
+                cost = fine_tune_fn(index=window_index(train_set_x, mini_index),lam=lam)
                 fine_tune_cost.append(cost)
                 #what's the role of iter? iter acts as follows
                 #in first epoch, iter for minibatch 'x' is x
@@ -441,64 +474,21 @@ class StackedAutoencoder(object):
     def sigmoid(self, x):
         return 1.0 / (1.0 + np.exp(-x))
 
-    def cost(self,input,theta_as_blocks,layer_idx,index):
-
-        layer_input = input
-        for i in xrange(layer_idx):
-            a = self.sigmoid(np.dot(layer_input,theta_as_blocks[i][0]) + theta_as_blocks[i][1])
-            layer_input = a
-
-        cost = self.sigmoid(np.dot(layer_input,theta_as_blocks[layer_idx][0]) + theta_as_blocks[layer_idx][1])[index]
-        #print "         Cost for node %i in layer %i is %f" %(index,layer_idx,cost)
-        return -cost
-
-    def cost_prime(self, input, theta_as_blocks, layer_idx, index):
-        prime = optimize.approx_fprime(input, self.cost, 0.00000001, theta_as_blocks, layer_idx, index)
-        return prime
-
     def get_max_activations(self,input,threshold,layer_idx):
 
-        #constraint for x
-        def con_x_norm(x,threshold):
-            return threshold-LA.norm(x)
-        cons = {'type': 'ineq','fun': con_x_norm,'args': (threshold,)}
-
         print 'Calculating max activations for layer %i...\n' % layer_idx
 
-        input_arr = input.get_value()
-        max_inputs = []
-
-        print 'Getting max activations for layer %i\n' % layer_idx
         #creating the ndarray from symbolic theta
         theta_as_blocks_arr = []
-
-        print 'Getting theta_as_blocks for layer %i' % layer_idx
         for k in xrange(layer_idx+1):
-            print '     Getting thetas for layer %i' % k
             theta_as_blocks_arr.append([self.thetas_as_blocks[k][0].get_value(),self.thetas_as_blocks[k][1].get_value()])
 
-        print '\nPerforming optimization (SLSQP) for layer %i...' % layer_idx
-
-        printed_50 = False
-        printed_90 = False
-        for j in xrange(self.h_sizes[layer_idx]):
-            #print '     Getting max input for node %i in layer %i' % (j, i)
-            init_val = input_arr
-            res = optimize.minimize(fun=self.cost, x0=init_val, args=(theta_as_blocks_arr,layer_idx,j),
-                                    jac=self.cost_prime, method='SLSQP', constraints=cons, options={'maxiter': 5})
-
-            if LA.norm(res.x) > threshold:
-                print '     Threshold exceeded node %i layer %i norm %f/%f' % (j, layer_idx, LA.norm(res.x), threshold)
-            max_inputs.append(res.x)
-
-            if j*1.0/self.h_sizes[layer_idx] > .9 and not printed_90:
-                print '     90% completed...'
-                printed_90 = True
-            elif j*1.0/self.h_sizes[layer_idx] > .5 and not printed_50:
-                print '     50% completed...'
-                printed_50 = True
+        #all the nodes of the layer are optimized together with analytic gradients (see MaxActivation)
+        start_time = time.clock()
+        max_inputs, max_acts = maximize_activations(theta_as_blocks_arr, input.get_value(), threshold, None)
+        print 'Max activations for layer %i: mean %f, min %f (%f s)' %(layer_idx, np.mean(max_acts), np.min(max_acts), time.clock()-start_time)
 
-        return np.asarray(max_inputs)
+        return max_inputs
 
 
 if __name__ == '__main__':
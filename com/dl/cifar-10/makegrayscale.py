@@ -3,59 +3,91 @@ __author__ = 'Thushan Ganegedara'
 import numpy as np
 import gzip,cPickle
 import os
+import sys,getopt
 from PIL import Image
 
+from BinaryDataset import write_split_batches, split_path
+
+# Converts the CIFAR-10 batches to grayscale and writes them in the BinaryDataset format
+# (<dir_name>/cifar_bw_{train,valid,test}.bin), which SdaCifarGPU.load_data_bw memory maps.
+# The batch files are converted and written one at a time, so only one batch is in memory.
+# uint8 pixels are stored with scale 1/255., float32 ones are stored as 0-255 values with scale 1/255. as well
+
+# weights of the R, G and B planes
+GRAY_WEIGHTS = np.asarray([0.2989, 0.5870, 0.1140], dtype=np.float32)
+BW_PREFIX = 'cifar_bw'
+
 class MakeGrayScale(object):
-    def load_data(self,dir_name='DataCifar'):
 
-        train_names = ['data_batch_1','data_batch_2','data_batch_3','data_batch_4']
-        valid_name = 'data_batch_5'
-        test_name = 'test_batch'
+    train_names = ['data_batch_1','data_batch_2','data_batch_3','data_batch_4']
+    valid_names = ['data_batch_5']
+    test_names = ['test_batch']
 
-        train_data = []
-        train_labels = []
-        for file_path in train_names:
-            f = open(dir_name + os.sep +file_path, 'rb')
+    def load_batch(self,file_path):
+        with open(file_path, 'rb') as f:
             dict = cPickle.load(f)
-            train_data.extend(self.turn_gray(dict.get('data')))
-            train_labels.extend(dict.get('labels'))
-            print "completed train"
-        train_set = [train_data,train_labels]
+        return dict.get('data'), dict.get('labels')
 
-        f = open(dir_name + os.sep +valid_name, 'rb')
-        dict = cPickle.load(f)
-        valid_set = [self.turn_gray(dict.get('data')),dict.get('labels')]
-        print "completed valid"
+    # (gray rows, labels) of every file in turn
+    def gray_batches(self,dir_name,file_names,dtype=np.float32):
+        for file_name in file_names:
+            data, labels = self.load_batch(dir_name + os.sep + file_name)
+            yield self.turn_gray(data,dtype), labels
+            print "completed %s" % file_name
 
-        f = open(dir_name + os.sep +test_name, 'rb')
-        dict = cPickle.load(f)
-        test_set = [self.turn_gray(dict.get('data')),dict.get('labels')]
-        print "completed test"
+    def load_data(self,dir_name='DataCifar',dtype=np.float32):
 
-        f.close()
+        all_sets = []
+        for file_names in [self.train_names, self.valid_names, self.test_names]:
+            batches = list(self.gray_batches(dir_name,file_names,dtype))
+            data = np.concatenate([data for data,labels in batches])
+            labels = np.concatenate([labels for data,labels in batches])
+            all_sets.append([data,labels])
 
-        return [train_set,valid_set,test_set]
+        return all_sets
 
+    # data - (rows, 3072) with the R, G and B planes of 1024 pixels each
+    # the three planes are weighted with one matrix product, uint8 results are rounded
+    def turn_gray(self,data,dtype=np.float32):
 
-    def turn_gray(self,data):
+        rows = data.shape[0]
+        gray = np.dot(GRAY_WEIGHTS, data.reshape(rows,3,1024).astype(np.float32))
 
-        rows = data.shape[0];
-        result = np.empty((rows,1024),dtype=np.float16)
+        if np.dtype(dtype) == np.uint8:
+            return np.rint(gray).astype(np.uint8)
+        return gray.astype(dtype)
 
-        for i in xrange(1024):
-            gray = 0.2989 * data[:,i] + 0.5870 * data[:,i+1024] + 0.1140 * data[:,i+2048]
-            result[:,i] = gray
+    # writes the three splits to <prefix>_{train,valid,test}.bin
+    def convert(self,dir_name='DataCifar',prefix=None,dtype=np.uint8):
+        if prefix is None:
+            prefix = dir_name + os.sep + BW_PREFIX
 
-        return result
+        for split, file_names in zip(['train','valid','test'], [self.train_names, self.valid_names, self.test_names]):
+            write_split_batches(split_path(prefix,split), self.gray_batches(dir_name,file_names,dtype), 1024, dtype, 1/255.)
+            print "Wrote %s" % split_path(prefix,split)
 
     def save_to_pickle(self,data,f_name):
         with open(f_name, 'wb') as handle:
             cPickle.dump(data, handle)
 
 if __name__ == '__main__':
-    mgs = MakeGrayScale()
-    tr_set, v_set, te_set = mgs.load_data()
-    mgs.save_to_pickle(tr_set,'train_set_bw')
-    mgs.save_to_pickle(v_set,'valid_set_bw')
-    mgs.save_to_pickle(te_set,'test_set_bw')
+    #-d <data_folder> (DataCifar by default) -o <prefix> (<data_folder>/cifar_bw by default) --float32 (uint8 by default)
+    try:
+        opts,args = getopt.getopt(sys.argv[1:],"d:o:",["float32"])
+    except getopt.GetoptError:
+        print 'makegrayscale.py -d <data_folder> -o <prefix> [--float32]'
+        sys.exit(2)
+
+    dir_name = 'DataCifar'
+    prefix = None
+    dtype = np.uint8
+    for opt,arg in opts:
+        if opt == '-d':
+            dir_name = arg
+        elif opt == '-o':
+            prefix = arg
+        elif opt == '--float32':
+            dtype = np.float32
 
+    mgs = MakeGrayScale()
+    mgs.convert(dir_name,prefix,dtype)
@@ -0,0 +1,179 @@
+__author__ = 'Thushan Ganegedara'
+
+import os
+import shutil
+import tempfile
+import time
+import multiprocessing
+import numpy as np
+
+# Finds, for every hidden unit of a layer at once, an input that maximizes the unit's activation
+# (projected gradient ascent). Row j of the input matrix X belongs to unit j, so one forward pass of X
+# through the sigmoid layers gives all activations, and the gradient of sum_j a[j,j] is one backward pass
+# with exact (analytic) gradients instead of finite differences.
+# After every step each row is clipped to the bounds and scaled back on to the ball ||x|| <= threshold.
+
+def sigmoid(x):
+    return 1.0 / (1.0 + np.exp(-x))
+
+# activations of every layer for the rows of X
+# thetas - [W, b] of the layers from the input up to the layer of interest, W has shape (n_in, n_out)
+def forward(X, thetas):
+    acts = [X]
+    for W, b in thetas:
+        acts.append(sigmoid(np.dot(acts[-1], W) + b))
+    return acts
+
+# gradient of sum_j acts[-1][j,j] with respect to the input rows
+def backward(acts, thetas):
+    a = acts[-1]
+    units = np.arange(a.shape[0])
+    W = thetas[-1][0]
+
+    #only a[j,j] depends on row j through the last layer, so its delta is a row scaled column of W
+    d_a = (a[units, units] * (1 - a[units, units]))[:, None] * W.T
+
+    for k in xrange(len(thetas) - 2, -1, -1):
+        a = acts[k + 1]
+        d_a = np.dot(d_a * a * (1 - a), thetas[k][0].T)
+    return d_a
+
+def project(X, threshold, bounds=None):
+    if bounds is not None:
+        np.clip(X, bounds[:, 0], bounds[:, 1], out=X)
+    norms = np.sqrt(np.sum(X**2, axis=1))
+    scale = np.minimum(1.0, threshold / np.maximum(norms, 1e-12))
+    X *= scale[:, None]
+    return X
+
+# thetas - see forward, the units of the last layer are maximized
+# init - (n_inputs,) starting input used for every unit, or (n_units, n_inputs)
+# bounds - optional list of (lower, upper) for every input
+# step - length of each (normalized) gradient step, threshold/20 by default
+# time_budget - optional seconds per unit, the iterations stop early once n_units*time_budget is used
+# returns the best input found for every unit (n_units, n_inputs) and its activation
+def maximize_activations(thetas, init, threshold, bounds=None, n_iter=100, step=None, dtype=np.float32, time_budget=None):
+    thetas = [(np.asarray(W, dtype=dtype), np.asarray(b, dtype=dtype)) for W, b in thetas]
+    n_units = thetas[-1][0].shape[1]
+    units = np.arange(n_units)
+    if bounds is not None:
+        bounds = np.asarray(bounds, dtype=dtype)
+    if step is None:
+        step = threshold / 20.0
+
+    X = np.empty((n_units, thetas[0][0].shape[0]), dtype=dtype)
+    X[...] = init
+    project(X, threshold, bounds)
+
+    best_X = X.copy()
+    best_act = np.full((n_units,), -np.inf)
+
+    start_time = time.time()
+    for it in xrange(n_iter):
+        if time_budget is not None and time.time() - start_time > time_budget * n_units:
+            break
+
+        acts = forward(X, thetas)
+        act = acts[-1][units, units]
+
+        improved = act > best_act
+        best_act[improved] = act[improved]
+        best_X[improved] = X[improved]
+
+        grad = backward(acts, thetas)
+        g_norms = np.sqrt(np.sum(grad**2, axis=1))
+        X += (step / np.maximum(g_norms, 1e-12))[:, None] * grad
+        project(X, threshold, bounds)
+
+    act = forward(X, thetas)[-1][units, units]
+    improved = act > best_act
+    best_act[improved] = act[improved]
+    best_X[improved] = X[improved]
+
+    return best_X, best_act
+
+# Parallel version for large layers: the units are split in to chunks of chunk_size, which are solved by a pool of
+# n_workers processes. The weight blocks are written once to .npy files and every worker opens them with
+# mmap_mode='r', so all processes share the same read-only pages instead of receiving a copy per task.
+# Chunks are returned as they finish (not in order) and passed to callback(units, X, act), e.g. to save
+# the filter images of those units right away, and the progress (units done, units/s, eta) is printed.
+# Returns the same as maximize_activations.
+
+# set in every worker by init_worker
+worker_thetas = None
+worker_options = None
+
+def init_worker(theta_files, options):
+    global worker_thetas, worker_options
+    worker_thetas = [(np.load(w_file, mmap_mode='r'), np.load(b_file, mmap_mode='r')) for w_file, b_file in theta_files]
+    worker_options = options
+
+# max activations of the given units of the last layer
+def solve_units(units):
+    init, threshold, bounds, n_iter, step, dtype, time_budget = worker_options
+    W, b = worker_thetas[-1]
+    thetas = worker_thetas[:-1] + [(W[:, units], b[units])]
+    if init.ndim == 2:
+        init = init[units]
+
+    X, act = maximize_activations(thetas, init, threshold, bounds, n_iter, step, dtype, time_budget)
+    return units, X, act
+
+def maximize_activations_parallel(thetas, init, threshold, bounds=None, n_iter=100, step=None, dtype=np.float32,
+                                  time_budget=None, n_workers=None, chunk_size=16, callback=None):
+    if n_workers is None:
+        n_workers = multiprocessing.cpu_count()
+
+    n_units = thetas[-1][0].shape[1]
+    init = np.asarray(init, dtype=dtype)
+    if bounds is not None:
+        bounds = np.asarray(bounds, dtype=dtype)
+
+    chunks = [np.arange(sIdx, min(sIdx + chunk_size, n_units)) for sIdx in xrange(0, n_units, chunk_size)]
+    best_X = np.empty((n_units, thetas[0][0].shape[0]), dtype=dtype)
+    best_act = np.empty((n_units,))
+
+    start_time = time.time()
+    tmp_dir = tempfile.mkdtemp(prefix='max_act_')
+    pool = None
+    try:
+        theta_files = []
+        for k, (W, b) in enumerate(thetas):
+            w_file = os.path.join(tmp_dir, 'W_%i.npy' % k)
+            b_file = os.path.join(tmp_dir, 'b_%i.npy' % k)
+            np.save(w_file, np.asarray(W, dtype=dtype))
+            np.save(b_file, np.asarray(b, dtype=dtype))
+            theta_files.append((w_file, b_file))
+        options = (init, threshold, bounds, n_iter, step, dtype, time_budget)
+
+        if n_workers > 1:
+            pool = multiprocessing.Pool(n_workers, init_worker, (theta_files, options))
+            results = pool.imap_unordered(solve_units, chunks)
+        else:
+            init_worker(theta_files, options)
+            results = (solve_units(units) for units in chunks)
+
+        n_done = 0
+        for units, X, act in results:
+            best_X[units] = X
+            best_act[units] = act
+            n_done += len(units)
+
+            if callback is not None:
+                callback(units, X, act)
+
+            elapsed = time.time() - start_time
+            rate = n_done / max(elapsed, 1e-12)
+            print '     %i/%i units (%.1f%%), %.2f units/s, elapsed %.1f s, eta %.1f s, mean activation %f' \
+                  %(n_done, n_units, 100.0*n_done/n_units, rate, elapsed, (n_units-n_done)/rate, np.mean(act))
+
+        if pool is not None:
+            pool.close()
+            pool.join()
+            pool = None
+    finally:
+        if pool is not None:
+            pool.terminate()
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+
+    return best_X, best_act
@@ -23,6 +23,9 @@ import time
 import sys,getopt
 
 from utils import tile_raster_images
+from MaxActivation import maximize_activations_parallel
+from BinaryDataset import has_binary_dataset, load_binary_dataset, load_split, split_path, SPLITS
+from StreamingData import StreamingDataset, n_examples, window_index
 
 try:
     import PIL.Image as Image
@@ -123,31 +126,40 @@ class StackedAutoencoder(object):
         self.error = self.softmax.get_error(self.y)
 
 
-    def load_data(self,dir_name='DataCifar',):
-
-        train_names = ['fold_0_data.pkl','fold_1_data.pkl','fold_2_data.pkl']
-        valid_name = 'fold_3_data.pkl'
-        test_name = 'fold_4_data.pkl'
-
-        train_data = []
-        train_labels = []
-        for file_path in train_names:
-            f = open(dir_name + os.sep +file_path, 'rb')
+    #dir_name can also be the prefix of a dataset converted with BinaryDataset.py, which is memory mapped
+    #window_size - if given, the training set is streamed through a shared window of that many examples
+    def load_data(self,dir_name='DataCifar',window_size=None):
+
+        if window_size is not None and has_binary_dataset(dir_name):
+            #the training set stays memory mapped and is streamed window by window (see StreamingDataset)
+            train_set = load_split(split_path(dir_name, 'train'))
+            valid_set, test_set = load_binary_dataset(dir_name, config.floatX, SPLITS[1:])
+        elif has_binary_dataset(dir_name):
+            train_set, valid_set, test_set = load_binary_dataset(dir_name, config.floatX)
+        else:
+            train_names = ['fold_0_data.pkl','fold_1_data.pkl','fold_2_data.pkl']
+            valid_name = 'fold_3_data.pkl'
+            test_name = 'fold_4_data.pkl'
+
+            train_data = []
+            train_labels = []
+            for file_path in train_names:
+                f = open(dir_name + os.sep +file_path, 'rb')
+                [imgs,labels] = cPickle.load(f)
+                train_data.extend(imgs)
+                train_labels.extend(labels)
+
+            train_set = [train_data,train_labels]
+
+            f = open(dir_name + os.sep +valid_name, 'rb')
             [imgs,labels] = cPickle.load(f)
-            train_data.extend(imgs)
-            train_labels.extend(labels)
-
-        train_set = [train_data,train_labels]
-
-        f = open(dir_name + os.sep +valid_name, 'rb')
-        [imgs,labels] = cPickle.load(f)
-        valid_set = [imgs,labels]
+            valid_set = [imgs,labels]
 
-        f = open(dir_name + os.sep +test_name, 'rb')
-        [imgs,labels] = cPickle.load(f)
-        test_set = [imgs,labels]
+            f = open(dir_name + os.sep +test_name, 'rb')
+            [imgs,labels] = cPickle.load(f)
+            test_set = [imgs,labels]
 
-        f.close()
+            f.close()
 
 
         def get_shared_data(data_xy):
@@ -158,7 +170,11 @@ class StackedAutoencoder(object):
             return shared_x,T.cast(shared_y,'int32')
 
 
-        train_x,train_y = get_shared_data(train_set)
+        #with window_size only a window of the training set is kept in a shared variable
+        if window_size is None:
+            train_x,train_y = get_shared_data(train_set)
+        else:
+            train_x,train_y = StreamingDataset(train_set[0], train_set[1], window_size, self.batch_size, *train_set[2:]).get_shared_data()
         valid_x,valid_y = get_shared_data(valid_set)
         test_x,test_y = get_shared_data(test_set)
 
@@ -167,27 +183,36 @@ class StackedAutoencoder(object):
 
         return all_data
 
-    def load_data_bw(self,dir_name='DataCifar',):
+    #dir_name can also be the prefix of a dataset converted with BinaryDataset.py, which is memory mapped
+    #window_size - if given, the training set is streamed through a shared window of that many examples
+    def load_data_bw(self,dir_name='DataCifar',window_size=None):
 
-        train_names = 'train_set_bw'
-        valid_name = 'valid_set_bw'
-        test_name = 'test_set_bw'
+        if window_size is not None and has_binary_dataset(dir_name):
+            #the training set stays memory mapped and is streamed window by window (see StreamingDataset)
+            train_set = load_split(split_path(dir_name, 'train'))
+            valid_set, test_set = load_binary_dataset(dir_name, config.floatX, SPLITS[1:])
+        elif has_binary_dataset(dir_name):
+            train_set, valid_set, test_set = load_binary_dataset(dir_name, config.floatX)
+        else:
+            train_names = 'train_set_bw'
+            valid_name = 'valid_set_bw'
+            test_name = 'test_set_bw'
 
 
-        f = open(dir_name + os.sep +train_names, 'rb')
-        train_data_ls,train_labels = cPickle.load(f)
-        train_data = np.asarray(train_data_ls)
-        train_set = [train_data,train_labels]
+            f = open(dir_name + os.sep +train_names, 'rb')
+            train_data_ls,train_labels = cPickle.load(f)
+            train_data = np.asarray(train_data_ls)
+            train_set = [train_data,train_labels]
 
-        f = open(dir_name + os.sep +valid_name, 'rb')
-        valid_data,valid_labels = cPickle.load(f)
-        valid_set = [valid_data,valid_labels]
+            f = open(dir_name + os.sep +valid_name, 'rb')
+            valid_data,valid_labels = cPickle.load(f)
+            valid_set = [valid_data,valid_labels]
 
-        f = open(dir_name + os.sep +test_name, 'rb')
-        test_data,test_labels = cPickle.load(f)
-        test_set = [test_data,test_labels]
+            f = open(dir_name + os.sep +test_name, 'rb')
+            test_data,test_labels = cPickle.load(f)
+            test_set = [test_data,test_labels]
 
-        f.close()
+            f.close()
 
 
         def get_shared_data(data_xy):
@@ -198,7 +223,11 @@ class StackedAutoencoder(object):
             return shared_x,T.cast(shared_y,'int32')
 
 
-        train_x,train_y = get_shared_data(train_set)
+        #with window_size only a window of the training set is kept in a shared variable
+        if window_size is None:
+            train_x,train_y = get_shared_data(train_set)
+        else:
+            train_x,train_y = StreamingDataset(train_set[0], train_set[1], window_size, self.batch_size, *train_set[2:]).get_shared_data()
         valid_x,valid_y = get_shared_data(valid_set)
         test_x,test_y = get_shared_data(test_set)
 
@@ -291,7 +320,7 @@ class StackedAutoencoder(object):
         (valid_set_x, valid_set_y) = datasets[1]
         (test_set_x, test_set_y) = datasets[2]
 
-        n_train_batches = train_set_x.get_value(borrow=True).shape[0] / batch_size
+        n_train_batches = n_examples(train_set_x) / batch_size
 
         pre_train_fns = self.greedy_pre_training(train_set_x, batch_size=self.batch_size,pre_lr=pre_lr,denoising=denoising)
 
@@ -302,7 +331,7 @@ class StackedAutoencoder(object):
             for epoch in xrange(pre_epochs):
                 c=[]
                 for batch_index in xrange(n_train_batches):
-                    c.append(pre_train_fns[i](index=batch_index, lam=lam, beta=beta, rho=rho))
+                    c.append(pre_train_fns[i](index=window_index(train_set_x, batch_index), lam=lam, beta=beta, rho=rho))
 
                 print 'Training epoch %d, cost ' % epoch,
                 print np.mean(c)
@@ -339,7 +368,7 @@ class StackedAutoencoder(object):
             epoch = epoch + 1
             fine_tune_cost = []
             for mini_index in xrange(n_train_batches):
-                cost = fine_tune_fn(index=mini_index,lam=lam)
+                cost = fine_tune_fn(index=window_index(train_set_x, mini_index),lam=lam)
                 fine_tune_cost.append(cost)
                 #what's the role of iter? iter acts as follows
                 #in first epoch, iter for minibatch 'x' is x
@@ -401,7 +430,9 @@ class StackedAutoencoder(object):
         if not os.path.exists(name):
             os.makedirs(name)
 
-    def visualize_hidden(self,threshold,bounds):
+    # n_workers, time_budget (seconds per unit) and n_iter - see MaxActivation.maximize_activations_parallel
+    # the filter of every unit is also saved to filters_layer_<i>/ as soon as it is found
+    def visualize_hidden(self,threshold,bounds,n_workers=None,time_budget=None,n_iter=100):
         print '\nSaving hidden layer filters...\n'
 
         #Visualizing 1st hidden layer
@@ -423,7 +454,14 @@ class StackedAutoencoder(object):
             inp = np.asarray(inp,dtype=config.floatX)
             input = shared(value=inp, name='input',borrow=True)
 
-            max_ins = self.nlopt_optimization(input,threshold,bounds,i)
+            dir_name = 'filters_layer_'+str(i)
+            self.mkdir_if_not_exist(dir_name)
+            def save_filters(units,X,act):
+                for u,x in zip(units,X):
+                    Image.fromarray(tile_raster_images(
+                        X=x.reshape(1,-1), img_shape=(im_side, im_side), tile_shape=(1, 1))).save(dir_name+os.sep+'unit_'+str(u)+'.png')
+
+            max_ins = self.get_max_activations(input,threshold,bounds,i,n_workers,time_budget,n_iter,save_filters)
 
             f_name = 'my_filter_layer_'+str(i)+'.png'
             im_side = sqrt(self.i_size)
@@ -449,22 +487,6 @@ class StackedAutoencoder(object):
     def sigmoid(self, x):
         return 1.0 / (1.0 + np.exp(-x))
 
-    def cost(self,input,theta_as_blocks,layer_idx,index):
-
-        layer_input = input
-        for i in xrange(layer_idx):
-            layer_input
-            a = self.sigmoid(np.dot(layer_input,theta_as_blocks[i][0]) + theta_as_blocks[i][1])
-            layer_input = a
-
-        cost = self.sigmoid(np.dot(layer_input,theta_as_blocks[layer_idx][0]) + theta_as_blocks[layer_idx][1])[index]
-        #print "         Cost for node %i in layer %i is %f" %(index,layer_idx,cost)
-        return cost
-
-    def cost_prime(self, input, theta_as_blocks, layer_idx, index):
-        prime = optimize.approx_fprime(input, self.cost, 0.0001, theta_as_blocks, layer_idx, index)
-        return prime
-
     def nlopt_optimization(self,input,threshold,bounds,layer_idx):
 
         def get_activation(x, theta, l_idx, i):
@@ -560,56 +582,23 @@ class StackedAutoencoder(object):
 
         return np.asarray(max_inputs)
 
-    def get_max_activations(self,input,threshold,bounds,layer_idx):
-
-        #constraint for x
-        def con_x_norm(x,threshold):
-            return threshold-LA.norm(x)
-        cons = {'type': 'ineq','fun': con_x_norm,'args': (threshold,)}
+    def get_max_activations(self,input,threshold,bounds,layer_idx,n_workers=None,time_budget=None,n_iter=100,callback=None):
 
         print 'Calculating max activations for layer %i...\n' % layer_idx
 
-        input_arr = input.get_value()
-        max_inputs = []
-
-        print 'Getting max activations for layer %i\n' % layer_idx
         #creating the ndarray from symbolic theta
         theta_as_blocks_arr = []
-
-        print 'Getting theta_as_blocks for layer %i' % layer_idx
         for k in xrange(layer_idx+1):
-            print '     Getting thetas for layer %i' % k
             theta_as_blocks_arr.append([self.thetas_as_blocks[k][0].get_value(),self.thetas_as_blocks[k][1].get_value()])
 
-        print '\nPerforming optimization (SLSQP) for layer %i...' % layer_idx
+        #the nodes of the layer are optimized in chunks by a process pool with analytic gradients (see MaxActivation)
+        start_time = time.time()
+        max_inputs, max_acts = maximize_activations_parallel(theta_as_blocks_arr, input.get_value(), threshold, bounds,
+                                                             n_iter=n_iter, time_budget=time_budget, n_workers=n_workers, callback=callback)
+        elapsed = time.time()-start_time
+        print 'Max activations for layer %i: mean %f, min %f (%f s, %f units/s)' %(layer_idx, np.mean(max_acts), np.min(max_acts), elapsed, len(max_acts)/max(elapsed,1e-12))
 
-        printed_50 = False
-        printed_90 = False
-        for j in xrange(self.h_sizes[layer_idx]):
-            #print '     Getting max input for node %i in layer %i' % (j, i)
-            init_val = input_arr
-
-            #if -self.cost(init_val,theta_as_blocks_arr,layer_idx,j)<0.001:
-            #    max_inputs.append(np.zeros((init_val.size)))
-            #    continue
-
-            res = optimize.minimize(fun=self.cost, x0=init_val, args=(theta_as_blocks_arr,layer_idx,j),
-                                    jac=self.cost_prime, method='L-BFGS-B', constraints=cons,
-                                    bounds=bounds, options={'maxiter':10})
-
-            print '     Got cost for node %i layer %i: %f' % (j, layer_idx, LA.norm(res.fun))
-            if LA.norm(res.x) > threshold:
-                print '     Threshold exceeded node %i layer %i norm %f/%f' % (j, layer_idx, LA.norm(res.x), threshold)
-            max_inputs.append(res.x)
-
-            if j*1.0/self.h_sizes[layer_idx] > .9 and not printed_90:
-                print '     90% completed...'
-                printed_90 = True
-            elif j*1.0/self.h_sizes[layer_idx] > .5 and not printed_50:
-                print '     50% completed...'
-                printed_50 = True
-
-        return np.asarray(max_inputs)
+        return max_inputs
 
 
 if __name__ == '__main__':
@@ -0,0 +1,40 @@
+__author__ = 'Thushan Ganegedara'
+
+import numpy as np
+from theano import config
+import theano.tensor as T
+from theano.tensor.shared_randomstreams import RandomStreams
+
+# Dropout of a layer's input. One RandomStreams is created per layer (and not per forward_pass), and the
+# training output is drawn once per input variable and reused (see dropped), so calling forward_pass again
+# for the same input (e.g. for the cost after get_hidden_act) does not add another state to rng.state_updates.
+# A mask is drawn for every example of the minibatch (size=input.shape), not one for the whole minibatch.
+# With inverted dropout the kept inputs are scaled by 1/(1-rate) while training, so at test time the input
+# is used as it is and the weights do not have to be multiplied by (1-rate).
+class Dropout(object):
+
+    def __init__(self, rate, inverted=True, seed=None):
+        self.rate = rate
+        self.inverted = inverted
+        if seed is None:
+            seed = np.random.randint(2 ** 30)
+        self.rng = RandomStreams(seed)
+        # input variable -> training output
+        self.dropped = {}
+
+    def apply(self, input, training=False):
+        if self.rate == 0:
+            return input
+
+        if training:
+            if input not in self.dropped:
+                mask = self.rng.binomial(size=input.shape, n=1, p=1-self.rate, dtype=config.floatX)
+                if self.inverted:
+                    self.dropped[input] = input * mask * np.asarray(1.0/(1-self.rate), dtype=config.floatX)
+                else:
+                    self.dropped[input] = input * mask
+            return self.dropped[input]
+
+        if self.inverted:
+            return input
+        return input * np.asarray(1-self.rate, dtype=config.floatX)
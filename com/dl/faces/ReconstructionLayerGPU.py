@@ -11,6 +11,7 @@ from PIL import Image
 from theano import function, config, shared, sandbox
 import theano.tensor as T
 from theano.tensor.shared_randomstreams import RandomStreams
+from Dropout import Dropout
 
 class ReconstructionLayer(object):
 
@@ -36,6 +37,8 @@ class ReconstructionLayer(object):
 
         self.dropout = dropout
         self.dropout_rate = dropout_rate
+        if dropout:
+            self.dropout_layer = Dropout(dropout_rate)
 
         numpy_rng = np.random.RandomState(89677)
         self.theano_rng = RandomStreams(numpy_rng.randint(2 ** 30))
@@ -53,23 +56,17 @@ class ReconstructionLayer(object):
             b = -0.01 + np.random.random_sample((n_outputs,)) * 0.02
             self.b = shared(value=np.asarray(b, dtype=config.floatX), name='b', borrow=True)
 
-        self.a_train = self.forward_pass(input=self.x_train,p=self.dropout_rate,training=True)
-        self.a_test = self.forward_pass(input=self.x_test,p=self.dropout_rate,training=False)
+        self.a_train = self.forward_pass(input=self.x_train,training=True)
+        self.a_test = self.forward_pass(input=self.x_test,training=False)
         self.theta = [self.W,self.b]
 
-    def forward_pass(self,input=None,p=0.5,training=False):
+    def forward_pass(self,input=None,training=False):
 
+        #inverted dropout, the test time input is used as it is
         if self.dropout:
-            srng = T.shared_randomstreams.RandomStreams(np.random.randint(999999))
-            mask = srng.binomial(n=1, p=1-p, size=(self.n_inputs,))
-
-            if training:
-                input_tilda = input * T.cast(mask, config.floatX)
-                a = T.nnet.sigmoid(T.dot(input_tilda,self.W) + self.b)
-            else:
-                a = T.nnet.sigmoid(T.dot(input,self.W*(1-p)) + self.b)
-        else:
-            a = T.nnet.sigmoid(T.dot(input,self.W) + self.b)
+            input = self.dropout_layer.apply(input, training)
+
+        a = T.nnet.sigmoid(T.dot(input,self.W) + self.b)
 
         return a
 
@@ -19,6 +19,7 @@ import time
 import sys,getopt
 
 from utils import tile_raster_images
+from MaxActivation import maximize_activations_parallel
 
 try:
     import PIL.Image as Image
@@ -339,7 +340,9 @@ class StackedAutoencoder(object):
         if not os.path.exists(name):
             os.makedirs(name)
 
-    def visualize_hidden(self,threshold,bounds):
+    # n_workers, time_budget (seconds per unit) and n_iter - see MaxActivation.maximize_activations_parallel
+    # the filter of every unit is also saved to filters_layer_<i>/ as soon as it is found
+    def visualize_hidden(self,threshold,bounds,n_workers=None,time_budget=None,n_iter=100):
         print '\nSaving hidden layer filters...\n'
 
         #Visualizing 1st hidden layer
@@ -360,7 +363,14 @@ class StackedAutoencoder(object):
             inp = np.asarray(inp,dtype=config.floatX)
             input = shared(value=inp, name='input',borrow=True)
 
-            max_ins = self.theano_max_activations(input,threshold,i,0.2)
+            dir_name = 'filters_layer_'+str(i)
+            self.mkdir_if_not_exist(dir_name)
+            def save_filters(units,X,act):
+                for u,x in zip(units,X):
+                    Image.fromarray(tile_raster_images(
+                        X=x.reshape(1,-1), img_shape=(self.i_width, self.i_height), tile_shape=(1, 1))).save(dir_name+os.sep+'unit_'+str(u)+'.png')
+
+            max_ins = self.get_max_activations(input,threshold,bounds,i,n_workers,time_budget,n_iter,save_filters)
 
             f_name = 'my_filter_layer_'+str(i)+'.png'
             im_count = int(sqrt(self.h_sizes[i]))
@@ -385,22 +395,6 @@ class StackedAutoencoder(object):
     def sigmoid(self, x):
         return 1.0 / (1.0 + np.exp(-x))
 
-    def cost(self,input,theta_as_blocks,layer_idx,index):
-
-        layer_input = input
-        for i in xrange(layer_idx):
-            a = self.sigmoid(np.dot(layer_input,theta_as_blocks[i][0]) + theta_as_blocks[i][1])
-            layer_input = a
-
-        cost = self.sigmoid(np.dot(layer_input,theta_as_blocks[layer_idx][0]) + theta_as_blocks[layer_idx][1])[index]
-        #print "         Cost for node %i in layer %i is %f" %(index,layer_idx,cost)
-        return -cost
-
-    def cost_prime(self, input, theta_as_blocks, layer_idx, index):
-
-        prime = optimize.approx_fprime(input, self.cost, 0.00000001, theta_as_blocks, layer_idx, index)
-        return prime
-
     def nlopt_optimization(self,input,threshold,layer_idx):
 
         def get_activation(x, theta_as_blocks, layer_idx, index):
@@ -475,54 +469,23 @@ class StackedAutoencoder(object):
 
         return max_inputs
 
-    def get_max_activations(self,input,threshold,bounds,layer_idx):
-
-        #constraint for x
-        def con_x_norm(x,threshold):
-            return threshold-LA.norm(x)
-        cons = {'type': 'ineq','fun': con_x_norm,'args': (threshold,)}
+    def get_max_activations(self,input,threshold,bounds,layer_idx,n_workers=None,time_budget=None,n_iter=100,callback=None):
 
         print 'Calculating max activations for layer %i...\n' % layer_idx
 
-        input_arr = np.asarray(input.get_value(),dtype=np.float16)
-        max_inputs = []
-
-        print 'Getting max activations for layer %i\n' % layer_idx
         #creating the ndarray from symbolic theta
         theta_as_blocks_arr = []
-
-        print 'Getting theta_as_blocks for layer %i' % layer_idx
         for k in xrange(layer_idx+1):
-            print '     Getting thetas for layer %i' % k
-            theta_as_blocks_arr.append([np.asarray(self.thetas_as_blocks[k][0].get_value(),dtype=np.float16),np.asarray(self.thetas_as_blocks[k][1].get_value(),dtype=np.float16)])
-
-        print '\nPerforming optimization (SLSQP) for layer %i...' % layer_idx
-
-        printed_50 = False
-        printed_90 = False
-
-
-        for j in xrange(self.h_sizes[layer_idx]):
-            init_val = input_arr
-            res = optimize.minimize(fun=self.cost, x0=init_val, args=(theta_as_blocks_arr,layer_idx,j),
-                                    jac=self.cost_prime, method='L-BFGS-B', constraints=cons, bounds=bounds,options={'maxiter': 5})
+            theta_as_blocks_arr.append([self.thetas_as_blocks[k][0].get_value(),self.thetas_as_blocks[k][1].get_value()])
 
+        #the nodes of the layer are optimized in chunks by a process pool with analytic gradients (see MaxActivation)
+        start_time = time.time()
+        max_inputs, max_acts = maximize_activations_parallel(theta_as_blocks_arr, input.get_value(), threshold, bounds,
+                                                             n_iter=n_iter, time_budget=time_budget, n_workers=n_workers, callback=callback)
+        elapsed = time.time()-start_time
+        print 'Max activations for layer %i: mean %f, min %f (%f s, %f units/s)' %(layer_idx, np.mean(max_acts), np.min(max_acts), elapsed, len(max_acts)/max(elapsed,1e-12))
 
-            if LA.norm(res.x) > threshold:
-                print '     Threshold exceeded node %i layer %i norm %f/%f' % (j, layer_idx, LA.norm(res.x), threshold)
-
-            print '     Got max input for node %i in layer %i: %f' % (j, layer_idx, res.fun)
-            max_inputs.append(res.x)
-
-
-            if j*1.0/self.h_sizes[layer_idx] > .9 and not printed_90:
-                print '     90% completed...'
-                printed_90 = True
-            elif j*1.0/self.h_sizes[layer_idx] > .5 and not printed_50:
-                print '     50% completed...'
-                printed_50 = True
-
-        return np.asarray(max_inputs)
+        return max_inputs
 
     def theano_max_activations(self,input,threshold,layer_idx,lr):
         inp_mat = []
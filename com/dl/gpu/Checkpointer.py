@@ -0,0 +1,95 @@
+__author__ = 'Thushan Ganegedara'
+
+import copy
+import os
+import threading
+
+try:
+    import cPickle as pickle
+except ImportError:
+    import pickle
+
+# Writes training state (a dict of arrays, counters and RNG states) to a checkpoint file.
+# save() only takes a copy of the state, the pickling and writing is done by a background thread so the
+# training loop does not wait for the disk. If a new snapshot arrives while the previous one is still being
+# written, only the newest pending snapshot is kept. Every write goes to a temporary file which is then
+# renamed over the checkpoint, so the file on disk is always a complete checkpoint.
+class Checkpointer(object):
+
+    # freq - number of steps (e.g. minibatches) between checkpoints, see due
+    def __init__(self, file_path, freq=1000, background=True):
+        self.file_path = file_path
+        self.freq = freq
+        self.background = background
+
+        dir_name = os.path.dirname(file_path)
+        if dir_name and not os.path.exists(dir_name):
+            os.makedirs(dir_name)
+
+        self.lock = threading.Condition()
+        self.pending = None
+        self.writing = False
+        self.thread = None
+
+    def due(self, step):
+        return self.freq > 0 and (step + 1) % self.freq == 0
+
+    # the last complete checkpoint, or None if there is none
+    def load(self):
+        if not os.path.exists(self.file_path):
+            return None
+        with open(self.file_path, 'rb') as f:
+            return pickle.load(f)
+
+    def save(self, state):
+        #the copy is taken here, so training can keep changing the arrays while the snapshot is written
+        snapshot = copy.deepcopy(state)
+        if not self.background:
+            self.write(snapshot)
+            return
+
+        with self.lock:
+            self.pending = snapshot
+            if self.thread is None or not self.thread.is_alive():
+                self.thread = threading.Thread(target=self.run)
+                self.thread.daemon = True
+                self.thread.start()
+            self.lock.notify()
+
+    def run(self):
+        while True:
+            with self.lock:
+                if self.pending is None:
+                    self.thread = None
+                    self.lock.notify_all()
+                    return
+                snapshot = self.pending
+                self.pending = None
+                self.writing = True
+
+            try:
+                self.write(snapshot)
+            finally:
+                with self.lock:
+                    self.writing = False
+                    self.lock.notify_all()
+
+    def write(self, snapshot):
+        tmp_path = self.file_path + '.tmp'
+        with open(tmp_path, 'wb') as f:
+            pickle.dump(snapshot, f, protocol=pickle.HIGHEST_PROTOCOL)
+            f.flush()
+            os.fsync(f.fileno())
+
+        #os.rename does not replace an existing file on Windows
+        try:
+            os.rename(tmp_path, self.file_path)
+        except OSError:
+            os.remove(self.file_path)
+            os.rename(tmp_path, self.file_path)
+
+    # blocks until every snapshot passed to save is on disk
+    def wait(self):
+        with self.lock:
+            while self.pending is not None or self.writing:
+                self.lock.wait()
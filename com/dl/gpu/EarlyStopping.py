@@ -0,0 +1,85 @@
+__author__ = 'Thushan Ganegedara'
+
+import numpy as np
+
+# Patience based early stopping for fine tuning, which also keeps the best parameters.
+# Every time the validation loss improves, the values of params (shared variables) are copied to host buffers
+# (allocated once), and restore() sets them back, so training ends with the best model and not the last one.
+class EarlyStopping(object):
+
+    # patience - number of minibatches to look at, increased to iter*patience_increase on a large enough improvement
+    def __init__(self, params, patience, patience_increase=2., improvement_threshold=0.995):
+        self.params = params
+        self.patience = patience
+        self.patience_increase = patience_increase
+        self.improvement_threshold = improvement_threshold
+
+        self.best_valid_loss = np.inf
+        self.best_iter = 0
+        self.best_params = None
+
+    # returns True if valid_loss (after iter minibatches) is the best so far, the parameters are copied then
+    def update(self, valid_loss, iter):
+        if valid_loss >= self.best_valid_loss:
+            return False
+
+        if valid_loss < self.best_valid_loss * self.improvement_threshold:
+            self.patience = max(self.patience, iter * self.patience_increase)
+
+        self.best_valid_loss = valid_loss
+        self.best_iter = iter
+
+        if self.best_params is None:
+            self.best_params = [np.array(p.get_value(borrow=True)) for p in self.params]
+        else:
+            for best, p in zip(self.best_params, self.params):
+                np.copyto(best, p.get_value(borrow=True))
+        return True
+
+    def should_stop(self, iter):
+        return self.patience <= iter
+
+    # sets the parameters back to the best ones (if there was a validation)
+    def restore(self):
+        if self.best_params is None:
+            return False
+        for best, p in zip(self.best_params, self.params):
+            p.set_value(best)
+        return True
+
+    # for checkpoints
+    def get_state(self):
+        return {'best_valid_loss': self.best_valid_loss, 'patience': self.patience,
+                'best_iter': self.best_iter, 'best_params': self.best_params}
+
+    def set_state(self, state):
+        self.best_valid_loss = state['best_valid_loss']
+        self.patience = state['patience']
+        self.best_iter = state['best_iter']
+        self.best_params = state.get('best_params')
+
+# Stops a pretraining layer once its epoch cost stopped decreasing: if the cost was not lower than
+# best_cost - tolerance*|best_cost| for patience epochs in a row, update returns True
+class PlateauDetector(object):
+
+    def __init__(self, tolerance=1e-3, patience=2):
+        self.tolerance = tolerance
+        self.patience = patience
+        self.best_cost = np.inf
+        self.bad_epochs = 0
+
+    def update(self, cost):
+        if self.best_cost == np.inf or cost < self.best_cost - self.tolerance * abs(self.best_cost):
+            self.best_cost = cost
+            self.bad_epochs = 0
+        else:
+            self.bad_epochs += 1
+        return self.bad_epochs >= self.patience
+
+    # for checkpoints
+    def get_state(self):
+        return {'best_cost': self.best_cost, 'bad_epochs': self.bad_epochs}
+
+    def set_state(self, state):
+        self.best_cost = state['best_cost']
+        self.bad_epochs = state['bad_epochs']
@@ -0,0 +1,192 @@
+__author__ = 'Thushan Ganegedara'
+
+import hashlib
+import os
+import sys
+import time
+import cPickle
+from collections import OrderedDict
+
+import numpy as np
+import theano
+from theano import config
+from theano.compile import SharedVariable
+from theano.gof import graph
+from theano.tensor.raw_random import RandomStateType
+
+# Persistent cache of compiled theano functions.
+# A compiled function is pickled together with the shared variables of the model (weights, optimizer state and
+# datasets) by name, so when it is loaded in a later run each of them can be swapped for the shared variable
+# with the same name in the current model (Function.copy(swap=...), Theano 0.8+) and the graph optimization
+# and compilation are skipped. If the names differ or the function uses a shared variable that has no name,
+# the entry is not used and the function is compiled.
+# Functions drawing from random streams are not stored: their states come with default_update graphs that
+# Function.copy does not swap reliably. Every stored entry is loaded back right away and checked against the
+# function it was compiled from (see validate), an entry that does not give the same results is dropped and
+# its key is marked so the function is always compiled.
+# The values of the dataset variables are not stored, they are replaced by empty arrays while pickling.
+# Keys should contain everything the graph depends on (architecture, batch size, cost options, ...),
+# the theano version, floatX and device are always added.
+class FunctionCache(object):
+
+    def __init__(self, cache_dir):
+        self.cache_dir = cache_dir
+        if not os.path.exists(cache_dir):
+            os.makedirs(cache_dir)
+
+        self.hits = 0
+        self.misses = 0
+        self.compile_time = 0.
+        self.load_time = 0.
+
+        #pickling a theano graph recurses once per node
+        sys.setrecursionlimit(max(sys.getrecursionlimit(), 50000))
+
+    def key(self, *parts):
+        h = hashlib.sha1()
+        h.update(repr((theano.__version__, config.floatX, config.device) + parts))
+        return h.hexdigest()
+
+    # shared variables in the given expressions (e.g. shared_y for T.cast(shared_y,'int32'))
+    def shared_inputs(self, exprs):
+        return [v for v in graph.inputs(exprs) if isinstance(v, SharedVariable)]
+
+    # compiled function stored under the key of key_parts, compiled (by compile_fn) and stored if there is none
+    # model_vars - dict of the shared variables of the model (weights, RNG states), the names have to identify
+    # the same variable in every run (e.g. 'param_0' and not the order the variables were created in)
+    # data - dataset expressions the function uses (shared variables or e.g. T.cast of a shared variable)
+    # probe_args - arguments the function is called with to validate a new entry (the state is restored afterwards)
+    def get_or_compile(self, name, key_parts, compile_fn, model_vars, data, probe_args=(0,)):
+        data_vars = self.shared_inputs(data)
+        shared_vars = OrderedDict(model_vars)
+        for i, v in enumerate(data_vars):
+            shared_vars['data_%i' % i] = v
+        path = os.path.join(self.cache_dir, self.key(name, *key_parts) + '.pkl')
+
+        if os.path.exists(path):
+            start_time = time.time()
+            try:
+                fn = self.load(path, shared_vars)
+                self.hits += 1
+                self.load_time += time.time() - start_time
+                print "Function cache hit '%s' (loaded in %f s)" %(name, time.time() - start_time)
+                return fn
+            except Exception as e:
+                print "Function cache entry for '%s' could not be used (%s), compiling..." %(name, e)
+
+        start_time = time.time()
+        fn = compile_fn()
+        self.misses += 1
+        self.compile_time += time.time() - start_time
+        print "Function cache miss '%s' (compiled in %f s)" %(name, time.time() - start_time)
+
+        if os.path.exists(path + '.nocache'):
+            return fn
+
+        reason = self.uncacheable(fn, shared_vars)
+        if reason is not None:
+            print "Not storing compiled function '%s' (%s)" %(name, reason)
+            return fn
+
+        fn_vars = self.fn_shared_vars(fn)
+        used_vars = OrderedDict((var_name, v) for var_name, v in shared_vars.iteritems() if v in fn_vars)
+        if self.save(path, fn, used_vars, data_vars) and not self.validate(path, fn, used_vars, data_vars, probe_args):
+            print "Stored function '%s' does not give the same results as the compiled one, it will not be cached" % name
+            os.remove(path)
+            open(path + '.nocache', 'w').close()
+        return fn
+
+    # shared variables the compiled function uses (incl. the implicit ones, e.g. RNG states)
+    def fn_shared_vars(self, fn):
+        return [i.variable for i in fn.maker.inputs if isinstance(i.variable, SharedVariable)]
+
+    # why fn can not be stored, None if it can
+    def uncacheable(self, fn, shared_vars):
+        fn_vars = self.fn_shared_vars(fn)
+        if any(isinstance(v.type, RandomStateType) for v in fn_vars):
+            return 'it draws from random streams'
+
+        #a function using a shared variable that is not in shared_vars could not be swapped to the current model
+        known = shared_vars.values()
+        unmatched = [v for v in fn_vars if v not in known]
+        if len(unmatched) > 0:
+            return 'it uses shared variables without a name (%s)' % ', '.join(str(v) for v in unmatched)
+        return None
+
+    # the stored function with its shared variables swapped for the ones with the same name in shared_vars
+    def load(self, path, shared_vars):
+        with open(path, 'rb') as f:
+            fn, saved_vars = cPickle.load(f)
+
+        copied = fn.copy(swap=self.get_swap(fn, saved_vars, shared_vars))
+        #copy builds the function from the list of outputs, so a single output would be returned as a list
+        copied.unpack_single = fn.unpack_single
+        copied.return_none = fn.return_none
+        return copied
+
+    # stored shared variable -> shared variable of the current model with the same name
+    # saved_vars holds every shared variable of the function (see save), so all of them are swapped
+    def get_swap(self, fn, saved_vars, shared_vars):
+        missing = [name for name in saved_vars if name not in shared_vars]
+        if len(missing) > 0:
+            raise ValueError("no shared variables named %s in the model" % ', '.join(missing))
+
+        swap = dict((var, shared_vars[name]) for name, var in saved_vars.iteritems())
+        unmatched = [v for v in self.fn_shared_vars(fn) if v not in swap]
+        if len(unmatched) > 0:
+            raise ValueError("function uses shared variables without a name (%s)" % ', '.join(str(v) for v in unmatched))
+        return swap
+
+    # stores the function with the shared variables it uses (used_vars) by name, returns True if it was stored
+    def save(self, path, fn, used_vars, data_vars):
+        values = [v.get_value(borrow=True) for v in data_vars]
+        for v, value in zip(data_vars, values):
+            v.set_value(np.zeros((0,) + value.shape[1:], dtype=value.dtype), borrow=True)
+
+        tmp_path = path + '.tmp'
+        try:
+            with open(tmp_path, 'wb') as f:
+                cPickle.dump((fn, used_vars), f, protocol=cPickle.HIGHEST_PROTOCOL)
+            if os.path.exists(path):
+                os.remove(path)
+            os.rename(tmp_path, path)
+            return True
+        except Exception as e:
+            print "Could not store compiled function (%s)" % e
+            return False
+        finally:
+            for v, value in zip(data_vars, values):
+                v.set_value(value, borrow=True)
+
+    # loads the entry at path back and calls it and fn with probe_args, starting from the same values of the
+    # model variables. True if both give the same outputs and the same updated values.
+    # The model variables are set back to their values afterwards, so the probe calls do not train the model
+    def validate(self, path, fn, used_vars, data_vars, probe_args):
+        model_vars = [v for v in used_vars.values() if v not in data_vars]
+        values = [v.get_value() for v in model_vars]
+
+        results = []
+        try:
+            for f in [self.load(path, used_vars), fn]:
+                outputs = f(*probe_args)
+                results.append((outputs, [v.get_value() for v in model_vars]))
+                for v, value in zip(model_vars, values):
+                    v.set_value(value)
+        except Exception as e:
+            print "Could not validate the stored function (%s)" % e
+            for v, value in zip(model_vars, values):
+                v.set_value(value)
+            return False
+
+        (loaded_outputs, loaded_values), (outputs, updated_values) = results
+        return self.same(loaded_outputs, outputs) and self.same(loaded_values, updated_values)
+
+    def same(self, a, b):
+        if isinstance(a, (list, tuple)) or isinstance(b, (list, tuple)):
+            return isinstance(a, (list, tuple)) and isinstance(b, (list, tuple)) and len(a) == len(b) and \
+                   all(self.same(x, y) for x, y in zip(a, b))
+        return np.asarray(a).shape == np.asarray(b).shape and np.allclose(a, b)
+
+    def report(self):
+        print "Function cache: %i hits (%f s loading), %i misses (%f s compiling)" \
+              %(self.hits, self.load_time, self.misses, self.compile_time)
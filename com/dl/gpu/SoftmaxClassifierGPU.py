@@ -4,6 +4,7 @@ __author__ = 'Thushan Ganegedara'
 import numpy as np
 from theano import function, config, shared, sandbox
 import theano.tensor as T
+from Dropout import Dropout
 
 import numpy.linalg as LA
 class SoftmaxClassifier(object):
@@ -24,6 +25,8 @@ class SoftmaxClassifier(object):
 
         self.dropout = dropout
         self.dropout_rate = dropout_rate
+        if dropout:
+            self.dropout_layer = Dropout(dropout_rate)
 
         #generate random weights for W
         if W1 == None:
@@ -44,17 +47,11 @@ class SoftmaxClassifier(object):
 
 
     def forward_pass(self,input=None,training=False):
+        #inverted dropout, the test time input is used as it is
         if self.dropout:
-            srng = T.shared_randomstreams.RandomStreams(np.random.randint(999999))
-            mask = srng.binomial(n=1, p=1-self.dropout_rate, size=(self.n_inputs,))
-            x_tilda = input * T.cast(mask, config.floatX)
-            if training:
-                a = T.nnet.softmax(T.dot(x_tilda, self.W1) + self.b1)
-            else:
-                a = T.nnet.softmax(T.dot(input, self.W1*(1-self.dropout_rate)) + self.b1)
-
-        else:
-            a = T.nnet.softmax(T.dot(input, self.W1) + self.b1)
+            input = self.dropout_layer.apply(input, training)
+
+        a = T.nnet.softmax(T.dot(input, self.W1) + self.b1)
         return a
 
     def get_cost(self,lam,cost_fn='neg_log'):
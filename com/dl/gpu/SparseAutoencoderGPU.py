@@ -11,6 +11,8 @@ from PIL import Image
 from theano import function, config, shared, sandbox
 import theano.tensor as T
 from theano.tensor.shared_randomstreams import RandomStreams
+from Dropout import Dropout
+from TheanoOptimizers import SGD
 
 class SparseAutoencoder(object):
 
@@ -22,6 +24,8 @@ class SparseAutoencoder(object):
 
         self.dropout = dropout
         self.dropout_rate = dropout_rate
+        if dropout:
+            self.dropout_layer = Dropout(dropout_rate)
 
         if x_train is None:
             self.x_train = T.dmatrix('x_train')
@@ -39,6 +43,8 @@ class SparseAutoencoder(object):
 
         numpy_rng = np.random.RandomState(89677)
         self.theano_rng = RandomStreams(numpy_rng.randint(2 ** 30))
+        # (input, corruption_level) -> corrupted input, so the cost is built on one draw of theano_rng
+        self.corrupted = {}
 
         #generate random weights for W
         if W1 == None:
@@ -67,61 +73,55 @@ class SparseAutoencoder(object):
 
     def forward_pass(self, input=None, training=False):
 
+        #inverted dropout, the test time input is used as it is
         if self.dropout:
-            srng = T.shared_randomstreams.RandomStreams(np.random.randint(999999))
-            mask = srng.binomial(n=1, p=1-self.dropout_rate, size=(self.n_inputs,))
-
-            if training:
-                input_tilda = input * T.cast(mask, config.floatX)
-                a2 = T.nnet.sigmoid(T.dot(input_tilda,self.W1) + self.b1)
-                a3 = T.nnet.sigmoid(T.dot(a2,self.W2) + self.b2)
-            else:
-                a2 = T.nnet.sigmoid(T.dot(input,self.W1*(1-self.dropout_rate)) + self.b1)
-                a3 = T.nnet.sigmoid(T.dot(a2,self.W2*(1-self.dropout_rate)) + self.b2)
-        else:
-            a2 = T.nnet.sigmoid(T.dot(input,self.W1) + self.b1)
-            a3 = T.nnet.sigmoid(T.dot(a2,self.W2) + self.b2)
+            input = self.dropout_layer.apply(input, training)
+
+        a2 = T.nnet.sigmoid(T.dot(input,self.W1) + self.b1)
+        a3 = T.nnet.sigmoid(T.dot(a2,self.W2) + self.b2)
 
         return a2, a3
 
 
     def get_corrupted_input(self,input,corruption_level=0.3):
-        return self.theano_rng.binomial(size=input.shape, n=1,
-                                        p=1 - corruption_level,
-                                        dtype=config.floatX) * input
+        key = (input, corruption_level)
+        if key not in self.corrupted:
+            self.corrupted[key] = self.theano_rng.binomial(size=input.shape, n=1,
+                                                           p=1 - corruption_level,
+                                                           dtype=config.floatX) * input
+        return self.corrupted[key]
 
     # cost calculate the cost you get given all the inputs feed forward through the network
     # at the moment I am using the squared error between the reconstructed and the input
     # theta is a vector formed by unrolling W1,b1,W2,b2 in to a single vector
     # Theta will be the input that the optimization method trying to optimize
-    def get_cost_and_updates(self, l_rate, lam, beta=0.25, rho=0.2, cost_fn='sqr_err',corruption_level=0.3,denoising=False):
+    # optimizer - update rule for self.theta (see TheanoOptimizers), plain SGD with l_rate if it is not given
+    # input - the layer's input the cost is built on (self.x_train if None), e.g. a variable for precomputed inputs
+    def get_cost_and_updates(self, l_rate, lam, beta=0.25, rho=0.2, cost_fn='sqr_err',corruption_level=0.3,denoising=False,optimizer=None,input=None):
 
+        x = self.x_train if input is None else input
         if denoising:
-            new_input = self.get_corrupted_input(self.x_train,corruption_level)
+            new_input = self.get_corrupted_input(x,corruption_level)
         else:
-            new_input = self.x_train
+            new_input = x
 
         a2,a3 = self.forward_pass(input=new_input,training=True)
 
         rho_hat = T.mean(a2)
         kl_div = T.sum(rho*T.log(rho/rho_hat) + (1-rho)*T.log((1-rho)/(1-rho_hat)))
         if cost_fn == 'sqr_err':
-            L = 0.5 * T.sum(T.sqr(a3-self.x_train), axis=1)
+            L = 0.5 * T.sum(T.sqr(a3-x), axis=1)
             cost = T.mean(L) + \
                    (lam/2)*(T.sum(T.sum(self.W1**2,axis=1)) + T.sum(T.sum(self.W2**2,axis=1))) + beta*kl_div
         elif cost_fn == 'neg_log':
-            L = - T.sum(self.x_train * T.log(a3) + (1 - self.x_train) * T.log(1 - a3), axis=1)
+            L = - T.sum(x * T.log(a3) + (1 - x) * T.log(1 - a3), axis=1)
             cost = T.mean(L) + (lam/2)*T.sum(T.sum(self.W1**2,axis=1)) + beta*kl_div
 
         gparams = T.grad(cost, self.theta)
 
-        #zip is used to iterate over two lists in parallel. This says, give the updated values for
-        #param and gparam (param and param - l_rate*gparam respectively) while enumerating
-        #params and gparams in parallel
-        updates = [
-            (param, param - l_rate*gparam)
-            for param, gparam in zip(self.theta, gparams)
-        ]
+        if optimizer is None:
+            optimizer = SGD(self.theta, l_rate)
+        updates = optimizer.get_updates(gparams)
 
         return cost, updates
 
@@ -13,6 +13,7 @@ from PIL import Image
 from numpy import linalg as LA
 from math import sqrt
 import gzip,cPickle
+from collections import OrderedDict
 
 from theano import function, config, shared, sandbox, Param
 import theano.tensor as T
@@ -21,6 +22,13 @@ import time
 import sys,getopt
 
 from utils import tile_raster_images
+from MaxActivation import maximize_activations_parallel
+from Checkpointer import Checkpointer
+from BinaryDataset import has_binary_dataset, load_binary_dataset, load_split, split_path, SPLITS
+from StreamingData import StreamingDataset, n_examples, window_index, streams
+from FunctionCache import FunctionCache
+from EarlyStopping import EarlyStopping, PlateauDetector
+from TheanoOptimizers import get_optimizer
 
 try:
     import PIL.Image as Image
@@ -30,7 +38,11 @@ except ImportError:
 class StackedAutoencoder(object):
 
 
-    def __init__(self,in_size=28**2, hidden_size = [500, 500, 250], out_size = 10, batch_size = 100, corruption_levels=[0.1, 0.1, 0.1],dropout=True,drop_rates=[0.5,0.2,0.2]):
+    #function_cache_dir - if given, compiled theano functions are stored there and reused by later runs (see FunctionCache)
+    #optimizer, optimizer_params - update rule used for pretraining and fine tuning and its options except the
+    #learning rate (e.g. 'momentum', {'momentum': 0.9}), see TheanoOptimizers
+    def __init__(self,in_size=28**2, hidden_size = [500, 500, 250], out_size = 10, batch_size = 100, corruption_levels=[0.1, 0.1, 0.1],dropout=True,drop_rates=[0.5,0.2,0.2],
+                 function_cache_dir=None, optimizer='sgd', optimizer_params=None):
         self.i_size = in_size
         self.h_sizes = hidden_size
         self.o_size = out_size
@@ -52,13 +64,10 @@ class StackedAutoencoder(object):
 
         self.corruption_levels = corruption_levels
 
-        #check if there are layer_count number of corruption levels
-        if denoising:
-            assert self.n_layers == len(self.corruption_levels)
-
         self.cost_fn_names = ['sqr_err', 'neg_log']
 
         self.x = T.matrix('x')  #store the inputs
+        self.layer_inputs = {}  #precomputed inputs of the layers (see get_layer_input)
         self.y = T.ivector('y') #store the labels for the corresponding inputs
 
         self.fine_cost = T.dscalar('fine_cost') #fine tuning cost
@@ -120,12 +129,30 @@ class StackedAutoencoder(object):
         #measure test performance
         self.error = self.softmax.get_error(self.y)
 
+        #one optimizer per pretrained layer and one for fine tuning, created here so their accumulators and
+        #learning rates (shared variables) exist before any function is compiled or loaded
+        self.optimizer = optimizer
+        self.optimizer_params = {} if optimizer_params is None else optimizer_params
+        self.pre_optimizers = [get_optimizer(optimizer, sa.theta, **self.optimizer_params) for sa in self.sa_layers]
+        self.fine_optimizer = get_optimizer(optimizer, self.thetas, **self.optimizer_params)
+
+        self.fn_cache = None if function_cache_dir is None else FunctionCache(function_cache_dir)
+
 
-    def load_data(self,file_path='Data'+os.sep+'mnist.pkl.gz'):
+    #file_path can also be the prefix of a dataset converted with BinaryDataset.py, which is memory mapped
+    #window_size - if given, the training set is streamed through a shared window of that many examples
+    def load_data(self,file_path='Data'+os.sep+'mnist.pkl.gz',window_size=None):
 
-        f = gzip.open(file_path, 'rb')
-        train_set, valid_set, test_set = cPickle.load(f)
-        f.close()
+        if window_size is not None and has_binary_dataset(file_path):
+            #the training set stays memory mapped and is streamed window by window (see StreamingDataset)
+            train_set = load_split(split_path(file_path, 'train'))
+            valid_set, test_set = load_binary_dataset(file_path, config.floatX, SPLITS[1:])
+        elif has_binary_dataset(file_path):
+            train_set, valid_set, test_set = load_binary_dataset(file_path, config.floatX)
+        else:
+            f = gzip.open(file_path, 'rb')
+            train_set, valid_set, test_set = cPickle.load(f)
+            f.close()
 
 
         def get_shared_data(data_xy):
@@ -136,7 +163,11 @@ class StackedAutoencoder(object):
             return shared_x,T.cast(shared_y,'int32')
 
 
-        train_x,train_y = get_shared_data(train_set)
+        #with window_size only a window of the training set is kept in a shared variable
+        if window_size is None:
+            train_x,train_y = get_shared_data(train_set)
+        else:
+            train_x,train_y = StreamingDataset(train_set[0], train_set[1], window_size, self.batch_size, *train_set[2:]).get_shared_data()
         valid_x,valid_y = get_shared_data(valid_set)
         test_x,test_y = get_shared_data(test_set)
 
@@ -147,67 +178,242 @@ class StackedAutoencoder(object):
 
     def greedy_pre_training(self, train_x, batch_size=1, pre_lr=0.25,denoising=False):
 
+        print "\nCompiling functions for DA layers..."
         pre_train_fns = []
+        for i in xrange(self.n_layers):
+            pre_train_fns.append(self.get_pre_training_fn(i, train_x, batch_size, pre_lr, denoising))
+
+        return pre_train_fns
+
+    # pretraining function of layer i
+    # layer_input - if True, train_x holds the inputs of layer i (see materialize_layer_input) instead of the
+    # network inputs, so a step only computes layer i instead of the forward pass through layers 0..i-1 as well
+    def get_pre_training_fn(self, i, train_x, batch_size=1, pre_lr=0.25, denoising=False, layer_input=False):
+
         index = T.lscalar('index')
         lam = T.scalar('lam')
         beta = T.scalar('beta')
         rho = T.scalar('rho')
+        sa = self.sa_layers[i]
+
+        #the learning rate is a shared variable of the optimizer, so a compiled function (see compile) works for any learning rate
+        self.pre_optimizers[i].l_rate.set_value(pre_lr)
+
+        #the givens section in this line set the self.x that we assign as input to the initial
+        # curr_input value be a small batch rather than the full batch.
+        # however, we don't need to set subsequent inputs to be an only a minibatch
+        # because if self.x is only a portion, you're going to get the hidden activations
+        # corresponding to that small batch of inputs.
+        # Therefore, setting self.x to be a mini-batch is enough to make all the subsequents use
+        # hidden activations corresponding to that mini batch of self.x
+        x_given, layer_x = self.x, None
+        if layer_input and i > 0:
+            #the graph (incl. the dropout and corruption draws) starts at the input of the layer instead
+            x_given = layer_x = self.get_layer_input(i)
+
+        #the graph is built even if the function is loaded from the function cache, so the random streams have the
+        #same states (see get_rng_vars) whether it is compiled or not
+        cost, updates = sa.get_cost_and_updates(l_rate=None, lam=lam, beta=beta, rho=rho, cost_fn=self.cost_fn_names[1],
+                                                corruption_level=self.corruption_levels[i], denoising=denoising,
+                                                optimizer=self.pre_optimizers[i], input=layer_x)
+
+        def compile_fn():
+            return function(inputs=[index, Param(lam, default=0.25), Param(beta, default=0.25), Param(rho, default=0.2)],
+                            outputs=cost, updates=updates, givens={
+                x_given: train_x[index * batch_size: (index+1) * batch_size]
+                }
+            )
 
-        i = 0
-        print "\nCompiling functions for DA layers..."
-        for sa in self.sa_layers:
+        return self.compile('pre_train_%i' %i, compile_fn, [train_x], batch_size, denoising, layer_input and i > 0)
+
+    # variable for the precomputed inputs of layer i (see materialize_layer_input), one per layer so the
+    # dropout and corruption drawn from it are the same in every graph
+    def get_layer_input(self, i):
+        if i not in self.layer_inputs:
+            self.layer_inputs[i] = T.matrix('x_layer_%i' % i)
+        return self.layer_inputs[i]
+
+    # computes the hidden activations of layer i-1 (the inputs of layer i) for the whole training set once,
+    # so layer i can be pretrained from them (see get_pre_training_fn) instead of recomputing them every epoch.
+    # The deterministic (test time) activations are used. They are kept in a shared variable, or in a memory mapped
+    # file in materialize_dir, which is streamed like the training set if that is streamed (see StreamingDataset)
+    def materialize_layer_input(self, i, train_x, materialize_dir=None):
+        n_batches = n_examples(train_x) / self.batch_size
+        index = T.lscalar('index')
 
+        def compile_fn():
+            return function(inputs=[index], outputs=self.sa_activations_test[i-1], givens={
+                self.x: train_x[index * self.batch_size: (index+1) * self.batch_size]
+            })
 
-            cost, updates = sa.get_cost_and_updates(l_rate=pre_lr, lam=lam, beta=beta, rho=rho, cost_fn=self.cost_fn_names[1],
-                                                    corruption_level=self.corruption_levels[i], denoising=denoising)
+        output_fn = self.compile('layer_output_%i' %(i-1), compile_fn, [train_x])
 
-            #the givens section in this line set the self.x that we assign as input to the initial
-            # curr_input value be a small batch rather than the full batch.
-            # however, we don't need to set subsequent inputs to be an only a minibatch
-            # because if self.x is only a portion, you're going to get the hidden activations
-            # corresponding to that small batch of inputs.
-            # Therefore, setting self.x to be a mini-batch is enough to make all the subsequents use
-            # hidden activations corresponding to that mini batch of self.x
-            sa_fn = function(inputs=[index, Param(lam, default=0.25), Param(beta, default=0.25), Param(rho, default=0.2)], outputs=cost, updates=updates, givens={
-                self.x: train_x[index * batch_size: (index+1) * batch_size]
-                }
-            )
+        shape = (n_batches * self.batch_size, self.h_sizes[i-1])
+        if materialize_dir is None:
+            layer_x = np.empty(shape, dtype=config.floatX)
+        else:
+            self.mkdir_if_not_exist(materialize_dir)
+            layer_x = np.memmap(os.path.join(materialize_dir, 'layer_%i_input.dat' %i), dtype=config.floatX, mode='w+', shape=shape)
 
-            pre_train_fns.append(sa_fn)
-            i = i+1
+        start_time = time.clock()
+        for batch_index in xrange(n_batches):
+            layer_x[batch_index * self.batch_size: (batch_index+1) * self.batch_size] = output_fn(window_index(train_x, batch_index))
+        print "Materialized the inputs of layer %i %s (%f s)" %(i, str(shape), time.clock() - start_time)
 
-        return pre_train_fns
+        stream = streams.get(train_x)
+        if materialize_dir is not None and stream is not None:
+            return StreamingDataset(layer_x, np.zeros((shape[0],)), stream.window_size, self.batch_size).shared_x
+        return shared(value=np.asarray(layer_x), name='layer_%i_input' %i, borrow=True)
 
-    def fine_tuning(self, datasets, batch_size=1, fine_lr=0.2):
+    #valid_score evaluates the validation set in chunks of eval_chunk_size examples (see get_evaluation_fn)
+    def fine_tuning(self, datasets, batch_size=1, fine_lr=0.2, eval_chunk_size=10000):
         (train_set_x, train_set_y) = datasets[0]
         (valid_set_x, valid_set_y) = datasets[1]
         (test_set_x, test_set_y) = datasets[2]
 
-        n_valid_batches = valid_set_x.get_value(borrow=True).shape[0]
-        n_valid_batches /= batch_size
-
         index = T.lscalar('index')  # index to a [mini]batch
+        self.fine_optimizer.l_rate.set_value(fine_lr)
 
-        gparams = T.grad(self.fine_cost, self.thetas)
-
-        updates = [(param, param - gparam*fine_lr)
-                   for param, gparam in zip(self.thetas,gparams)]
+        def compile_fine_tune_fn():
+            gparams = T.grad(self.fine_cost, self.thetas)
+            updates = self.fine_optimizer.get_updates(gparams)
 
-        fine_tuen_fn = function(inputs=[index, Param(self.lam_fine_tune,default=0.25)],outputs=self.fine_cost, updates=updates, givens={
-            self.x: train_set_x[index * self.batch_size: (index+1) * self.batch_size],
-            self.y: train_set_y[index * self.batch_size: (index+1) * self.batch_size]
-        })
+            return function(inputs=[index, Param(self.lam_fine_tune,default=0.25)],outputs=self.fine_cost, updates=updates, givens={
+                self.x: train_set_x[index * self.batch_size: (index+1) * self.batch_size],
+                self.y: train_set_y[index * self.batch_size: (index+1) * self.batch_size]
+            })
 
-        validation_fn = function(inputs=[index],outputs=self.error, givens={
-            self.x: valid_set_x[index * batch_size: (index + 1) * batch_size],
-            self.y: valid_set_y[index * batch_size: (index + 1) * batch_size]
-        },name='valid')
+        fine_tuen_fn = self.compile('fine_tune', compile_fine_tune_fn, [train_set_x, train_set_y])
+        evaluate_valid = self.get_evaluation_fn('valid', valid_set_x, valid_set_y, eval_chunk_size)
 
         def valid_score():
-            return [validation_fn(i) for i in xrange(n_valid_batches)]
+            return evaluate_valid()[0]
         return fine_tuen_fn, valid_score
 
-    def train_model(self, datasets=None, pre_epochs=5, fine_epochs=300, pre_lr=0.25, fine_lr=0.2, batch_size=1, lam=0.0001, beta=0.25, rho = 0.2,denoising=False):
+    # one compiled function computes the errors and the examples of every class for chunk_size examples at once,
+    # so evaluating a set takes ceil(n_examples/chunk_size) calls (one if the set fits in a chunk) instead of one per minibatch
+    # returns a function evaluating the whole set, which returns the error rate, errors per class and examples per class
+    def get_evaluation_fn(self, name, set_x, set_y, chunk_size=10000):
+        n_examples = set_x.get_value(borrow=True).shape[0]
+        chunk_size = min(chunk_size, n_examples)
+        n_chunks = (n_examples + chunk_size - 1) / chunk_size
+
+        index = T.lscalar('index')
+
+        def compile_fn():
+            #is_class[i,c] is 1 if example i belongs to class c
+            is_class = T.eq(self.y.dimshuffle(0,'x'), T.arange(self.o_size).dimshuffle('x',0))
+            wrong = T.neq(self.softmax.pred, self.y).dimshuffle(0,'x')
+            return function(inputs=[index], outputs=[T.sum(is_class*wrong, axis=0), T.sum(is_class, axis=0)], givens={
+                self.x: set_x[index * chunk_size: (index + 1) * chunk_size],
+                self.y: set_y[index * chunk_size: (index + 1) * chunk_size]
+            }, name=name)
+
+        eval_fn = self.compile(name, compile_fn, [set_x, set_y], chunk_size)
+
+        def evaluate():
+            class_errors = np.zeros((self.o_size,), dtype=np.int64)
+            class_counts = np.zeros((self.o_size,), dtype=np.int64)
+            for i in xrange(n_chunks):
+                errors, counts = eval_fn(i)
+                class_errors += errors
+                class_counts += counts
+            return np.sum(class_errors)*1.0/n_examples, class_errors, class_counts
+
+        return evaluate
+
+    # compiles a theano function with compile_fn, or loads it from the function cache
+    # data - datasets (shared variables) used in givens, key_parts - options the graph depends on besides the architecture
+    def compile(self, name, compile_fn, data, *key_parts):
+        if self.fn_cache is None:
+            return compile_fn()
+
+        arch = (self.i_size, tuple(self.h_sizes), self.o_size, self.batch_size, self.dropout, tuple(self.drop_rates),
+                tuple(self.corruption_levels), tuple(self.cost_fn_names), self.optimizer, tuple(sorted(self.optimizer_params.items())))
+        return self.fn_cache.get_or_compile(name, (arch,) + key_parts, compile_fn, self.get_named_vars(), data)
+
+    # every shared variable of the model under a name that does not depend on the order the graphs were built in
+    def get_named_vars(self):
+        named_vars = OrderedDict()
+        for i, var in enumerate(self.get_state_vars()):
+            named_vars['param_%i' % i] = var
+        named_vars.update(self.get_named_rng_vars())
+        for i, var in enumerate(self.get_optimizer_vars()):
+            named_vars['optimizer_%i' % i] = var
+        return named_vars
+
+    # shared variables that make up the state of the network (weights of every layer incl. the decoders and softmax)
+    def get_state_vars(self):
+        state_vars = []
+        for sa in self.sa_layers:
+            state_vars.extend(sa.theta)
+        state_vars.extend(self.softmax.theta)
+        return state_vars
+
+    # states of the theano random streams used for corruption and dropout
+    def get_rng_vars(self):
+        return self.get_named_rng_vars().values()
+
+    # the states by stream, e.g. 'sa1_corruption_0' is the first state drawn from the corruption stream of layer 1
+    def get_named_rng_vars(self):
+        rng_vars = OrderedDict()
+        for i, sa in enumerate(self.sa_layers):
+            for j, su in enumerate(sa.theano_rng.state_updates):
+                rng_vars['sa%i_corruption_%i' % (i, j)] = su[0]
+        for name, layer in zip(['sa%i' % i for i in xrange(self.n_layers)] + ['softmax'], self.sa_layers + [self.softmax]):
+            if layer.dropout:
+                for j, su in enumerate(layer.dropout_layer.rng.state_updates):
+                    rng_vars['%s_dropout_%i' % (name, j)] = su[0]
+        return rng_vars
+
+    # draws every random state the graphs of train_model use (the layers keep the draws, see Dropout), so they all
+    # exist and have the same names (see get_named_rng_vars) whichever phase training starts in
+    # materialize - the pretraining graphs start at the precomputed layer inputs (see get_layer_input)
+    def build_rng_states(self, denoising=False, materialize=False):
+        if denoising:
+            #check if there are layer_count number of corruption levels
+            assert self.n_layers == len(self.corruption_levels)
+
+        for i, sa in enumerate(self.sa_layers):
+            inputs = [sa.x_train]
+            if materialize and i > 0:
+                inputs.append(self.get_layer_input(i))
+            for x in inputs:
+                if denoising:
+                    x = sa.get_corrupted_input(x, self.corruption_levels[i])
+                sa.forward_pass(x, training=True)
+
+    # sets the shared variables to the values of a checkpoint, which have to belong to the same model
+    def restore_vars(self, what, vars, values):
+        if len(vars) != len(values):
+            raise ValueError("Checkpoint has %i %s values, the model has %i" %(len(values), what, len(vars)))
+        for var, value in zip(vars, values):
+            var.set_value(value)
+
+    def restore_named_vars(self, what, named_vars, values):
+        if not isinstance(values, dict) or set(named_vars) != set(values):
+            raise ValueError("Checkpoint %s values do not match the model (%s)" %(what, ', '.join(named_vars)))
+        for name, var in named_vars.iteritems():
+            var.set_value(values[name])
+
+    # learning rates and accumulators of the optimizers
+    def get_optimizer_vars(self):
+        optimizer_vars = []
+        for optimizer in self.pre_optimizers + [self.fine_optimizer]:
+            optimizer_vars.extend(optimizer.get_state_vars())
+        return optimizer_vars
+
+    # checkpoint_file - if given, the training state (weights, optimizer, counters, early-stopping values, RNG states) is written
+    # there in the background every checkpoint_freq minibatches. With resume=True training continues from that file
+    # pre_plateau_tol, pre_plateau_patience - pretraining of a layer stops when its cost did not improve by
+    # pre_plateau_tol (relative, e.g. 1e-3) for pre_plateau_patience epochs (see PlateauDetector). It is off (None) by default,
+    # so every layer is pretrained for pre_epochs epochs unless it is given
+    # Fine tuning ends with the parameters that had the best validation error (see EarlyStopping)
+    # materialize - if True, the inputs of every layer are computed once before it is pretrained (see materialize_layer_input),
+    # in a memory mapped file in materialize_dir if it is given, otherwise in a shared variable
+    def train_model(self, datasets=None, pre_epochs=5, fine_epochs=300, pre_lr=0.25, fine_lr=0.2, batch_size=1, lam=0.0001, beta=0.25, rho = 0.2,denoising=False,
+                    checkpoint_file=None, checkpoint_freq=1000, resume=True, pre_plateau_tol=None, pre_plateau_patience=2,
+                    materialize=False, materialize_dir=None):
 
         print "Training Info..."
         print "Batch size: ",
@@ -222,6 +428,9 @@ class StackedAutoencoder(object):
         print "Dropout: ",
         print self.dropout,
         print self.drop_rates
+        print "Optimizer: ",
+        print self.optimizer,
+        print self.optimizer_params
         print "Sparcity: ",
         print "%f (beta) %f (rho)" %(beta,rho)
 
@@ -229,26 +438,118 @@ class StackedAutoencoder(object):
         (valid_set_x, valid_set_y) = datasets[1]
         (test_set_x, test_set_y) = datasets[2]
 
-        n_train_batches = train_set_x.get_value(borrow=True).shape[0] / batch_size
-
-        pre_train_fns = self.greedy_pre_training(train_set_x, batch_size=self.batch_size,pre_lr=pre_lr,denoising=denoising)
-
-        start_time = time.clock()
-        for i in xrange(self.n_layers):
-
-            print "\nPretraining layer %i" %i
-            for epoch in xrange(pre_epochs):
-                c=[]
-                for batch_index in xrange(n_train_batches):
-                    c.append(pre_train_fns[i](index=batch_index, lam=lam, beta=beta, rho=rho))
+        n_train_batches = n_examples(train_set_x) / batch_size
 
-                print 'Training epoch %d, cost ' % epoch,
-                print np.mean(c)
-
-            end_time = time.clock()
-            training_time = (end_time - start_time)
+        #########################################################################
+        #####                          Checkpointing                        #####
+        #########################################################################
+        #phase, layer, epoch and batch point to the next minibatch to be trained
+        state = {'phase': 'pre', 'layer': 0, 'epoch': 0, 'batch': 0, 'step': 0, 'done_looping': False,
+                 'pre_epochs_run': 0, 'fine_epochs_run': 0}
 
-            print "Training time: %f" %training_time
+        #########################################################################
+        #####                         Early-Stopping                        #####
+        #########################################################################
+        # look at 10 epochs worth of minibatches at least
+        stopper = EarlyStopping(self.thetas, patience=10 * n_train_batches, patience_increase=2., improvement_threshold=0.995)
+
+        #checkpoints store the random states by stream, so every graph drawing from them is built first and
+        #the states are the same whether training starts in pretraining, in the middle of it or in fine tuning
+        self.build_rng_states(denoising, materialize)
+
+        #plateau detector of the layer being pretrained and the costs of its epoch in progress. They are checkpointed
+        #too, so a resumed layer stops after the same epoch as it would have without the interruption
+        pretraining = {'plateau': None, 'costs': []}
+        resumed_pretraining = None
+
+        checkpointer = None
+        if checkpoint_file is not None:
+            checkpointer = Checkpointer(checkpoint_file, checkpoint_freq)
+            saved = checkpointer.load() if resume else None
+            if saved is not None:
+                self.restore_vars('params', self.get_state_vars(), saved['params'])
+                self.restore_named_vars('theano_rng', self.get_named_rng_vars(), saved['theano_rng'])
+                self.restore_vars('optimizer', self.get_optimizer_vars(), saved.get('optimizer', []))
+                np.random.set_state(saved['rng'])
+                state.update(saved['counters'])
+                stopper.set_state(saved['early_stopping'])
+                resumed_pretraining = saved.get('pretraining')
+                print "Resuming from checkpoint (%s, layer %i, epoch %i, minibatch %i)" %(state['phase'],state['layer'],state['epoch'],state['batch'])
+
+        def checkpoint():
+            checkpointer.save({'params': [var.get_value() for var in self.get_state_vars()],
+                               'theano_rng': dict((name, var.get_value()) for name, var in self.get_named_rng_vars().iteritems()),
+                               'optimizer': [var.get_value() for var in self.get_optimizer_vars()],
+                               'rng': np.random.get_state(),
+                               'counters': dict(state),
+                               'early_stopping': stopper.get_state(),
+                               'pretraining': {'plateau': None if pretraining['plateau'] is None else pretraining['plateau'].get_state(),
+                                               'costs': list(pretraining['costs'])}})
+
+        # called after every minibatch, state already points to the next one
+        def step_done():
+            state['step'] += 1
+            if checkpointer is not None and checkpointer.due(state['step']-1):
+                checkpoint()
+
+        if state['phase'] == 'pre':
+            if not materialize:
+                pre_train_fns = self.greedy_pre_training(train_set_x, batch_size=self.batch_size,pre_lr=pre_lr,denoising=denoising)
+
+            start_time = time.clock()
+            for i in xrange(state['layer'], self.n_layers):
+
+                print "\nPretraining layer %i" %i
+                layer_x = train_set_x
+                if materialize:
+                    #the lower layers are trained already, so their outputs are computed only once
+                    if i > 0:
+                        layer_x = self.materialize_layer_input(i, train_set_x, materialize_dir)
+                    pre_train_fn = self.get_pre_training_fn(i, layer_x, self.batch_size, pre_lr, denoising, layer_input=True)
+                else:
+                    pre_train_fn = pre_train_fns[i]
+
+                plateau = PlateauDetector(pre_plateau_tol, pre_plateau_patience) if pre_plateau_tol is not None else None
+                resumed_costs = []
+                if resumed_pretraining is not None:
+                    #the checkpoint was written while this layer was pretrained
+                    if plateau is not None and resumed_pretraining['plateau'] is not None:
+                        plateau.set_state(resumed_pretraining['plateau'])
+                    resumed_costs = resumed_pretraining['costs']
+                    resumed_pretraining = None
+                pretraining['plateau'] = plateau
+
+                for epoch in xrange(state['epoch'], pre_epochs):
+                    c = resumed_costs
+                    resumed_costs = []
+                    pretraining['costs'] = c
+                    for batch_index in xrange(state['batch'], n_train_batches):
+                        c.append(pre_train_fn(index=window_index(layer_x, batch_index), lam=lam, beta=beta, rho=rho))
+                        state['batch'] = batch_index + 1
+                        step_done()
+
+                    print 'Training epoch %d, cost ' % epoch,
+                    print np.mean(c)
+                    state['epoch'] = epoch + 1
+                    state['batch'] = 0
+                    state['pre_epochs_run'] += 1
+
+                    if plateau is not None and plateau.update(np.mean(c)):
+                        print "Cost of layer %i has not improved for %i epochs, stopping after epoch %i/%i" %(i,pre_plateau_patience,epoch+1,pre_epochs)
+                        break
+
+                end_time = time.clock()
+                training_time = (end_time - start_time)
+
+                print "Training time: %f" %training_time
+                state['layer'] = i + 1
+                state['epoch'] = 0
+
+            state['phase'] = 'fine'
+            state['epoch'] = 0
+            state['batch'] = 0
+            if checkpointer is not None:
+                checkpoint()
 
         #########################################################################
         #####                          Fine Tuning                          #####
@@ -257,27 +558,20 @@ class StackedAutoencoder(object):
 
         fine_tune_fn,valid_model = self.fine_tuning(datasets,batch_size=self.batch_size,fine_lr=fine_lr)
 
-        #########################################################################
-        #####                         Early-Stopping                        #####
-        #########################################################################
-        patience = 10 * n_train_batches # look at this many examples
-        patience_increase = 2.
-        improvement_threshold = 0.995
-        #validation frequency - the number of minibatches to go through before checking validation set
-        validation_freq = min(n_train_batches,patience/2)
+        if self.fn_cache is not None:
+            self.fn_cache.report()
 
-        #we want to minimize best_valid_loss, so we shoudl start with largest
-        best_valid_loss = np.inf
-        test_score = 0.
+        #validation frequency - the number of minibatches to go through before checking validation set
+        validation_freq = min(n_train_batches,stopper.patience/2)
 
-        done_looping = False
-        epoch = 0
+        done_looping = state['done_looping']
+        epoch = state['epoch']
 
         while epoch < fine_epochs and (not done_looping):
             epoch = epoch + 1
             fine_tune_cost = []
-            for mini_index in xrange(n_train_batches):
-                cost = fine_tune_fn(index=mini_index,lam=lam)
+            for mini_index in xrange(state['batch'], n_train_batches):
+                cost = fine_tune_fn(index=window_index(train_set_x, mini_index),lam=lam)
                 fine_tune_cost.append(cost)
                 #what's the role of iter? iter acts as follows
                 #in first epoch, iter for minibatch 'x' is x
@@ -288,58 +582,66 @@ class StackedAutoencoder(object):
                 # this is an operation done in cycles. 1 cycle is iter+1/validation_freq
                 # doing this every epoch
                 if (iter+1) % validation_freq == 0:
-                    validation_losses = valid_model()
-                    curr_valid_loss = np.mean(validation_losses)
+                    curr_valid_loss = valid_model()
                     print 'epoch %i, minibatch %i/%i, validation error is %f %%' %(epoch, mini_index+1,n_train_batches,curr_valid_loss*100)
 
-                    if curr_valid_loss < best_valid_loss:
-
-                        if (
-                            curr_valid_loss < best_valid_loss * improvement_threshold
-                        ):
-                            patience = max(patience, iter * patience_increase)
+                    #copies the parameters if this is the best validation error so far
+                    stopper.update(curr_valid_loss, iter)
 
-                        best_valid_loss = curr_valid_loss
-                        best_iter = iter
+                #the checkpoint continues with the next minibatch (of epoch-1, the epoch in progress, or of the next one)
+                if mini_index+1 < n_train_batches:
+                    state.update({'epoch': epoch-1, 'batch': mini_index+1})
+                else:
+                    state.update({'epoch': epoch, 'batch': 0})
+                step_done()
 
+            state['batch'] = 0
+            state['fine_epochs_run'] = epoch
             print 'Fine tune cost for epoch %i, is %f' %(epoch+1,np.mean(fine_tune_cost))
             #patience is here to check the maximum number of iterations it should check
             #before terminating
-            if patience <= iter:
+            if stopper.should_stop(iter):
                 done_looping = True
                 break
 
+        if stopper.restore():
+            print "Restored the parameters of minibatch %i (validation error %f %%)" %(stopper.best_iter+1,stopper.best_valid_loss*100)
 
-    def test_model(self,test_set_x,test_set_y,batch_size= 1):
+        pre_total = self.n_layers * pre_epochs
+        saved_epochs = (pre_total - state['pre_epochs_run']) + (fine_epochs - state['fine_epochs_run'])
+        print "Early stopping: ran %i/%i pretraining epochs and %i/%i fine tuning epochs, saved %i epochs (%f %%)" \
+              %(state['pre_epochs_run'],pre_total,state['fine_epochs_run'],fine_epochs,saved_epochs,100.0*saved_epochs/max(1,pre_total+fine_epochs))
 
-        print '\nTesting the model...'
-        n_test_batches = test_set_x.get_value(borrow=True).shape[0] / batch_size
+        if checkpointer is not None:
+            state['done_looping'] = done_looping
+            checkpoint()
+            checkpointer.wait()
 
-        index = T.lscalar('index')
+
+    #the whole test set is evaluated in chunks of chunk_size examples (batch_size is not used any more)
+    def test_model(self,test_set_x,test_set_y,batch_size= 1,chunk_size=10000):
+
+        print '\nTesting the model...'
 
         #no update parameters, so this just returns the values it calculate
         #without objetvie function minimization
-        test_fn = function(inputs=[index], outputs=[self.error], givens={
-            self.x: test_set_x[
-                index * batch_size: (index + 1) * batch_size
-            ],
-            self.y: test_set_y[
-                index * batch_size: (index + 1) * batch_size
-            ]
-        }, name='test')
-
-        e=[]
-        for batch_index in xrange(n_test_batches):
-            err = test_fn(batch_index)
-            e.append(err)
-
-        print 'Test Error %f ' % np.mean(e)
+        test_fn = self.get_evaluation_fn('test', test_set_x, test_set_y, chunk_size)
+        if self.fn_cache is not None:
+            self.fn_cache.report()
+
+        err, class_errors, class_counts = test_fn()
+
+        print 'Test Error %f ' % err
+        print 'Errors per class: ',
+        print ', '.join(['%i: %i/%i' %(c, class_errors[c], class_counts[c]) for c in xrange(self.o_size)])
 
     def mkdir_if_not_exist(self, name):
         if not os.path.exists(name):
             os.makedirs(name)
 
-    def visualize_hidden(self,threshold):
+    # n_workers, time_budget (seconds per unit) and n_iter - see MaxActivation.maximize_activations_parallel
+    # the filter of every unit is also saved to filters_layer_<i>/ as soon as it is found
+    def visualize_hidden(self,threshold,n_workers=None,time_budget=None,n_iter=100):
         print '\nSaving hidden layer filters...\n'
 
         #Visualizing 1st hidden layer
@@ -361,7 +663,14 @@ class StackedAutoencoder(object):
             inp = np.asarray(inp,dtype=config.floatX)
             input = shared(value=inp, name='input',borrow=True)
 
-            max_ins = self.get_max_activations(input,threshold,i)
+            dir_name = 'filters_layer_'+str(i)
+            self.mkdir_if_not_exist(dir_name)
+            def save_filters(units,X,act):
+                for u,x in zip(units,X):
+                    Image.fromarray(tile_raster_images(
+                        X=x.reshape(1,-1), img_shape=(im_side, im_side), tile_shape=(1, 1))).save(dir_name+os.sep+'unit_'+str(u)+'.png')
+
+            max_ins = self.get_max_activations(input,threshold,i,n_workers,time_budget,n_iter,save_filters)
 
             f_name = 'my_filter_layer_'+str(i)+'.png'
             im_side = sqrt(self.i_size)
@@ -381,75 +690,41 @@ class StackedAutoencoder(object):
     def sigmoid(self, x):
         return 1.0 / (1.0 + np.exp(-x))
 
-    def cost(self,input,theta_as_blocks,layer_idx,index):
-
-        layer_input = input
-        for i in xrange(layer_idx):
-            a = self.sigmoid(np.dot(layer_input,theta_as_blocks[i][0]) + theta_as_blocks[i][1])
-            layer_input = a
-
-        cost = self.sigmoid(np.dot(layer_input,theta_as_blocks[layer_idx][0]) + theta_as_blocks[layer_idx][1])[index]
-        #print "         Cost for node %i in layer %i is %f" %(index,layer_idx,cost)
-        return -cost
-
-    def cost_prime(self, input, theta_as_blocks, layer_idx, index):
-        prime = optimize.approx_fprime(input, self.cost, 0.00000001, theta_as_blocks, layer_idx, index)
-        return prime
-
-    def get_max_activations(self,input,threshold,layer_idx):
-
-        #constraint for x
-        def con_x_norm(x,threshold):
-            return threshold-LA.norm(x)
-        cons = {'type': 'ineq','fun': con_x_norm,'args': (threshold,)}
+    def get_max_activations(self,input,threshold,layer_idx,n_workers=None,time_budget=None,n_iter=100,callback=None):
 
         print 'Calculating max activations for layer %i...\n' % layer_idx
 
-        input_arr = input.get_value()
-        max_inputs = []
-
-        print 'Getting max activations for layer %i\n' % layer_idx
         #creating the ndarray from symbolic theta
         theta_as_blocks_arr = []
-
-        print 'Getting theta_as_blocks for layer %i' % layer_idx
         for k in xrange(layer_idx+1):
-            print '     Getting thetas for layer %i' % k
             theta_as_blocks_arr.append([self.thetas_as_blocks[k][0].get_value(),self.thetas_as_blocks[k][1].get_value()])
 
-        print '\nPerforming optimization (SLSQP) for layer %i...' % layer_idx
+        #the nodes of the layer are optimized in chunks by a process pool with analytic gradients (see MaxActivation)
+        start_time = time.time()
+        max_inputs, max_acts = maximize_activations_parallel(theta_as_blocks_arr, input.get_value(), threshold, None,
+                                                             n_iter=n_iter, time_budget=time_budget, n_workers=n_workers, callback=callback)
+        elapsed = time.time()-start_time
+        print 'Max activations for layer %i: mean %f, min %f (%f s, %f units/s)' %(layer_idx, np.mean(max_acts), np.min(max_acts), elapsed, len(max_acts)/max(elapsed,1e-12))
 
-        printed_50 = False
-        printed_90 = False
-        for j in xrange(self.h_sizes[layer_idx]):
-            #print '     Getting max input for node %i in layer %i' % (j, i)
-            init_val = input_arr
-            res = optimize.minimize(fun=self.cost, x0=init_val, args=(theta_as_blocks_arr,layer_idx,j),
-                                    jac=self.cost_prime, method='SLSQP', constraints=cons, options={'maxiter': 5})
-
-            if LA.norm(res.x) > threshold:
-                print '     Threshold exceeded node %i layer %i norm %f/%f' % (j, layer_idx, LA.norm(res.x), threshold)
-            max_inputs.append(res.x)
-
-            if j*1.0/self.h_sizes[layer_idx] > .9 and not printed_90:
-                print '     90% completed...'
-                printed_90 = True
-            elif j*1.0/self.h_sizes[layer_idx] > .5 and not printed_50:
-                print '     50% completed...'
-                printed_50 = True
-
-        return np.asarray(max_inputs)
+        return max_inputs
 
 
 if __name__ == '__main__':
     #sys.argv[1:] is used to drop the first argument of argument list
     #because first argument is always the filename
     try:
-        opts,args = getopt.getopt(sys.argv[1:],"h:p:f:b:d:",["w_decay=","early_stopping=","dropout=","corruption=","beta=","rho="])
+        opts,args = getopt.getopt(sys.argv[1:],"h:p:f:b:d:",["w_decay=","early_stopping=","dropout=","corruption=","beta=","rho=","fn_cache=","window=","optimizer=","materialize="])
     except getopt.GetoptError:
         print '<filename>.py -h [<hidden values>] -p <pre-epochs> -f <fine-tuning-epochs> -b <batch_size> -d <data_folder>'
         sys.exit(2)
 
+    fn_cache_dir = None
+    window_size = None
+    optimizer = 'sgd'
+    optimizer_params = {}
+    materialize = False
+    materialize_dir = None
+
     #when I run in command line
     if len(opts)!=0:
         lam = 0.0
@@ -493,6 +768,21 @@ if __name__ == '__main__':
                 beta = float(arg)
             elif opt == '--rho':
                 rho = float(arg)
+            elif opt == '--fn_cache':
+                fn_cache_dir = arg
+            elif opt == '--window':
+                window_size = int(arg)
+            elif opt == '--optimizer':
+                #e.g. --optimizer=momentum,momentum=0.9
+                optimizer = arg.split(',')[0]
+                for param_str in arg.split(',')[1:]:
+                    param_name, param_value = param_str.split('=')
+                    optimizer_params[param_name.strip()] = float(param_value)
+            elif opt == '--materialize':
+                #y - layer inputs in shared variables, otherwise the directory for memory mapped layer inputs
+                materialize = True
+                if arg != 'y':
+                    materialize_dir = arg
 
     #when I run in Pycharm
     else:
@@ -508,9 +798,11 @@ if __name__ == '__main__':
         denoising=True
         beta = 0.0
         rho = 0.2
-    sae = StackedAutoencoder(hidden_size=hid, batch_size=b_size, corruption_levels=corr_level,dropout=dropout,drop_rates=drop_rates)
-    all_data = sae.load_data(data_dir)
-    sae.train_model(datasets=all_data, pre_epochs=pre_ep, fine_epochs=fine_ep, batch_size=sae.batch_size, lam=lam, beta=beta, rho=rho, denoising=denoising)
+    sae = StackedAutoencoder(hidden_size=hid, batch_size=b_size, corruption_levels=corr_level,dropout=dropout,drop_rates=drop_rates,function_cache_dir=fn_cache_dir,
+                             optimizer=optimizer,optimizer_params=optimizer_params)
+    all_data = sae.load_data(data_dir,window_size=window_size)
+    sae.train_model(datasets=all_data, pre_epochs=pre_ep, fine_epochs=fine_ep, batch_size=sae.batch_size, lam=lam, beta=beta, rho=rho, denoising=denoising,
+                    materialize=materialize, materialize_dir=materialize_dir)
     sae.test_model(all_data[2][0],all_data[2][1],batch_size=sae.batch_size)
     #max_inp = sae.get_input_threshold(all_data[0][0])
     #sae.visualize_hidden(max_inp)
\ No newline at end of file
@@ -0,0 +1,104 @@
+__author__ = 'Thushan Ganegedara'
+
+import threading
+import weakref
+import numpy as np
+from theano import config, shared
+import theano.tensor as T
+
+# Streams a dataset that is too large for one shared variable (e.g. a np.memmap from BinaryDataset) to theano.
+# Only a window of window_size examples is kept in a shared variable. Compiled functions are built on the window
+# exactly like on a full shared dataset (givens={x: shared_x[index*batch_size:(index+1)*batch_size]}), the training
+# loop only has to map its minibatch index in to the window with window_index, which swaps in the window holding
+# that minibatch. While a window is used, the next one is read and converted in a background thread in to a
+# second host buffer (double buffering), so for sequential minibatches the swap is only the host to device copy.
+# shared variable of the window -> StreamingDataset
+# (kept outside the shared variable, so it can still be pickled with a compiled function)
+streams = weakref.WeakKeyDictionary()
+
+class StreamingDataset(object):
+
+    # data_x - (n_examples, n_features) array or memmap, values are data_x*scale
+    # window_size - examples per window, rounded down to a multiple of batch_size
+    def __init__(self, data_x, data_y, window_size, batch_size, scale=1.0):
+        if not isinstance(data_x, np.ndarray):
+            data_x = np.asarray(data_x, dtype=config.floatX)
+        self.data_x = data_x
+        self.data_y = np.asarray(data_y)
+        self.scale = scale
+        self.batch_size = batch_size
+        self.n_examples = data_x.shape[0]
+
+        self.window_size = max(batch_size, min(window_size, self.n_examples) / batch_size * batch_size)
+        self.batches_per_window = self.window_size / batch_size
+        self.n_windows = (self.n_examples + self.window_size - 1) / self.window_size
+
+        #two host buffers, one is in the shared variable and the other one is filled with the next window
+        self.buffers = [(np.zeros((self.window_size, data_x.shape[1]), dtype=config.floatX),
+                         np.zeros((self.window_size,), dtype=config.floatX)) for _ in xrange(2)]
+        self.curr_buffer = 0
+        self.curr_window = -1
+
+        self.shared_x = shared(value=self.buffers[0][0], borrow=True)
+        self.shared_y = shared(value=self.buffers[0][1], borrow=True)
+        #so n_examples and window_index can find the stream from the shared variable used in givens
+        streams[self.shared_x] = self
+
+        self.prefetch_thread = None
+        self.prefetch_window = -1
+
+        self.load_window(0, 0)
+        self.use_buffer(0, 0)
+
+    # shared variables in the same form as the get_shared_data functions of the models return them
+    def get_shared_data(self):
+        return self.shared_x, T.cast(self.shared_y, 'int32')
+
+    def load_window(self, window, buffer_idx):
+        buf_x, buf_y = self.buffers[buffer_idx]
+        sIdx = window * self.window_size
+        eIdx = min(sIdx + self.window_size, self.n_examples)
+        if self.scale == 1.0:
+            buf_x[:eIdx-sIdx] = self.data_x[sIdx:eIdx]
+        else:
+            np.multiply(self.data_x[sIdx:eIdx], self.scale, out=buf_x[:eIdx-sIdx], casting='unsafe')
+        buf_y[:eIdx-sIdx] = self.data_y[sIdx:eIdx]
+
+    def use_buffer(self, window, buffer_idx):
+        buf_x, buf_y = self.buffers[buffer_idx]
+        #borrow=True, the other buffer is the only one written by the background thread
+        self.shared_x.set_value(buf_x, borrow=True)
+        self.shared_y.set_value(buf_y, borrow=True)
+        self.curr_buffer = buffer_idx
+        self.curr_window = window
+
+        #start reading the window after this one (the first window after the last one, for the next epoch)
+        self.prefetch_window = (window + 1) % self.n_windows
+        if self.prefetch_window != window:
+            self.prefetch_thread = threading.Thread(target=self.load_window, args=(self.prefetch_window, 1 - buffer_idx))
+            self.prefetch_thread.daemon = True
+            self.prefetch_thread.start()
+
+    # makes sure the window holding minibatch batch_index is in the shared variable and returns
+    # the index of that minibatch inside the window
+    def window_index(self, batch_index):
+        window = batch_index / self.batches_per_window
+        if window != self.curr_window:
+            if self.prefetch_thread is not None:
+                self.prefetch_thread.join()
+                self.prefetch_thread = None
+            if window != self.prefetch_window:
+                self.load_window(window, 1 - self.curr_buffer)
+            self.use_buffer(window, 1 - self.curr_buffer)
+
+        return batch_index - window * self.batches_per_window
+
+# number of examples of a dataset given as a shared variable or as the shared variable of a StreamingDataset
+def n_examples(set_x):
+    stream = streams.get(set_x)
+    return set_x.get_value(borrow=True).shape[0] if stream is None else stream.n_examples
+
+# index to use with a function compiled on set_x for minibatch batch_index
+def window_index(set_x, batch_index):
+    stream = streams.get(set_x)
+    return batch_index if stream is None else stream.window_index(batch_index)
@@ -0,0 +1,116 @@
+__author__ = 'Thushan Ganegedara'
+
+import numpy as np
+import theano
+from theano import config, shared
+from theano.compile import SharedVariable
+import theano.tensor as T
+
+# Update rules for the theano models (the same rules as Optimizers.py for the NumPy models, plus RMSProp).
+# An optimizer is created once for a list of parameters (shared variables) and builds the updates list for
+# their gradients. Its accumulators (velocities, moment estimates) are shared variables created right away,
+# so they exist before any function is compiled and can be stored with the model (see get_state_vars).
+# l_rate is a shared variable as well (unless a symbolic scalar is given), so a learning rate schedule
+# only needs l_rate.set_value(...) and not a new compiled function.
+
+class SGD(object):
+
+    def __init__(self, params, l_rate=0.1):
+        self.params = list(params)
+        if isinstance(l_rate, theano.Variable):
+            self.l_rate = l_rate
+        else:
+            self.l_rate = shared(np.asarray(l_rate, dtype=config.floatX), name='l_rate')
+        self.accumulators = []
+
+    # shared variable of zeros shaped like param
+    def accumulator(self, param, name):
+        value = param.get_value(borrow=True)
+        acc = shared(np.zeros(value.shape, dtype=value.dtype), name='%s_%s' % (name, param.name),
+                     broadcastable=param.broadcastable)
+        self.accumulators.append(acc)
+        return acc
+
+    def get_updates(self, grads):
+        return [(param, param - self.l_rate * grad) for param, grad in zip(self.params, grads)]
+
+    # shared variables that make up the state of the optimizer (learning rate and accumulators)
+    def get_state_vars(self):
+        if isinstance(self.l_rate, SharedVariable):
+            return [self.l_rate] + self.accumulators
+        return list(self.accumulators)
+
+class Momentum(SGD):
+
+    def __init__(self, params, l_rate=0.1, momentum=0.9):
+        super(Momentum, self).__init__(params, l_rate)
+        self.momentum = momentum
+        self.velocities = [self.accumulator(param, 'velocity') for param in self.params]
+
+    def get_updates(self, grads):
+        updates = []
+        for param, grad, velocity in zip(self.params, grads, self.velocities):
+            new_velocity = self.momentum * velocity - self.l_rate * grad
+            updates.append((velocity, new_velocity))
+            updates.append((param, param + new_velocity))
+        return updates
+
+class Nesterov(Momentum):
+
+    # the same reformulation as Optimizers.Nesterov, param += -mu*v_prev + (1+mu)*v
+    def get_updates(self, grads):
+        updates = []
+        for param, grad, velocity in zip(self.params, grads, self.velocities):
+            new_velocity = self.momentum * velocity - self.l_rate * grad
+            updates.append((velocity, new_velocity))
+            updates.append((param, param + (1 + self.momentum) * new_velocity - self.momentum * velocity))
+        return updates
+
+class Adam(SGD):
+
+    def __init__(self, params, l_rate=0.001, beta1=0.9, beta2=0.999, eps=1e-8):
+        super(Adam, self).__init__(params, l_rate)
+        self.beta1 = beta1
+        self.beta2 = beta2
+        self.eps = eps
+        self.t = shared(np.asarray(0., dtype=config.floatX), name='adam_t')
+        self.accumulators.append(self.t)
+        self.m = [self.accumulator(param, 'm') for param in self.params]
+        self.v = [self.accumulator(param, 'v') for param in self.params]
+
+    def get_updates(self, grads):
+        t = self.t + 1
+        #bias corrected step size
+        step = self.l_rate * T.sqrt(1 - self.beta2**t) / (1 - self.beta1**t)
+
+        updates = [(self.t, t)]
+        for param, grad, m, v in zip(self.params, grads, self.m, self.v):
+            new_m = self.beta1 * m + (1 - self.beta1) * grad
+            new_v = self.beta2 * v + (1 - self.beta2) * T.sqr(grad)
+            updates.append((m, new_m))
+            updates.append((v, new_v))
+            updates.append((param, param - step * new_m / (T.sqrt(new_v) + self.eps)))
+        return updates
+
+class RMSProp(SGD):
+
+    def __init__(self, params, l_rate=0.001, rho=0.9, eps=1e-6):
+        super(RMSProp, self).__init__(params, l_rate)
+        self.rho = rho
+        self.eps = eps
+        self.mean_squares = [self.accumulator(param, 'mean_square') for param in self.params]
+
+    def get_updates(self, grads):
+        updates = []
+        for param, grad, mean_square in zip(self.params, grads, self.mean_squares):
+            new_mean_square = self.rho * mean_square + (1 - self.rho) * T.sqr(grad)
+            updates.append((mean_square, new_mean_square))
+            updates.append((param, param - self.l_rate * grad / (T.sqrt(new_mean_square) + self.eps)))
+        return updates
+
+optimizers = {'sgd': SGD, 'momentum': Momentum, 'nesterov': Nesterov, 'adam': Adam, 'rmsprop': RMSProp}
+
+def get_optimizer(name, params, **kwargs):
+    if name not in optimizers:
+        raise ValueError("Unknown optimizer '%s', use one of %s" % (name, sorted(optimizers.keys())))
+    return optimizers[name](params, **kwargs)
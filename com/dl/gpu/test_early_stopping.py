@@ -0,0 +1,31 @@
+__author__ = 'Thushan Ganegedara'
+
+import pickle
+
+from EarlyStopping import PlateauDetector
+
+COSTS = [10.0, 9.0, 8.999, 8.998, 7.0, 6.9999, 6.9998, 6.9997]
+
+# epoch after which the detector stops (len(costs) if it does not)
+def stop_epoch(detector, costs, start=0):
+    for epoch in range(start, len(costs)):
+        if detector.update(costs[epoch]):
+            return epoch
+    return len(costs)
+
+def test_plateau_detector_stops_after_patience_epochs():
+    assert stop_epoch(PlateauDetector(1e-3, 2), COSTS) == 3
+    assert stop_epoch(PlateauDetector(1e-3, 3), COSTS) == 7
+
+# a detector restored from a checkpoint stops after the same epoch as one that was not interrupted
+def test_plateau_detector_resume():
+    uninterrupted = stop_epoch(PlateauDetector(1e-3, 3), COSTS)
+    for interrupt in range(1, uninterrupted + 1):
+        detector = PlateauDetector(1e-3, 3)
+        for epoch in range(interrupt):
+            detector.update(COSTS[epoch])
+        saved = pickle.loads(pickle.dumps(detector.get_state()))
+
+        resumed = PlateauDetector(1e-3, 3)
+        resumed.set_state(saved)
+        assert stop_epoch(resumed, COSTS, interrupt) == uninterrupted
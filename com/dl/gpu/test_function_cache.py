@@ -0,0 +1,106 @@
+__author__ = 'Thushan Ganegedara'
+
+import os
+from collections import OrderedDict
+
+import numpy as np
+import pytest
+
+theano = pytest.importorskip('theano')
+from theano import function, config, shared
+import theano.tensor as T
+from theano.tensor.shared_randomstreams import RandomStreams
+
+from FunctionCache import FunctionCache
+from StackedAutoencoderGPU import StackedAutoencoder
+
+# A function loaded from the cache has to give the same results as the function compiled from the same graph,
+# starting from the same state. Every test builds the model again for each run, like a new process would
+
+def build_regression(seed=0):
+    rng = np.random.RandomState(seed)
+    W = shared(np.asarray(rng.rand(5, 3), dtype=config.floatX), name='W')
+    data_x = shared(np.asarray(rng.rand(40, 5), dtype=config.floatX), name='data_x')
+    data_y = shared(np.asarray(rng.randint(0, 3, 40), dtype=config.floatX), name='data_y')
+    return W, data_x, T.cast(data_y, 'int32')
+
+def compile_regression(W, data_x, data_y):
+    index = T.lscalar('index')
+    x = T.matrix('x')
+    y = T.ivector('y')
+    p = T.nnet.softmax(T.dot(x, W))
+    cost = -T.mean(T.log(p)[T.arange(y.shape[0]), y])
+    return function([index], cost, updates=[(W, W - 0.5 * T.grad(cost, W))],
+                    givens={x: data_x[index * 10: (index + 1) * 10], y: data_y[index * 10: (index + 1) * 10]})
+
+def run_regression(cache_dir=None):
+    W, data_x, data_y = build_regression()
+    compile_fn = lambda: compile_regression(W, data_x, data_y)
+    if cache_dir is None:
+        fn = compile_fn()
+    else:
+        fn = FunctionCache(cache_dir).get_or_compile('regression', (), compile_fn, OrderedDict([('W', W)]), [data_x, data_y])
+    costs = [fn(i % 4) for i in range(8)]
+    return costs, W.get_value()
+
+def test_cached_function_matches_compiled(tmpdir):
+    cache_dir = str(tmpdir)
+    costs, W = run_regression()
+
+    for run in range(2):
+        cached_costs, cached_W = run_regression(cache_dir)
+        #a single output is returned as a scalar, not a list
+        assert all(np.ndim(cost) == 0 for cost in cached_costs)
+        assert np.allclose(cached_costs, costs)
+        assert np.allclose(cached_W, W)
+
+def test_random_streams_are_not_cached(tmpdir):
+    cache_dir = str(tmpdir)
+
+    def run(cache_dir=None):
+        data_x = shared(np.asarray(np.random.RandomState(0).rand(10, 5), dtype=config.floatX), name='data_x')
+        rng = RandomStreams(1234)
+        index = T.lscalar('index')
+        compile_fn = lambda: function([index], T.sum(data_x[index] * rng.binomial(size=(5,), p=0.5, dtype=config.floatX)))
+        if cache_dir is None:
+            fn = compile_fn()
+        else:
+            named_vars = OrderedDict(('rng_%i' % i, su[0]) for i, su in enumerate(rng.state_updates))
+            fn = FunctionCache(cache_dir).get_or_compile('dropout', (), compile_fn, named_vars, [data_x])
+        return [fn(i) for i in range(10)]
+
+    outputs = run()
+    assert np.allclose(run(cache_dir), outputs)
+    assert np.allclose(run(cache_dir), outputs)
+    assert not any(name.endswith('.pkl') for name in os.listdir(cache_dir))
+
+# pretraining costs, fine tuning costs and test class counts of a small network
+def run_network(cache_dir=None, dropout=False, denoising=False):
+    np.random.seed(0)
+    sae = StackedAutoencoder(in_size=20, hidden_size=[8, 6], out_size=3, batch_size=10, corruption_levels=[0.1, 0.2],
+                             dropout=dropout, drop_rates=[0.1, 0.1, 0.1], function_cache_dir=cache_dir)
+
+    rng = np.random.RandomState(1)
+    sets = []
+    for n in [60, 20, 50]:
+        x = shared(np.asarray(rng.rand(n, 20), dtype=config.floatX), borrow=True)
+        y = shared(np.asarray(np.arange(n) % 3, dtype=config.floatX), borrow=True)
+        sets.append((x, T.cast(y, 'int32')))
+
+    pre_train_fns = sae.greedy_pre_training(sets[0][0], batch_size=10, pre_lr=0.1, denoising=denoising)
+    pre_costs = [pre_train_fns[i](index=b) for i in range(2) for b in range(6)]
+    fine_tune_fn, valid_score = sae.fine_tuning(sets, batch_size=10, fine_lr=0.1)
+    fine_costs = [fine_tune_fn(b) for b in range(6)]
+    error, class_errors, class_counts = sae.get_evaluation_fn('test', sets[2][0], sets[2][1], chunk_size=20)()
+    return pre_costs, fine_costs, valid_score(), error, class_counts
+
+@pytest.mark.parametrize('dropout,denoising', [(False, False), (True, True)])
+def test_cached_network_matches_compiled(tmpdir, dropout, denoising):
+    compiled = run_network(dropout=dropout, denoising=denoising)
+    assert list(compiled[-1]) == [17, 17, 16]
+
+    #the first run stores the functions, the second one loads them
+    for run in range(2):
+        cached = run_network(str(tmpdir), dropout, denoising)
+        for cached_values, values in zip(cached, compiled):
+            assert np.allclose(cached_values, values)
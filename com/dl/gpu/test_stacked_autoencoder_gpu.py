@@ -0,0 +1,40 @@
+__author__ = 'Thushan Ganegedara'
+
+import numpy as np
+import pytest
+
+theano = pytest.importorskip('theano')
+from theano import config, shared
+import theano.tensor as T
+
+from StackedAutoencoderGPU import StackedAutoencoder
+
+def make_datasets(n_inputs=20, n_outputs=3):
+    rng = np.random.RandomState(1)
+    sets = []
+    for n in [60, 20, 20]:
+        x = shared(np.asarray(rng.rand(n, n_inputs), dtype=config.floatX), borrow=True)
+        y = shared(np.asarray(np.arange(n) % n_outputs, dtype=config.floatX), borrow=True)
+        sets.append((x, T.cast(y, 'int32')))
+    return sets
+
+def make_model(dropout):
+    np.random.seed(0)
+    return StackedAutoencoder(in_size=20, hidden_size=[8, 6], out_size=3, batch_size=10, corruption_levels=[0.1, 0.2],
+                              dropout=dropout, drop_rates=[0.1, 0.1, 0.1])
+
+# pretraining from the materialized layer inputs builds the dropout and corruption graphs of a layer on its
+# input variable, so the compiled functions do not depend on the network input
+@pytest.mark.parametrize('dropout,denoising', [(True, False), (False, True), (True, True)])
+@pytest.mark.parametrize('in_memory', [True, False])
+def test_materialize(tmpdir, dropout, denoising, in_memory):
+    sae = make_model(dropout)
+    thetas = [theta.get_value() for theta in sae.thetas]
+    materialize_dir = None if in_memory else str(tmpdir)
+
+    sae.train_model(datasets=make_datasets(), pre_epochs=2, fine_epochs=1, batch_size=10, denoising=denoising,
+                    pre_plateau_tol=None, materialize=True, materialize_dir=materialize_dir)
+
+    for theta, value in zip(sae.thetas, thetas):
+        assert np.all(np.isfinite(theta.get_value()))
+    assert any(not np.allclose(theta.get_value(), value) for theta, value in zip(sae.thetas, thetas))
@@ -58,6 +58,10 @@ def tile_raster_images(X, img_shape, tile_shape, tile_spacing=(0, 0),
     assert len(tile_shape) == 2
     assert len(tile_spacing) == 2
 
+    img_shape = [int(ishp) for ishp in img_shape]
+    tile_shape = [int(tshp) for tshp in tile_shape]
+    tile_spacing = [int(tsp) for tsp in tile_spacing]
+
     # The expression below can be re-written in a more C style as
     # follows :
     #
@@ -75,11 +79,11 @@ def tile_raster_images(X, img_shape, tile_shape, tile_spacing=(0, 0),
         assert len(X) == 4
         # Create an output numpy ndarray to store the image
         if output_pixel_vals:
-            out_array = numpy.zeros((out_shape[0], out_shape[1], 4),
-                                    dtype='uint8')
+            dt = 'uint8'
         else:
-            out_array = numpy.zeros((out_shape[0], out_shape[1], 4),
-                                    dtype=X.dtype)
+            dt = numpy.result_type(*[numpy.asarray(x).dtype
+                                     for x in X if x is not None])
+        out_array = numpy.empty((out_shape[0], out_shape[1], 4), dtype=dt)
 
         #colors default to 0, alpha defaults to 1 (opaque)
         if output_pixel_vals:
@@ -89,53 +93,73 @@ def tile_raster_images(X, img_shape, tile_shape, tile_spacing=(0, 0),
 
         for i in xrange(4):
             if X[i] is None:
-                # if channel is None, fill it with zeros of the correct
-                # dtype
-                dt = out_array.dtype
-                if output_pixel_vals:
-                    dt = 'uint8'
-                out_array[:, :, i] = numpy.zeros(
-                    out_shape,
-                    dtype=dt
-                ) + channel_defaults[i]
+                # if channel is None, fill it with the default value
+                out_array[:, :, i] = channel_defaults[i]
             else:
-                # use a recurrent call to compute the channel and store it
-                # in the output
-                out_array[:, :, i] = tile_raster_images(
+                # the tiles of the channel are written directly in to its
+                # (strided) plane of the output
+                tile_raster_channel(
                     X[i], img_shape, tile_shape, tile_spacing,
-                    scale_rows_to_unit_interval, output_pixel_vals)
+                    scale_rows_to_unit_interval, output_pixel_vals,
+                    out_array[:, :, i])
         return out_array
 
     else:
         # if we are dealing with only one channel
-        H, W = img_shape
-        Hs, Ws = tile_spacing
+        X = numpy.asarray(X)
 
         # generate a matrix to store the output
         dt = X.dtype
         if output_pixel_vals:
             dt = 'uint8'
-        out_array = numpy.zeros(out_shape, dtype=dt)
-
-        for tile_row in xrange(tile_shape[0]):
-            for tile_col in xrange(tile_shape[1]):
-                if tile_row * tile_shape[1] + tile_col < X.shape[0]:
-                    this_x = X[tile_row * tile_shape[1] + tile_col]
-                    if scale_rows_to_unit_interval:
-                        # if we should scale values to be between 0 and 1
-                        # do this by calling the `scale_to_unit_interval`
-                        # function
-                        this_img = scale_to_unit_interval(
-                            this_x.reshape(img_shape))
-                    else:
-                        this_img = this_x.reshape(img_shape)
-                    # add the slice to the corresponding position in the
-                    # output array
-                    c = 1
-                    if output_pixel_vals:
-                        c = 255
-                    out_array[
-                        tile_row * (H + Hs): tile_row * (H + Hs) + H,
-                        tile_col * (W + Ws): tile_col * (W + Ws) + W
-                    ] = this_img * c
-        return out_array
\ No newline at end of file
+        out_array = numpy.empty(out_shape, dtype=dt)
+
+        tile_raster_channel(X, img_shape, tile_shape, tile_spacing,
+                            scale_rows_to_unit_interval, output_pixel_vals,
+                            out_array)
+        return out_array
+
+
+def tile_raster_channel(X, img_shape, tile_shape, tile_spacing,
+                        scale_rows_to_unit_interval, output_pixel_vals,
+                        out_array):
+    """
+    Write the tiles of one channel in to out_array (a 2-D array or view of
+    the output shape), see ``tile_raster_images``.
+
+    All rows are scaled at once, and out_array is viewed (without a copy)
+    as a (rows, cols, H, W) array of tiles with strides that skip the
+    spacing, so the whole mosaic is written with one strided assignment.
+    """
+    X = numpy.asarray(X)
+    H, W = img_shape
+    Hs, Ws = tile_spacing
+    rows, cols = tile_shape
+    n = min(X.shape[0], rows * cols)
+
+    # spacing and missing tiles are 0
+    out_array[...] = 0
+
+    if scale_rows_to_unit_interval:
+        # the same as calling `scale_to_unit_interval` on every row
+        dt = X.dtype if X.dtype.kind == 'f' else numpy.float64
+        tiles = numpy.array(X[:n], dtype=dt)
+        tiles -= tiles.min(axis=1)[:, None]
+        tiles *= 1.0 / (tiles.max(axis=1) + 1e-8)[:, None]
+    else:
+        tiles = X[:n]
+    if output_pixel_vals:
+        tiles = tiles * 255
+    tiles = tiles.reshape((n, H, W))
+
+    s0, s1 = out_array.strides
+    tile_view = numpy.lib.stride_tricks.as_strided(
+        out_array, shape=(rows, cols, H, W),
+        strides=(s0 * (H + Hs), s1 * (W + Ws), s0, s1))
+
+    # full rows of tiles, then the remaining tiles of the last row
+    full_rows = n // cols
+    tile_view[:full_rows] = tiles[:full_rows * cols].reshape(
+        (full_rows, cols, H, W))
+    if n > full_rows * cols:
+        tile_view[full_rows, :n - full_rows * cols] = tiles[full_rows * cols:]
@@ -0,0 +1,27 @@
+__author__ = 'Thushan Ganegedara'
+
+import os
+
+import pytest
+
+# The scripts are run from their own directories and import their helpers flat (like utils.py), so these
+# modules have a copy in every directory that uses them. The copies have to stay the same
+ROOT = os.path.dirname(os.path.abspath(__file__))
+COPIES = {
+    'BinaryDataset.py': ['.', 'com/dl/gpu', 'com/dl/cifar-10', 'com/dl/faces-classif'],
+    'Checkpointer.py': ['.', 'com/dl/gpu'],
+    'MaxActivation.py': ['com/dl/gpu', 'com/dl/faces', 'com/dl/faces-classif', 'com/dl/cifar-10'],
+    'TheanoOptimizers.py': ['com/dl/gpu', 'alex', 'DeepReinforcementLearning'],
+    'utils.py': ['com/dl/gpu', 'com/dl/faces', 'com/dl/faces-classif', 'com/dl/cifar-10'],
+}
+
+def read(dir_name, file_name):
+    with open(os.path.join(ROOT, dir_name, file_name), 'rb') as f:
+        return f.read()
+
+@pytest.mark.parametrize('file_name', sorted(COPIES))
+def test_copies_are_identical(file_name):
+    dirs = COPIES[file_name]
+    first = read(dirs[0], file_name)
+    for dir_name in dirs[1:]:
+        assert read(dir_name, file_name) == first, '%s/%s differs from %s/%s' % (dir_name, file_name, dirs[0], file_name)
@@ -0,0 +1,61 @@
+__author__ = 'Thushan Ganegedara'
+
+import numpy as np
+from scipy import optimize
+
+import SparseAutoencoder as sae_module
+from SparseAutoencoder import SparseAutoencoder
+
+# scipy's L-BFGS-B (setulb) only accepts float64 gradients, older versions fail with
+# "failed to initialize intent(inout) array -- expected elsize=8 but got 4" otherwise.
+# minimize is wrapped so the check fails on any scipy version if a float32 gradient is handed over
+def check_float64_minimize(monkeypatch):
+    grad_dtypes = []
+    minimize = optimize.minimize
+
+    def checked_minimize(fun, x0, args=(), **kwargs):
+        def checked_fun(theta, *fun_args):
+            err, grad = fun(theta, *fun_args)
+            grad_dtypes.append(grad.dtype)
+            return err, grad
+        return minimize(checked_fun, x0, args=args, **kwargs)
+
+    monkeypatch.setattr(sae_module.optimize, 'minimize', checked_minimize)
+    return grad_dtypes
+
+def make_data(n_inputs=20, n_examples=50):
+    rng = np.random.RandomState(0)
+    return rng.rand(n_inputs, n_examples)
+
+def test_back_prop_default_dtype(monkeypatch):
+    grad_dtypes = check_float64_minimize(monkeypatch)
+    np.random.seed(0)
+    sa = SparseAutoencoder(20, 5, make_data())
+    assert sa.dtype == np.float32
+    theta = sa.params.theta.copy()
+
+    sa.back_prop(iter=2)
+
+    assert len(grad_dtypes) > 0 and all(dtype == np.float64 for dtype in grad_dtypes)
+    assert sa.params.theta.dtype == np.float32
+    assert not np.array_equal(theta, sa.params.theta)
+
+def test_back_prop_sample_major(monkeypatch, tmpdir):
+    grad_dtypes = check_float64_minimize(monkeypatch)
+    path = str(tmpdir.join('X.npy'))
+    np.save(path, np.asarray(make_data().T, dtype=np.float32))
+    np.random.seed(0)
+    sa = SparseAutoencoder(20, 5, path, chunk_size=16)
+
+    sa.back_prop(iter=2)
+
+    assert len(grad_dtypes) > 0 and all(dtype == np.float64 for dtype in grad_dtypes)
+
+def test_back_prop_parallel(monkeypatch):
+    grad_dtypes = check_float64_minimize(monkeypatch)
+    np.random.seed(0)
+    sa = SparseAutoencoder(20, 5, make_data())
+
+    sa.back_prop(iter=2, n_procs=2)
+
+    assert len(grad_dtypes) > 0 and all(dtype == np.float64 for dtype in grad_dtypes)